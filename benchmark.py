@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+
+"""
+Offline micro-benchmarks for the hot paths of the importer.
+Usage: python benchmark.py <benchmark> [<jira project> <export.xml> ...]
+"""
+
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from cache import ProjectCache
+from importer import Importer, Options
+from model import Comment, Issue, LINK_KINDS
+import project as project_module
+from dateutil.parser import parse
+from project import Project
+from reader import add_xml_files_to_project, iter_xml_items
+from references import ReferenceRewriter, PlaceholderResolver, JIRA_BROWSE_URL
+
+
+def deep_sizeof(obj, seen=None):
+  """
+  Returns the number of bytes held by an object graph, counting every object once
+  """
+  if seen is None:
+    seen = set()
+  if id(obj) in seen:
+    return 0
+  seen.add(id(obj))
+  size = sys.getsizeof(obj)
+  if isinstance(obj, dict):
+    for key, value in obj.iteritems():
+      size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+  elif isinstance(obj, (list, tuple, set)):
+    for value in obj:
+      size += deep_sizeof(value, seen)
+  elif hasattr(obj, '__slots__'):
+    for name in obj.__slots__:
+      size += deep_sizeof(getattr(obj, name, None), seen)
+  return size
+
+
+def _copy(s):
+  # bl: lxml hands out a new string for every element text, which the dicts used to keep
+  return s[:1] + s[1:]
+
+
+def _legacy_issue_dict(issue):
+  # bl: the per-issue dict Project built before the slotted model
+  legacy = {'title': issue.title,
+    'key': issue.key,
+    'body': issue.body,
+    'created_at': issue.created_at,
+    'closed_at': issue.closed_at,
+    'updated_at': issue.updated_at,
+    'closed': issue.closed,
+    'labels': [_copy(label) for label in issue.labels],
+    'comments': [{'created_at': comment.created_at, 'body': comment.body} for comment in issue.comments]
+  }
+  for kind, prefix in LINK_KINDS:
+    legacy[kind] = [link.key for link in issue.links if link.kind == kind]
+  if issue.milestone_name is not None:
+    legacy['milestone_name'] = _copy(issue.milestone_name)
+  if not legacy['closed_at']:
+    del legacy['closed_at']
+  return legacy
+
+
+def bench_model_memory(project, file_names):
+  issues = project.get_issues()
+  legacy = [_legacy_issue_dict(issue) for issue in issues]
+  # bl: the bodies are the same strings in both, so only count the containers around them
+  shared = set()
+  for issue in issues:
+    shared.add(id(issue.body))
+    for comment in issue.comments:
+      shared.add(id(comment.body))
+  model_bytes = deep_sizeof(issues, set(shared))
+  legacy_bytes = deep_sizeof(legacy, set(shared))
+  print 'model-memory: {} issues'.format(len(issues))
+  print '  dict issues:    {:>12} bytes'.format(legacy_bytes)
+  print '  slotted issues: {:>12} bytes ({:.1f}%)'.format(model_bytes, 100.0 * model_bytes / max(legacy_bytes, 1))
+
+
+def _timed(fn, texts, repeat=3):
+  best = None
+  for i in range(repeat):
+    start = time.time()
+    for text in texts:
+      fn(text)
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+def _project_texts(project):
+  texts = []
+  for issue in project.get_issues():
+    texts.append(issue.body)
+    texts.extend(comment.body for comment in issue.comments)
+    texts.extend(link.key for link in issue.links)
+  return texts
+
+
+def _legacy_reference_rewrite(project_name, jira_repos):
+  # bl: the pattern dicts Importer went through before the compiled ReferenceRewriter
+  own_patterns = {
+    JIRA_BROWSE_URL + project_name + r'-(\d+)': r'\1',
+    project_name + r'-(\d+)': r'\1'
+  }
+  url_patterns = {}
+  for jira_key, repo in jira_repos.iteritems():
+    url_patterns[JIRA_BROWSE_URL + jira_key + r'-(\d+)'] = r'https://github.com/SocialStrata/' + repo + r'/issues/\1'
+    url_patterns[jira_key + r'-(\d+)'] = r'https://github.com/SocialStrata/' + repo + r'/issues/\1'
+
+  def rewrite(text):
+    result = text
+    for pattern, replacement in own_patterns.iteritems():
+      result = re.sub(pattern, Importer._PLACEHOLDER_PREFIX + replacement + Importer._PLACEHOLDER_SUFFIX, result)
+    for pattern, replacement in url_patterns.iteritems():
+      result = re.sub(pattern, replacement, result)
+    return result
+  return rewrite
+
+
+def bench_references(project, file_names):
+  texts = _project_texts(project)
+  jira_repos = Importer._JIRA_PROJECT_REPOS
+  size = sum(len(text) for text in texts)
+  legacy = _timed(_legacy_reference_rewrite(project.name, jira_repos), texts)
+  rewriter = ReferenceRewriter('SocialStrata', jira_repos, project.name, Importer._PLACEHOLDER_PREFIX, Importer._PLACEHOLDER_SUFFIX)
+  compiled = _timed(rewriter.rewrite, texts)
+  print 'references: {} texts, {} characters'.format(len(texts), size)
+  print '  pattern dicts:     {:8.3f}s ({:10.0f} texts/s)'.format(legacy, len(texts) / max(legacy, 1e-9))
+  print '  ReferenceRewriter: {:8.3f}s ({:10.0f} texts/s)'.format(compiled, len(texts) / max(compiled, 1e-9))
+
+
+# bl: the hand-copied re.sub chain that post-processing ran before the PlaceholderResolver
+_LEGACY_PLACEHOLDER_SUBS = [
+  (Importer._PLACEHOLDER_PREFIX + r'(\d+)' + Importer._PLACEHOLDER_SUFFIX, r'#\1'),
+  (r'<a href=\"https://github\.com/SocialStrata/crowdstack/issues/[0-9]+(.*?)".*?>(<del>)?(#|TUR-|HLA-|https://github.com/SocialStrata/crowdstack/issues/|SocialStrata/crowdstack#)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/crowdstack#\4'),
+  (r'<a href=\"https://github\.com/SocialStrata/eve/issues/[0-9]+(.*?)".*?>(<del>)?(#|https://github.com/SocialStrata/eve/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/eve#\4'),
+  (r'<a href=\"https://github\.com/SocialStrata/operations/issues/[0-9]+(.*?)".*?>(<del>)?(#|https://github.com/SocialStrata/operations/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/operations#\4'),
+  (r'<a href=\"https://github\.com/SocialStrata/web-sites/issues/[0-9]+(.*?)".*?>(<del>)?(#|https://github.com/SocialStrata/web-sites/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/web-sites#\4'),
+  (r'<a href=\"https://github\.com/SocialStrata/right-starts/issues/[0-9]+(.*?)".*?>(<del>)?(#|https://github.com/SocialStrata/right-starts/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/right-starts#\4'),
+  (r'<a href=\"https://github\.com/SocialStrata/customer-service/issues/[0-9]+(.*?)".*?>(<del>)?(#|https://github.com/SocialStrata/customer-service/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/customer-service#\4'),
+  (r'<a href=\"https://github\.com/SocialStrata/hoodo/issues/[0-9]+(.*?)".*?>(<del>)?(#|https://github.com/SocialStrata/hoodo/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/hoodo#\4'),
+  (r'<a href=\"https://hub\.socialstrata\.com/jira/browse/#[0-9]+(.*?)".*?>(<del>)?(#|https://hub.socialstrata.com/jira/browse/#)([0-9]+)(.*?)(</del>)?</a>', r'#\4'),
+  (r'<a href=\"https://hub\.socialstrata\.com/jira/browse/https://github\.com/SocialStrata/crowdstack/issues/[0-9]+(.*?)".*?>(<del>)?(#|TUR-|HLA-|https://github.com/SocialStrata/crowdstack/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/crowdstack#\4'),
+  (r'<a href=\"https://hub\.socialstrata\.com/jira/browse/https://github\.com/SocialStrata/eve/issues/[0-9]+(.*?)".*?>(<del>)?(#|TUR-|HLA-|https://github.com/SocialStrata/eve/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/eve#\4'),
+  (r'<a href=\"https://hub\.socialstrata\.com/jira/browse/#[0-9]+(.*?)".*?>(<del>)?(#|TUR-|HLA-)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/crowdstack#\4'),
+  (r'>https://hub\.socialstrata\.com/jira/browse/(#[0-9]+)</a>', r'>\1</a>'),
+  (r'(TUR|HLA)-([0-9]+)', r'SocialStrata/crowdstack#\2')
+]
+
+
+def _legacy_placeholder_resolve(text):
+  for pattern, replacement in _LEGACY_PLACEHOLDER_SUBS:
+    text = re.sub(pattern, replacement, text)
+  return text
+
+
+# bl: texts the resolver must turn into the expected ones, e.g. links that must not be merged with later ones
+_PLACEHOLDER_CASES = (
+  ('see <a href="https://github.com/SocialStrata/eve/issues/5">other text</a> and keep this <b>bold</b> then '
+   '<a href="https://github.com/SocialStrata/eve/issues/6">#6</a> end',
+   'see <a href="https://github.com/SocialStrata/eve/issues/5">other text</a> and keep this <b>bold</b> then SocialStrata/eve#6 end'),
+)
+
+
+def bench_post_process(project, file_names):
+  jira_repos = Importer._JIRA_PROJECT_REPOS
+  rewriter = ReferenceRewriter('SocialStrata', jira_repos, project.name, Importer._PLACEHOLDER_PREFIX, Importer._PLACEHOLDER_SUFFIX)
+  # bl: post-processing sees the texts as they were imported
+  texts = [rewriter.rewrite(text) for text in _project_texts(project)]
+  untouched = sum(1 for text in texts if _legacy_placeholder_resolve(text) == text)
+  legacy = _timed(_legacy_placeholder_resolve, texts)
+  resolver = PlaceholderResolver('SocialStrata', set(jira_repos.itervalues()), Importer._LEGACY_JIRA_KEYS,
+                                 Importer._PLACEHOLDER_PREFIX, Importer._PLACEHOLDER_SUFFIX)
+  for text, expected in _PLACEHOLDER_CASES:
+    if resolver.resolve(text) != expected:
+      raise RuntimeError('PlaceholderResolver rewrote {!r} into {!r}'.format(text, resolver.resolve(text)))
+  fused = _timed(resolver.resolve, texts)
+  print 'post-process: {} texts, {} without anything to rewrite'.format(len(texts), untouched)
+  print '  re.sub chain:        {:8.3f}s ({:8.1f}us/text)'.format(legacy, 1e6 * legacy / max(len(texts), 1))
+  print '  PlaceholderResolver: {:8.3f}s ({:8.1f}us/text)'.format(fused, 1e6 * fused / max(len(texts), 1))
+
+
+def _issue_payloads(project):
+  return [(issue.key, issue.to_payload(), [comment.to_payload() for comment in issue.comments],
+           [(link.kind, link.key) for link in issue.links]) for issue in project.get_issues()]
+
+
+def bench_project_cache(project, file_names):
+  directory = tempfile.mkdtemp()
+  try:
+    cache = ProjectCache(directory)
+    start = time.time()
+    parsed = Project(project.name)
+    add_xml_files_to_project(parsed, file_names)
+    parse = time.time() - start
+    start = time.time()
+    key = cache.key(project.name, file_names)
+    fingerprints = time.time() - start
+    start = time.time()
+    cache.store(parsed, key)
+    store = time.time() - start
+    start = time.time()
+    loaded = Project(project.name)
+    cache.load(loaded, key)
+    load = time.time() - start
+    # bl: a cached project is always merged in JIRA number order
+    if _issue_payloads(loaded) != sorted(_issue_payloads(parsed), key=lambda payload: int(payload[0].split('-', 1)[1])):
+      raise RuntimeError('The cached project differs from the parsed one')
+    print 'project-cache: {} issues'.format(len(parsed.get_issues()))
+    print '  parse exports:    {:8.3f}s'.format(parse)
+    print '  fingerprint:      {:8.3f}s'.format(fingerprints)
+    print '  store cache:      {:8.3f}s'.format(store)
+    print '  load cache:       {:8.3f}s ({:.1f}% of the parse)'.format(load, 100.0 * load / max(parse, 1e-9))
+  finally:
+    shutil.rmtree(directory)
+
+
+def _legacy_trim_payload_size(importer, issue, comments):
+  # bl: the Importer.trim_payload_size that encoded the whole payload again for every comment it tried
+  comment_to_strip_from = None
+  num_comments = len(comments)
+  for i in range(num_comments):
+    if len(comments[i].body) > 65536:
+      comment_to_strip_from = i
+      break
+  issue_payload = issue.to_payload()
+  comment_payloads = [comment.to_payload() for comment in comments]
+  for i in range(num_comments, 0, -1):
+    importer.issue_data = {'issue': issue_payload, 'comments': comment_payloads[0:i]}
+    if len(json.dumps(importer.issue_data)) <= 1048576:
+      if i < num_comments:
+        comment_to_strip_from = min(comment_to_strip_from, i)
+      break
+  importer.issue_data = {'issue': issue_payload, 'comments': comment_payloads[0: comment_to_strip_from if comment_to_strip_from is not None else num_comments]}
+  if comment_to_strip_from is not None:
+    for i in range(len(comments)-1, comment_to_strip_from-1, -1):
+      importer.comments_to_append.insert(0, comments[i])
+      del comments[i]
+
+
+def _many_comments_issues():
+  # bl: issues with hundreds of comments, the largest of them over 1MB with one comment over 64KB
+  issues = []
+  for count, size in ((100, 2000), (300, 3000), (600, 2500), (1000, 1500)):
+    issue = Issue('BENCH-' + str(count), 'Issue with {} comments'.format(count), 'body', '2020-03-05T22:21:00+07:00', '2020-03-10T17:31:32+00:00', False)
+    for i in range(count):
+      issue.comments.append(Comment('2020-03-06T00:00:00+00:00', ('comment %d ' % i) * (size / 10)))
+    issues.append(issue)
+  issues[-1].comments[len(issues[-1].comments) / 2].body = 'X' * 70000
+  return issues
+
+
+def _trim_all(trim, importer, issues):
+  results = []
+  stdout = sys.stdout
+  sys.stdout = open(os.devnull, 'w')
+  try:
+    for issue in issues:
+      comments = list(issue.comments)
+      importer.comments_to_append = []
+      trim(importer, issue, comments)
+      results.append((json.dumps(importer.issue_data), comments, importer.comments_to_append))
+  finally:
+    sys.stdout.close()
+    sys.stdout = stdout
+  return results
+
+
+def bench_payload_size(project, file_names):
+  issues = project.get_issues() + _many_comments_issues()
+  importer = Importer(Options(user='', account='SocialStrata', repo='bench', token='', first_issue_id=1, last_issue_id=1), project)
+  if _trim_all(_legacy_trim_payload_size, importer, issues) != _trim_all(Importer.trim_payload_size, importer, issues):
+    raise RuntimeError('trim_payload_size differs from the legacy implementation')
+  comments = sum(len(issue.comments) for issue in issues)
+  legacy = _timed(lambda issue: _trim_all(_legacy_trim_payload_size, importer, [issue]), issues)
+  linear = _timed(lambda issue: _trim_all(Importer.trim_payload_size, importer, [issue]), issues)
+  print 'payload-size: {} issues, {} comments'.format(len(issues), comments)
+  print '  encode per prefix: {:8.3f}s'.format(legacy)
+  print '  running totals:    {:8.3f}s'.format(linear)
+
+
+def _export_timestamps(file_names):
+  timestamps = []
+  for file_name in file_names:
+    for item in iter_xml_items(file_name):
+      timestamps.extend(element.text for element in item.iterchildren('created', 'updated', 'resolved'))
+      try:
+        timestamps.extend(comment.get('created') for comment in item.comments.comment)
+      except AttributeError:
+        pass
+  return timestamps
+
+
+def bench_timestamps(project, file_names):
+  timestamps = _export_timestamps(file_names)
+  legacy = lambda timestamp: parse(timestamp).isoformat()
+  if [legacy(timestamp) for timestamp in timestamps] != [project_module.convert_jira_timestamp(timestamp) for timestamp in timestamps]:
+    raise RuntimeError('convert_jira_timestamp differs from dateutil')
+  dateutil = _timed(legacy, timestamps)
+  cold = None
+  for i in range(3):
+    project_module._timestamps.clear()
+    elapsed = _timed(project_module.convert_jira_timestamp, timestamps, repeat=1)
+    cold = elapsed if cold is None else min(cold, elapsed)
+  warm = _timed(project_module.convert_jira_timestamp, timestamps)
+  print 'timestamps: {} timestamps, {} distinct'.format(len(timestamps), len(set(timestamps)))
+  print '  dateutil:               {:8.3f}s ({:8.2f}us/timestamp)'.format(dateutil, 1e6 * dateutil / max(len(timestamps), 1))
+  print '  JIRA format:            {:8.3f}s ({:8.2f}us/timestamp)'.format(cold, 1e6 * cold / max(len(timestamps), 1))
+  print '  JIRA format, memoized:  {:8.3f}s ({:8.2f}us/timestamp)'.format(warm, 1e6 * warm / max(len(timestamps), 1))
+
+
+BENCHMARKS = {
+  'model-memory': bench_model_memory,
+  'references': bench_references,
+  'post-process': bench_post_process,
+  'project-cache': bench_project_cache,
+  'payload-size': bench_payload_size,
+  'timestamps': bench_timestamps
+}
+
+
+def main(argv):
+  if len(argv) < 3 or argv[0] not in BENCHMARKS:
+    sys.exit(__doc__.strip() + '\nBenchmarks: ' + ', '.join(sorted(BENCHMARKS)))
+  project = Project(argv[1])
+  add_xml_files_to_project(project, argv[2:])
+  BENCHMARKS[argv[0]](project, argv[2:])
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
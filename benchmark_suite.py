@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+Offline benchmark suite over a synthetic JIRA export.
+Times ingestion, relationship conversion, reference rewriting and payload sizing,
+records the peak memory of the process after each stage and writes the results as JSON, so runs of different versions can be compared.
+Usage: python benchmark_suite.py [options]
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from benchmark import deep_sizeof
+from importer import Importer, Options
+from project import Project
+from reader import add_xml_files_to_project
+from synthetic_export import generate_exports, add_settings_arguments, settings_from_arguments
+
+
+def _lifetime_max_rss_kb():
+  # bl: the peak of the whole process up to now, not of a single stage, since the stages build on each other's state
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _version():
+  try:
+    return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   stderr=open(os.devnull, 'w')).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+class _Stages:
+  """
+  Collects the timings of the benchmark stages
+  """
+
+  def __init__(self):
+    self.results = {}
+
+  def run(self, name, fn, items, unit):
+    start = time.time()
+    fn()
+    elapsed = time.time() - start
+    self.results[name] = {'seconds': round(elapsed, 4), unit: items,
+                          unit + '_per_second': round(items / max(elapsed, 1e-9), 1),
+                          'lifetime_max_rss_kb': _lifetime_max_rss_kb()}
+    print >> sys.stderr, '{:<14} {:8.3f}s {:>10} {} ({:.0f}/s)'.format(name, elapsed, items, unit, items / max(elapsed, 1e-9))
+
+
+def _quiet(fn):
+  # bl: the importer reports every trimmed comment, which would be timed along
+  def run():
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+      fn()
+    finally:
+      sys.stdout.close()
+      sys.stdout = stdout
+  return run
+
+
+def run_suite(settings, directory):
+  stages = _Stages()
+  file_names = []
+  stages.run('generate', lambda: file_names.extend(generate_exports(directory, settings)), settings.issues, 'issues')
+  export_bytes = sum(os.path.getsize(file_name) for file_name in file_names)
+
+  project = Project(settings.project)
+  # bl: a single process, so Project.add_item itself is timed and its memory counted
+  stages.run('ingest', _quiet(lambda: add_xml_files_to_project(project, file_names, processes=1)), export_bytes, 'bytes')
+  issues = project.get_issues()
+  _quiet(project.merge_labels_and_components)()
+  model_bytes = deep_sizeof(issues)
+
+  importer = Importer(Options(user='', account='SocialStrata', repo='benchmark', token='', first_issue_id=1, last_issue_id=settings.issues,
+                              pre_resolve_references=True), project)
+  for milestone in project.get_milestones():
+    project.get_milestones()[milestone] = 1
+  for issue in issues:
+    if issue.milestone_name is not None:
+      issue.milestone = project.get_milestones()[issue.milestone_name]
+      issue.milestone_name = None
+
+  links = sum(len(issue.links) for issue in issues)
+
+  def convert_relationships():
+    for issue in issues:
+      importer.convert_relationships_to_comments(issue)
+  stages.run('relationships', convert_relationships, links, 'links')
+
+  texts = [issue.body for issue in issues] + [comment.body for issue in issues for comment in issue.comments]
+  text_bytes = sum(len(text) for text in texts)
+
+  def rewrite_references():
+    for issue in issues:
+      issue.body = importer._replace_jira_with_github_id(issue.body)
+      for comment in issue.comments:
+        comment.body = importer._replace_jira_with_github_id(comment.body)
+  stages.run('references', rewrite_references, text_bytes, 'characters')
+
+  def build_payloads():
+    for issue in issues:
+      importer.comments_to_append = []
+      importer.build_issue_data(issue, issue.comments)
+  stages.run('payloads', _quiet(build_payloads), len(issues), 'issues')
+
+  return {
+    'version': _version(),
+    'python': sys.version.split()[0],
+    'settings': settings._asdict(),
+    'export_bytes': export_bytes,
+    'issues': len(issues),
+    'comments': len(texts) - len(issues),
+    'model_bytes': model_bytes,
+    'stages': stages.results
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmarks the importer offline against a synthetic JIRA export.')
+  add_settings_arguments(parser)
+  parser.add_argument('--output', help='file to write the JSON results to instead of stdout')
+  parser.add_argument('--keep', help='directory to keep the generated export in')
+  args = parser.parse_args()
+
+  directory = args.keep or tempfile.mkdtemp()
+  try:
+    results = run_suite(settings_from_arguments(args), directory)
+  finally:
+    if not args.keep:
+      shutil.rmtree(directory)
+  output = json.dumps(results, indent=2, sort_keys=True)
+  if args.output:
+    with open(args.output, 'w') as f:
+      f.write(output + '\n')
+  else:
+    print output
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+from metrics import metrics
+from text import CHUNK_LENGTH, MAX_BODY_LENGTH
+
+# bl: stored bodies are written, read and rewritten this many bytes at a time
+_SEGMENT_SIZE = 1 << 20
+
+# bl: the blob files mapped for reading, by file name. a file is mapped again once it grew past the mapping
+_maps = {}
+_maps_lock = threading.Lock()
+
+
+def _mapped(file_name, end):
+  with _maps_lock:
+    data = _maps.get(file_name)
+    if data is None or len(data) < end:
+      with open(file_name, 'rb') as f:
+        data = _maps[file_name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return data
+
+
+class StoredBody(object):
+  """
+  Handle of a body spilled into a blob file of the body store: where its UTF-8 bytes are, how many characters it has
+  and how long it is as a JSON string without the quotes. A short header in front of it, e.g. of a chunk, is kept
+  in the handle. Handles are small and pickle by file name, so the processes of a migration can pass them around.
+  """
+  __slots__ = ('file_name', 'offset', 'size', 'length', 'json_length', 'prefix')
+
+  def __init__(self, file_name, offset, size, length, json_length, prefix=u''):
+    self.file_name = file_name
+    self.offset = offset
+    self.size = size
+    self.length = length
+    self.json_length = json_length
+    self.prefix = prefix
+
+  def __getstate__(self):
+    return tuple(getattr(self, name) for name in self.__slots__)
+
+  def __setstate__(self, state):
+    for name, value in zip(self.__slots__, state):
+      setattr(self, name, value)
+
+  def __len__(self):
+    return self.length
+
+  def with_prefix(self, prefix):
+    """
+    Returns a handle of the body with the prefix put in front
+    """
+    return StoredBody(self.file_name, self.offset, self.size, self.length + len(prefix),
+                      self.json_length + len(json.dumps(prefix)) - 2, prefix + self.prefix)
+
+  def _bytes(self, lines=False):
+    """
+    Yields the UTF-8 bytes of the prefix and the body in segments cut between two characters, or after line breaks with lines
+    """
+    if self.prefix:
+      yield self.prefix.encode('utf8')
+    start = self.offset
+    end = self.offset + self.size
+    data = _mapped(self.file_name, end)
+    while start < end:
+      stop = min(start + _SEGMENT_SIZE, end)
+      if stop < end and lines:
+        # bl: a line longer than a segment is taken as a whole
+        newline = data.rfind('\n', start, stop)
+        if newline < 0:
+          newline = data.find('\n', stop, end)
+        stop = newline + 1 if newline >= 0 else end
+      elif stop < end:
+        # bl: back to the first byte of a character, continuation bytes are 10xxxxxx
+        while 0x80 <= ord(data[stop]) < 0xC0:
+          stop -= 1
+      yield data[start:stop]
+      start = stop
+
+  def segments(self, lines=False):
+    for data in self._bytes(lines):
+      yield data.decode('utf8')
+
+  def text(self):
+    return u''.join(self.segments())
+
+  def sha1(self):
+    digest = hashlib.sha1()
+    for data in self._bytes():
+      digest.update(data)
+    return digest.hexdigest()
+
+  def json_segments(self):
+    for segment in self.segments():
+      yield json.dumps(segment)[1:-1]
+
+  def chunks(self, chunk_length=CHUNK_LENGTH):
+    """
+    Yields the text in chunks of chunk_length characters
+    """
+    pending = u''
+    for segment in self.segments():
+      pending += segment
+      start = 0
+      while len(pending) - start >= chunk_length:
+        yield pending[start:start + chunk_length]
+        start += chunk_length
+      pending = pending[start:]
+    if pending:
+      yield pending
+
+  def split(self, chunk_length=CHUNK_LENGTH):
+    """
+    Returns handles of the chunks of chunk_length characters the body is split into, found with one pass over its bytes
+    """
+    if self.prefix:
+      raise ValueError("Only bodies without a prefix are split")
+    handles = []
+    offset = self.offset
+    for chunk in self.chunks(chunk_length):
+      size = len(chunk.encode('utf8'))
+      handles.append(StoredBody(self.file_name, offset, size, len(chunk), len(json.dumps(chunk)) - 2))
+      offset += size
+    return handles
+
+
+class BodyStore:
+  """
+  Spills descriptions and comments longer than threshold characters into append-only blob files, which are
+  mapped into memory for reading, and hands out StoredBody handles in place of them. Chunking, hashing and sizing the
+  payloads of stored bodies goes through the mapped bytes a segment at a time, so the memory of a migration
+  stays bounded however big the pasted logs in its issues are. Each process appends to a blob file of its own
+  in the run directory, which is removed again by close.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.directory = None
+    self.threshold = MAX_BODY_LENGTH
+    self._owner = None
+    self._file = None
+    self._file_name = None
+    self._pid = None
+
+  def configure(self, directory, threshold=MAX_BODY_LENGTH):
+    """
+    Spills the bodies into a new run directory in directory. With None, all bodies are kept in memory.
+    """
+    self.close()
+    if directory is None:
+      return
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    self.directory = tempfile.mkdtemp(prefix='run-', dir=directory)
+    self.threshold = threshold
+    self._owner = os.getpid()
+
+  def store(self, text):
+    """
+    Returns a handle of the text if it is longer than threshold characters, the text otherwise
+    """
+    if self.directory is None or text is None or len(text) <= self.threshold:
+      return text
+    return self._append(text[i:i + _SEGMENT_SIZE] for i in xrange(0, len(text), _SEGMENT_SIZE))
+
+  def rewrite(self, body, rewrite):
+    """
+    Applies the rewrite to a stored body line by line and stores the result, returned as text if short enough.
+    Only for rewrites of references, which never span lines.
+    """
+    result = self._append(rewrite(segment) for segment in body.segments(lines=True))
+    return result.text() if len(result) <= self.threshold else result
+
+  def _append(self, segments):
+    with self._lock:
+      blob = self._blob()
+      offset = blob.tell()
+      length = 0
+      json_length = 0
+      for segment in segments:
+        blob.write(segment.encode('utf8') if isinstance(segment, unicode) else segment)
+        length += len(segment)
+        json_length += len(json.dumps(segment)) - 2
+      # bl: flushed right away, so the body can be mapped and read by any process
+      blob.flush()
+      size = blob.tell() - offset
+    metrics.add('bodies_stored')
+    metrics.add('body_store_bytes', size)
+    return StoredBody(self._file_name, offset, size, length, json_length)
+
+  def _blob(self):
+    # bl: processes started after the store was configured get a blob file of their own
+    if self._pid != os.getpid():
+      fd, self._file_name = tempfile.mkstemp(suffix='.blob', dir=self.directory)
+      self._file = os.fdopen(fd, 'wb')
+      self._pid = os.getpid()
+    return self._file
+
+  def close(self):
+    """
+    Closes the blob file of the process. The process that configured the store also removes the run directory.
+    """
+    if self._file is not None and self._pid == os.getpid():
+      self._file.close()
+    self._file = None
+    self._pid = None
+    if self.directory is not None and self._owner == os.getpid():
+      shutil.rmtree(self.directory, ignore_errors=True)
+    self.directory = None
+
+
+def text(body):
+  """
+  Returns the text of a body, reading it back if it was stored
+  """
+  return body.text() if isinstance(body, StoredBody) else body
+
+
+def text_chunks(body, chunk_length=CHUNK_LENGTH):
+  """
+  Yields the text of a body in chunks of chunk_length characters
+  """
+  if isinstance(body, StoredBody):
+    for chunk in body.chunks(chunk_length):
+      yield chunk
+  else:
+    for start in xrange(0, len(body), chunk_length):
+      yield body[start:start + chunk_length]
+
+
+def split_body(body, chunk_length=CHUNK_LENGTH):
+  """
+  Returns the chunks of chunk_length characters a body is split into, as handles if it was stored
+  """
+  if isinstance(body, StoredBody):
+    return body.split(chunk_length)
+  return list(text_chunks(body, chunk_length))
+
+
+def prepend(prefix, body):
+  return body.with_prefix(prefix) if isinstance(body, StoredBody) else prefix + body
+
+
+def body_sha1(body):
+  """
+  Returns the sha1 of the UTF-8 bytes of a body
+  """
+  return body.sha1() if isinstance(body, StoredBody) else hashlib.sha1(body.encode('utf8')).hexdigest()
+
+
+def json_sha1(values):
+  """
+  Returns the sha1 of json.dumps(values) for a list of values, encoding stored bodies a segment at a time
+  """
+  digest = hashlib.sha1('[')
+  for i, value in enumerate(values):
+    if i:
+      digest.update(', ')
+    if isinstance(value, StoredBody):
+      digest.update('"')
+      for segment in value.json_segments():
+        digest.update(segment)
+      digest.update('"')
+    else:
+      digest.update(json.dumps(value))
+  digest.update(']')
+  return digest.hexdigest()
+
+
+# bl: one store per migration, shared like the metrics. its processes inherit the configuration
+bodies = BodyStore()
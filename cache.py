@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+import cPickle
+import cStringIO
+import hashlib
+import os
+import zlib
+from body_store import StoredBody, bodies
+
+# bl: bump whenever Project extracts something different from the exports, so older caches are not used
+_FORMAT_VERSION = 1
+
+_MAGIC = 'jira-project-cache'
+
+
+def fingerprint(file_name):
+  """
+  Returns the size, mtime and sha1 of an export file
+  """
+  digest = hashlib.sha1()
+  with open(file_name, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), ''):
+      digest.update(block)
+  stat = os.stat(file_name)
+  return stat.st_size, stat.st_mtime, digest.hexdigest()
+
+
+def _stored_body_text(obj):
+  return obj.text() if isinstance(obj, StoredBody) else None
+
+
+class ProjectCache:
+  """
+  On-disk cache of the state Project extracts from a set of JIRA XML exports.
+  The state is stored as a zlib compressed pickle, keyed by the fingerprints of the export files,
+  so a changed export misses the cache and the project is parsed again.
+  """
+
+  def __init__(self, directory):
+    self.directory = directory
+
+  def key(self, project_name, file_names):
+    """
+    Returns the cache key of a project parsed from the given export files
+    """
+    key = hashlib.sha1(str(_FORMAT_VERSION) + project_name)
+    for file_name in file_names:
+      key.update(repr((os.path.basename(file_name),) + fingerprint(file_name)))
+    return key.hexdigest()
+
+  def _cache_file(self, project_name, key):
+    return os.path.join(self.directory, project_name + '-' + key + '.cache')
+
+  def load(self, project, key):
+    """
+    Merges the cached state into the project.
+    Returns False if there is no cache for the key.
+    """
+    cache_file = self._cache_file(project.name, key)
+    if not os.path.exists(cache_file):
+      return False
+    with open(cache_file, 'rb') as f:
+      data = f.read()
+    if not data.startswith(_MAGIC + '\n'):
+      print 'Ignoring corrupt project cache', cache_file
+      return False
+    unpickler = cPickle.Unpickler(cStringIO.StringIO(zlib.decompress(data[len(_MAGIC) + 1:])))
+    unpickler.persistent_load = bodies.store
+    project.merge_states([unpickler.load()])
+    print 'Loaded {} issues for {} from {}'.format(len(project.get_issues()), project.name, cache_file)
+    return True
+
+  def store(self, project, key):
+    """
+    Stores the state of a project that was just parsed, replacing the caches of older versions of its exports
+    """
+    if not os.path.isdir(self.directory):
+      os.makedirs(self.directory)
+    cache_file = self._cache_file(project.name, key)
+    output = cStringIO.StringIO()
+    pickler = cPickle.Pickler(output, 2)
+    # bl: the blob files of stored bodies only live as long as the run, so the cache keeps their texts,
+    # which are stored again when it is loaded
+    pickler.inst_persistent_id = _stored_body_text
+    pickler.dump(project.get_state())
+    data = zlib.compress(output.getvalue(), 6)
+    # bl: written next to the cache and renamed, so a crash never leaves a truncated cache behind
+    with open(cache_file + '.tmp', 'wb') as f:
+      f.write(_MAGIC + '\n')
+      f.write(data)
+    os.rename(cache_file + '.tmp', cache_file)
+    for name in os.listdir(self.directory):
+      stale = os.path.join(self.directory, name)
+      if name.startswith(project.name + '-') and name.endswith('.cache') and stale != cache_file:
+        os.remove(stale)
@@ -0,0 +1,518 @@
+#!/usr/bin/env python
+
+"""
+Local stand-in for the parts of the GitHub API the importer uses, for offline end-to-end load tests.
+Usage: python fake_github.py [options]
+"""
+
+import argparse
+import json
+import random
+import re
+import socket
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import namedtuple, defaultdict
+from SocketServer import ThreadingMixIn
+
+ServerSettings = namedtuple("ServerSettings", "latency import_delay forbidden_rate retry_after rate_limit max_payload max_body page_size seed")
+# bl: latency is added to every request and import_delay is how long an import stays pending, both in seconds.
+# forbidden_rate is the share of requests failed with a secondary rate limit 403 asking to retry after retry_after seconds.
+# rate_limit is the hourly request budget reported in the rate limit headers. max_payload and max_body are the
+# limits of GitHub for import payloads and issue and comment bodies, page_size the number of items per page
+ServerSettings.__new__.__defaults__ = (0.0, 0.5, 0.0, 1, 100000000, 1048576, 65536, 30, 1)
+
+_ROUTES = [
+  ('import', re.compile(r'^/repos/[^/]+/[^/]+/import/issues$')),
+  ('import_status', re.compile(r'^/repos/[^/]+/[^/]+/import/issues/(\d+)$')),
+  ('milestones', re.compile(r'^/repos/[^/]+/[^/]+/milestones$')),
+  ('labels', re.compile(r'^/repos/[^/]+/[^/]+/labels$')),
+  ('repo_comments', re.compile(r'^/repos/[^/]+/[^/]+/issues/comments$')),
+  ('comment', re.compile(r'^/repos/[^/]+/[^/]+/issues/comments/(\d+)$')),
+  ('issue_comments', re.compile(r'^/repos/[^/]+/[^/]+/issues/(\d+)/comments$')),
+  ('issue', re.compile(r'^/repos/[^/]+/[^/]+/issues/(\d+)$')),
+  ('graphql', re.compile(r'^/graphql$')),
+  ('stats', re.compile(r'^/_stats$'))
+]
+
+_DELETE_ISSUE = re.compile(r'(?:(\w+):\s*)?deleteIssue\(input:\s*\{\s*issueId:\s*"([^"]+)"')
+
+_ISSUE_BY_NUMBER = re.compile(r'(\w+):\s*issue\(number:\s*(\d+)\)')
+
+_UPDATE_BODY = re.compile(r'(\w+):\s*(updateIssue|updateIssueComment)\(input:\s*\{\s*id:\s*\$(\w+),\s*body:\s*\$(\w+)\s*\}\)')
+
+
+def _now_iso(now=None):
+  return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now if now is not None else time.time()))
+
+
+class _Response(object):
+  __slots__ = ('status', 'data', 'headers')
+
+  def __init__(self, status, data, headers=None):
+    self.status = status
+    self.data = data
+    self.headers = headers or {}
+
+
+class FakeGitHub:
+  """
+  The state of one fake GitHub repository and the API calls on it.
+  Imports are completed in submission order once they were pending for import_delay seconds,
+  and get the next issue number like on GitHub.
+  """
+
+  def __init__(self, settings, base_url):
+    self.settings = settings
+    self.base_url = base_url
+    self.repo_url = None
+    self._lock = threading.Lock()
+    self._random = random.Random(settings.seed)
+    self._imports = []
+    self._pending = []
+    self._issues = {}
+    self._node_ids = {}
+    self._comments = {}
+    self._milestones = {}
+    self._labels = set()
+    self._next_number = 1
+    self._next_comment = 1
+    self._window_start = time.time()
+    self._window_requests = 0
+    self.requests = defaultdict(int)
+    self.request_seconds = defaultdict(float)
+    self.bytes_received = 0
+    self.forbidden = 0
+
+  def stats(self):
+    with self._lock:
+      return {
+        'requests': sum(self.requests.itervalues()),
+        'requests_by_endpoint': dict(self.requests),
+        'seconds_by_endpoint': dict((key, round(value, 4)) for key, value in self.request_seconds.iteritems()),
+        'bytes_received': self.bytes_received,
+        'forbidden': self.forbidden,
+        'imports': len(self._imports),
+        'issues': sum(1 for issue in self._issues.itervalues() if not issue['deleted']),
+        'comments': len(self._comments)
+      }
+
+  def _rate_limit_headers(self):
+    now = time.time()
+    if now - self._window_start >= 3600:
+      self._window_start = now
+      self._window_requests = 0
+    self._window_requests += 1
+    return {'X-RateLimit-Limit': str(self.settings.rate_limit),
+            'X-RateLimit-Remaining': str(max(self.settings.rate_limit - self._window_requests, 0)),
+            'X-RateLimit-Reset': str(int(self._window_start + 3600))}
+
+  def handle(self, method, path, query, body):
+    start = time.time()
+    if self.settings.latency:
+      time.sleep(self.settings.latency)
+    route, args = 'unknown', ()
+    for name, pattern in _ROUTES:
+      match = pattern.match(path)
+      if match:
+        route, args = name, match.groups()
+        break
+    with self._lock:
+      key = method + ' ' + route
+      self.requests[key] += 1
+      self.bytes_received += len(body)
+      headers = self._rate_limit_headers()
+      if route != 'stats' and self.settings.forbidden_rate and self._random.random() < self.settings.forbidden_rate:
+        self.forbidden += 1
+        headers['Retry-After'] = str(self.settings.retry_after)
+        response = _Response(403, {'message': 'You have exceeded a secondary rate limit. Please wait a few minutes before you try again.'}, headers)
+      else:
+        handler = getattr(self, '_' + method.lower() + '_' + route, None)
+        if handler is None:
+          response = _Response(404, {'message': 'Not Found'})
+        else:
+          if self.repo_url is None and route != 'graphql':
+            self.repo_url = self.base_url + '/'.join(path.split('/')[:4])
+          data = json.loads(body) if body else None
+          response = handler(data, query, *args)
+        response.headers.update(headers)
+      self.request_seconds[key] += time.time() - start
+    return response
+
+  def _page(self, items, query, url):
+    page = int(query.get('page', ['1'])[0])
+    per_page = int(query.get('per_page', [str(self.settings.page_size)])[0])
+    headers = {}
+    if page * per_page < len(items):
+      headers['Link'] = '<{}?page={}&per_page={}>; rel="next"'.format(url, page + 1, per_page)
+    return items[(page - 1) * per_page:page * per_page], headers
+
+  def _complete_imports(self):
+    now = time.time()
+    while self._pending and self._pending[0]['ready_at'] <= now:
+      issue_import = self._pending.pop(0)
+      issue_data = issue_import['payload']['issue']
+      number = self._next_number
+      self._next_number += 1
+      node_id = 'I_' + str(number)
+      self._issues[number] = {'number': number, 'node_id': node_id, 'title': issue_data['title'], 'body': issue_data['body'],
+                              'created_at': issue_data.get('created_at') or _now_iso(now),
+                              'state': 'closed' if issue_data.get('closed') else 'open', 'labels': issue_data.get('labels', []),
+                              'milestone': issue_data.get('milestone'), 'comments': [], 'deleted': False}
+      self._node_ids[node_id] = number
+      for comment in issue_import['payload']['comments']:
+        self._add_comment(number, comment['body'], comment.get('created_at'))
+      issue_import['status'] = 'imported'
+      issue_import['issue_url'] = self.repo_url + '/issues/' + str(number)
+      issue_import['updated_at'] = _now_iso(now)
+
+  def _add_comment(self, number, body, created_at=None):
+    comment_id = self._next_comment
+    self._next_comment += 1
+    self._comments[comment_id] = {'id': comment_id, 'url': self.repo_url + '/issues/comments/' + str(comment_id),
+                                  'body': body, 'issue': number, 'created_at': created_at or _now_iso()}
+    self._issues[number]['comments'].append(comment_id)
+    return self._comments[comment_id]
+
+  def _status(self, issue_import):
+    status = dict((key, value) for key, value in issue_import.iteritems() if key not in ('payload', 'ready_at'))
+    return status
+
+  def _post_import(self, data, query):
+    if len(json.dumps(data)) > self.settings.max_payload:
+      return _Response(413, {'message': 'Payload too large'})
+    errors = []
+    if len(data['issue']['body']) > self.settings.max_body:
+      errors.append({'location': '/issue/body', 'resource': 'Issue', 'field': 'body', 'code': 'too_long'})
+    for i, comment in enumerate(data['comments']):
+      if len(comment['body']) > self.settings.max_body:
+        errors.append({'location': '/comments/{}/body'.format(i), 'resource': 'IssueComment', 'field': 'body', 'code': 'too_long'})
+    if errors:
+      return _Response(422, {'message': 'Validation Failed', 'errors': errors})
+    import_id = len(self._imports) + 1
+    now = time.time()
+    issue_import = {'id': import_id, 'status': 'pending', 'url': self.repo_url + '/import/issues/' + str(import_id),
+                    'import_issues_url': self.repo_url + '/import/issues', 'repository_url': self.repo_url,
+                    'created_at': _now_iso(now), 'updated_at': _now_iso(now),
+                    'payload': data, 'ready_at': now + self.settings.import_delay}
+    self._imports.append(issue_import)
+    self._pending.append(issue_import)
+    return _Response(202, self._status(issue_import))
+
+  def _get_import(self, data, query):
+    self._complete_imports()
+    since = query.get('since', [''])[0]
+    # bl: like GitHub, the listing leaves out the issue url and errors
+    statuses = [dict((key, value) for key, value in self._status(issue_import).iteritems() if key not in ('issue_url', 'errors'))
+                for issue_import in self._imports if issue_import['created_at'] >= since]
+    items, headers = self._page(statuses, query, self.repo_url + '/import/issues')
+    return _Response(200, items, headers)
+
+  def _get_import_status(self, data, query, import_id):
+    self._complete_imports()
+    import_id = int(import_id)
+    if import_id > len(self._imports):
+      return _Response(404, {'message': 'Not Found'})
+    return _Response(200, self._status(self._imports[import_id - 1]))
+
+  def _post_milestones(self, data, query):
+    if data['title'] in self._milestones:
+      return _Response(422, {'message': 'Validation Failed', 'errors': [{'resource': 'Milestone', 'code': 'already_exists', 'field': 'title'}]})
+    self._milestones[data['title']] = len(self._milestones) + 1
+    return _Response(201, {'number': self._milestones[data['title']], 'title': data['title']})
+
+  def _get_milestones(self, data, query):
+    milestones = [{'number': number, 'title': title, 'state': 'open'} for title, number in sorted(self._milestones.iteritems(), key=lambda item: item[1])]
+    items, headers = self._page(milestones, query, self.repo_url + '/milestones')
+    return _Response(200, items, headers)
+
+  def _post_labels(self, data, query):
+    if data['name'] in self._labels:
+      return _Response(422, {'message': 'Validation Failed', 'errors': [{'resource': 'Label', 'code': 'already_exists', 'field': 'name'}]})
+    self._labels.add(data['name'])
+    return _Response(201, {'name': data['name'], 'color': data.get('color')})
+
+  def _get_labels(self, data, query):
+    items, headers = self._page([{'name': name} for name in sorted(self._labels)], query, self.repo_url + '/labels')
+    return _Response(200, items, headers)
+
+  def _issue(self, number):
+    issue = self._issues.get(int(number))
+    if issue is None:
+      return None, _Response(404, {'message': 'Not Found'})
+    if issue['deleted']:
+      return None, _Response(410, {'message': 'This issue was deleted'})
+    return issue, None
+
+  def _issue_json(self, issue):
+    return dict((key, value) for key, value in issue.iteritems() if key not in ('comments', 'deleted'))
+
+  def _get_issue(self, data, query, number):
+    issue, error = self._issue(number)
+    return error or _Response(200, self._issue_json(issue))
+
+  def _patch_issue(self, data, query, number):
+    issue, error = self._issue(number)
+    if error:
+      return error
+    if 'body' in data and len(data['body']) > self.settings.max_body:
+      return _Response(422, {'message': 'Validation Failed', 'errors': [{'resource': 'Issue', 'field': 'body', 'code': 'too_long'}]})
+    issue.update((key, value) for key, value in data.iteritems() if key in ('title', 'body', 'state', 'labels', 'milestone'))
+    return _Response(200, self._issue_json(issue))
+
+  def _get_issue_comments(self, data, query, number):
+    issue, error = self._issue(number)
+    if error:
+      return error
+    comments = [self._comments[comment_id] for comment_id in issue['comments']]
+    items, headers = self._page(comments, query, self.repo_url + '/issues/' + str(number) + '/comments')
+    return _Response(200, items, headers)
+
+  def _post_issue_comments(self, data, query, number):
+    issue, error = self._issue(number)
+    if error:
+      return error
+    if len(data['body']) > self.settings.max_body:
+      return _Response(422, {'message': 'Validation Failed', 'errors': [{'resource': 'IssueComment', 'field': 'body', 'code': 'too_long'}]})
+    return _Response(201, self._add_comment(issue['number'], data['body']))
+
+  def _get_repo_comments(self, data, query):
+    comments = [self._comments[comment_id] for comment_id in sorted(self._comments)
+                if not self._issues[self._comments[comment_id]['issue']]['deleted']]
+    items, headers = self._page(comments, query, self.repo_url + '/issues/comments')
+    return _Response(200, items, headers)
+
+  def _patch_comment(self, data, query, comment_id):
+    comment = self._comments.get(int(comment_id))
+    if comment is None:
+      return _Response(404, {'message': 'Not Found'})
+    if len(data['body']) > self.settings.max_body:
+      return _Response(422, {'message': 'Validation Failed', 'errors': [{'resource': 'IssueComment', 'field': 'body', 'code': 'too_long'}]})
+    comment['body'] = data['body']
+    return _Response(200, comment)
+
+  def _post_graphql(self, data, query):
+    text = data['query']
+    if 'deleteIssue' in text:
+      return self._delete_issues(text)
+    if 'updateIssue' in text:
+      return self._update_bodies(text, data.get('variables') or {})
+    if 'node(' in text:
+      match = re.search(r'node\(id:\s*"I_(\d+)"\)', text)
+      issue = self._issues.get(int(match.group(1)))
+      return _Response(200, {'data': {'node': {'comments': self._comment_page(issue, text)} if issue else None}})
+    if 'issue(number:' in text:
+      return self._issues_by_number(text)
+    if 'repository(' in text:
+      return self._list_issues(text)
+    if 'search(' in text:
+      first = int(re.search(r'first:\s*(\d+)', text).group(1))
+      nodes = [{'id': issue['node_id']} for number, issue in sorted(self._issues.iteritems()) if not issue['deleted']][:first]
+      return _Response(200, {'data': {'__typename': 'Query', 'search': {'nodes': nodes}}})
+    return _Response(200, {'data': None, 'errors': [{'message': 'Query not supported by the fake GitHub'}]})
+
+  def _delete_issues(self, text):
+    result = {}
+    errors = []
+    for alias, node_id in _DELETE_ISSUE.findall(text):
+      alias = alias or 'deleteIssue'
+      number = self._node_ids.get(node_id)
+      if number is None or self._issues[number]['deleted']:
+        result[alias] = None
+        errors.append({'type': 'NOT_FOUND', 'path': [alias],
+                       'message': "Could not resolve to a node with the global id of '" + node_id + "'"})
+        continue
+      self._issues[number]['deleted'] = True
+      result[alias] = {'clientMutationId': None, 'repository': {'id': 'R_1'}}
+    response = {'data': result}
+    if errors:
+      response['errors'] = errors
+    return _Response(200, response)
+
+  def _issues_by_number(self, text):
+    repository = {}
+    errors = []
+    for alias, number in _ISSUE_BY_NUMBER.findall(text):
+      issue = self._issues.get(int(number))
+      if issue is None or issue['deleted']:
+        repository[alias] = None
+        errors.append({'type': 'NOT_FOUND', 'path': ['repository', alias],
+                       'message': 'Could not resolve to an Issue with the number of {}.'.format(number)})
+        continue
+      repository[alias] = {'number': issue['number'], 'title': issue['title'], 'createdAt': issue['created_at']}
+    response = {'data': {'repository': repository}}
+    if errors:
+      response['errors'] = errors
+    return _Response(200, response)
+
+  def _list_issues(self, text):
+    first = int(re.search(r'issues\(first:\s*(\d+)', text).group(1))
+    after = re.search(r'after:\s*"n(\d+)"', text)
+    after = int(after.group(1)) if after else 0
+    live = [number for number, issue in sorted(self._issues.iteritems()) if not issue['deleted']]
+    page = [number for number in live if number > after][:first]
+    has_next = bool(page) and page[-1] < live[-1]
+    return _Response(200, {'data': {
+      'repository': {
+        'issues': {'totalCount': len(live), 'pageInfo': {'hasNextPage': has_next, 'endCursor': 'n{}'.format(page[-1]) if page else None},
+                   'nodes': [self._issue_node(self._issues[number], text) for number in page]},
+        'pullRequests': {'totalCount': 0}
+      },
+      'rateLimit': {'cost': 1, 'remaining': 5000, 'resetAt': _now_iso(time.time() + 3600)}
+    }})
+
+  def _issue_node(self, issue, text):
+    node = {'id': issue['node_id'], 'number': issue['number']}
+    if 'body' in text:
+      node['body'] = issue['body']
+    if 'comments(' in text:
+      node['comments'] = self._comment_page(issue, text)
+    return node
+
+  def _comment_page(self, issue, text):
+    first = int(re.search(r'comments\(first:\s*(\d+)', text).group(1))
+    after = re.search(r'comments\(first:\s*\d+,\s*after:\s*"c(\d+)"', text)
+    start = int(after.group(1)) if after else 0
+    comment_ids = issue['comments'][start:start + first]
+    return {'pageInfo': {'hasNextPage': start + first < len(issue['comments']), 'endCursor': 'c{}'.format(start + len(comment_ids))},
+            'nodes': [{'id': 'IC_{}'.format(comment_id), 'body': self._comments[comment_id]['body']} for comment_id in comment_ids]}
+
+  def _update_bodies(self, text, variables):
+    result = {}
+    for alias, mutation, id_variable, body_variable in _UPDATE_BODY.findall(text):
+      node_id = variables[id_variable]
+      body = variables[body_variable]
+      if len(body) > self.settings.max_body:
+        return _Response(200, {'data': None, 'errors': [{'path': [alias], 'message': 'Body is too long (maximum is 65536 characters)'}]})
+      if mutation == 'updateIssueComment':
+        comment = self._comments.get(int(node_id[len('IC_'):]))
+        if comment is None:
+          return _Response(200, {'data': None, 'errors': [{'type': 'NOT_FOUND', 'path': [alias], 'message': 'Could not resolve ' + node_id}]})
+        comment['body'] = body
+      else:
+        number = self._node_ids.get(node_id)
+        if number is None or self._issues[number]['deleted']:
+          return _Response(200, {'data': None, 'errors': [{'type': 'NOT_FOUND', 'path': [alias], 'message': 'Could not resolve ' + node_id}]})
+        self._issues[number]['body'] = body
+      result[alias] = {'clientMutationId': None}
+    return _Response(200, {'data': result})
+
+  def _get_stats(self, data, query):
+    # bl: called with the lock held, so the counters are copied here instead of through stats()
+    return _Response(200, {'requests': sum(self.requests.itervalues()), 'requests_by_endpoint': dict(self.requests),
+                           'bytes_received': self.bytes_received, 'forbidden': self.forbidden, 'imports': len(self._imports)})
+
+
+class _Handler(BaseHTTPRequestHandler):
+  # bl: keep-alive, like the connections the importer pools. responses are written at once,
+  # so the headers and the body don't each wait for a delayed ACK
+  protocol_version = 'HTTP/1.1'
+  wbufsize = -1
+  disable_nagle_algorithm = True
+
+  def _handle(self):
+    url = urlparse.urlsplit(self.path)
+    length = int(self.headers.get('Content-Length') or 0)
+    body = self.rfile.read(length) if length else ''
+    response = self.server.github.handle(self.command, url.path, urlparse.parse_qs(url.query), body)
+    payload = json.dumps(response.data)
+    self.send_response(response.status)
+    self.send_header('Content-Type', 'application/json; charset=utf-8')
+    self.send_header('Content-Length', str(len(payload)))
+    for name, value in response.headers.iteritems():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(payload)
+
+  do_GET = _handle
+  do_POST = _handle
+  do_PATCH = _handle
+  do_DELETE = _handle
+
+  def log_message(self, format, *args):
+    pass
+
+
+class FakeGitHubServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+  def __init__(self, settings, port=0, host='127.0.0.1'):
+    HTTPServer.__init__(self, (host, port), _Handler)
+    self.api_url = 'http://{}:{}'.format(host, self.server_address[1])
+    self.github = FakeGitHub(settings, self.api_url)
+    self._thread = None
+    self._handlers = []
+    self._handlers_lock = threading.Lock()
+
+  def process_request(self, request, client_address):
+    # bl: the handler threads are kept track of, so stop can close their keep-alive connections and join them
+    thread = threading.Thread(target=self.process_request_thread, args=(request, client_address))
+    thread.daemon = self.daemon_threads
+    with self._handlers_lock:
+      self._handlers = [(t, r) for t, r in self._handlers if t.is_alive()]
+      self._handlers.append((thread, request))
+    thread.start()
+
+  def start(self):
+    """
+    Serves in a background thread and returns the API url to pass to the importer
+    """
+    self._thread = threading.Thread(target=self.serve_forever)
+    self._thread.daemon = True
+    self._thread.start()
+    return self.api_url
+
+  def stop(self):
+    """
+    Stops serving, closes the open connections and waits for all threads of the server to finish
+    """
+    if self._thread is not None:
+      self.shutdown()
+      self._thread.join()
+      self._thread = None
+    with self._handlers_lock:
+      handlers, self._handlers = self._handlers, []
+    for thread, request in handlers:
+      try:
+        request.shutdown(socket.SHUT_RDWR)
+      except socket.error:
+        pass
+    for thread, request in handlers:
+      thread.join()
+    self.server_close()
+
+
+def add_settings_arguments(parser):
+  defaults = ServerSettings()
+  parser.add_argument('--latency', type=float, default=defaults.latency, help='seconds added to every request')
+  parser.add_argument('--import-delay', type=float, default=defaults.import_delay, help='seconds an import stays pending')
+  parser.add_argument('--forbidden-rate', type=float, default=defaults.forbidden_rate, help='share of requests failed with a secondary rate limit')
+  parser.add_argument('--retry-after', type=int, default=defaults.retry_after, help='Retry-After seconds of the secondary rate limit')
+  parser.add_argument('--rate-limit', type=int, default=defaults.rate_limit, help='hourly request budget in the rate limit headers')
+  parser.add_argument('--max-payload', type=int, default=defaults.max_payload, help='largest import payload in bytes')
+  parser.add_argument('--max-body', type=int, default=defaults.max_body, help='longest issue or comment body')
+  parser.add_argument('--page-size', type=int, default=defaults.page_size, help='items per page of listings')
+  parser.add_argument('--server-seed', dest='seed', type=int, default=defaults.seed, help='random seed of the injected failures')
+
+
+def settings_from_arguments(args):
+  return ServerSettings(*(getattr(args, field) for field in ServerSettings._fields))
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Serves a fake GitHub API for offline importer runs.')
+  parser.add_argument('--port', type=int, default=8000)
+  add_settings_arguments(parser)
+  args = parser.parse_args()
+  server = FakeGitHubServer(settings_from_arguments(args), args.port)
+  print 'Serving a fake GitHub API at', server.api_url
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    print json.dumps(server.github.stats(), indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  main()
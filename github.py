@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+
+import multiprocessing
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import metrics
+
+
+class RateLimiter:
+  """
+  Paces requests against one GitHub token with a token bucket.
+  The refill rate follows the X-RateLimit-Remaining and X-RateLimit-Reset headers,
+  so the remaining budget is spread evenly until the limit resets instead of
+  being burnt at once and followed by a stall.
+  """
+
+  _HOURLY_LIMIT = 5000
+
+  def __init__(self, burst=20):
+    self._lock = threading.Lock()
+    self._burst = float(burst)
+    self._tokens = float(burst)
+    self._rate = RateLimiter._HOURLY_LIMIT / 3600.0
+    self._checked_at = time.time()
+    self._remaining = None
+    self._reset_at = None
+    self.wait_time = 0.0
+
+  def acquire(self):
+    """
+    Blocks until a request may be sent
+    """
+    while True:
+      with self._lock:
+        now = time.time()
+        self._tokens = min(self._burst, self._tokens + (now - self._checked_at) * self._rate)
+        self._checked_at = now
+        if self._remaining == 0 and self._reset_at > now:
+          wait = self._reset_at - now
+        elif self._remaining == 0:
+          # bl: the limit was reset, so start over at the full hourly rate until the next response says otherwise
+          self._remaining = None
+          self._rate = RateLimiter._HOURLY_LIMIT / 3600.0
+          continue
+        elif self._tokens >= 1:
+          self._tokens -= 1
+          return
+        else:
+          wait = (1 - self._tokens) / self._rate
+        self.wait_time += wait
+      time.sleep(wait)
+
+  def update(self, response):
+    """
+    Takes the current budget from the rate limit headers of a response
+    """
+    remaining = response.headers.get('X-RateLimit-Remaining')
+    reset_at = response.headers.get('X-RateLimit-Reset')
+    if remaining is None or reset_at is None:
+      return
+    with self._lock:
+      self._remaining = int(remaining)
+      self._reset_at = int(reset_at)
+      self._rate = max(self._remaining, 1) / max(self._reset_at - time.time(), 1.0)
+
+  def record_wait(self, wait):
+    """
+    Adds seconds spent waiting outside of acquire, e.g. before a retry, to wait_time
+    """
+    with self._lock:
+      self.wait_time += wait
+
+  def is_rate_limited(self, response):
+    if response.status_code not in (403, 429):
+      return False
+    return ('Retry-After' in response.headers or response.headers.get('X-RateLimit-Remaining') == '0'
+            or 'rate limit' in response.text.lower())
+
+  def backoff(self, response, attempt):
+    """
+    Returns how many seconds to wait before retrying a request that failed with the given response,
+    or that did not get a response at all if it is None
+    """
+    if response is not None and 'Retry-After' in response.headers:
+      return float(response.headers['Retry-After'])
+    reset_at = response.headers.get('X-RateLimit-Reset') if response is not None else None
+    if reset_at is not None and response.headers.get('X-RateLimit-Remaining') == '0':
+      return max(int(reset_at) - time.time(), 0) + 1
+    # bl: secondary rate limits want at least a minute, server and connection errors only a moment
+    base, cap = (60.0, 900.0) if response is not None and self.is_rate_limited(response) else (1.0, 60.0)
+    return min(cap, base * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+class PointBudget:
+  """
+  Paces GraphQL requests to GitHub's secondary rate limit of 2,000 points per minute,
+  where a query costs 1 point and a request with mutations 5, however many mutations it has.
+  """
+
+  QUERY_POINTS = 1
+
+  MUTATION_POINTS = 5
+
+  def __init__(self, points_per_minute=2000):
+    self._lock = threading.Lock()
+    self._capacity = float(points_per_minute)
+    self._points = float(points_per_minute)
+    self._rate = points_per_minute / 60.0
+    self._checked_at = time.time()
+
+  def spend(self, points):
+    """
+    Blocks until the points are available
+    """
+    while True:
+      with self._lock:
+        now = time.time()
+        self._points = min(self._capacity, self._points + (now - self._checked_at) * self._rate)
+        self._checked_at = now
+        if self._points >= points:
+          self._points -= points
+          return
+        wait = (points - self._points) / self._rate
+      time.sleep(wait)
+
+
+def _shared_field(index, optional=False):
+  """
+  Returns a property stored at the index of the shared state array, with -1 standing for None if optional
+  """
+  def get(self):
+    value = self._state[index]
+    return None if optional and value < 0 else value
+
+  def set(self, value):
+    self._state[index] = -1 if value is None else value
+  return property(get, set)
+
+
+class SharedRateLimiter(RateLimiter, object):
+  """
+  A RateLimiter kept in shared memory, for the worker processes of a migration to pace their requests
+  against the token together. Created before the workers are started, which inherit it.
+  """
+
+  _tokens = _shared_field(0)
+  _rate = _shared_field(1)
+  _checked_at = _shared_field(2)
+  _remaining = _shared_field(3, optional=True)
+  _reset_at = _shared_field(4, optional=True)
+  wait_time = _shared_field(5)
+
+  def __init__(self, burst=20):
+    self._state = multiprocessing.RawArray('d', 6)
+    RateLimiter.__init__(self, burst)
+    self._lock = multiprocessing.Lock()
+
+
+class SharedPointBudget(PointBudget, object):
+  """
+  A PointBudget kept in shared memory, like SharedRateLimiter
+  """
+
+  _points = _shared_field(0)
+  _checked_at = _shared_field(1)
+
+  def __init__(self, points_per_minute=2000):
+    self._state = multiprocessing.RawArray('d', 2)
+    PointBudget.__init__(self, points_per_minute)
+    self._lock = multiprocessing.Lock()
+
+
+# bl: all clients using the same token share its budget
+_rate_limiters = {}
+_point_budgets = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def rate_limiter_for(token):
+  with _rate_limiters_lock:
+    if token not in _rate_limiters:
+      _rate_limiters[token] = RateLimiter()
+    return _rate_limiters[token]
+
+
+def point_budget_for(token):
+  with _rate_limiters_lock:
+    if token not in _point_budgets:
+      _point_budgets[token] = PointBudget()
+    return _point_budgets[token]
+
+
+def share_budget(token):
+  """
+  Moves the budget of a token into shared memory, so processes started afterwards share it
+  """
+  with _rate_limiters_lock:
+    _rate_limiters[token] = SharedRateLimiter()
+    _point_budgets[token] = SharedPointBudget()
+
+
+class GitHubClient:
+  """
+  Keep-alive HTTP client for all REST and GraphQL calls to GitHub.
+  Connections are pooled per host, so the many small requests of a migration
+  don't each pay for a new TLS handshake.
+  """
+
+  _DEFAULT_TIME_OUT = 120.0
+
+  _RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+  REST = 'rest'
+
+  IMPORT = 'import'
+
+  GRAPHQL = 'graphql'
+
+  def __init__(self, token, api_url='https://api.github.com', pool_size=10, max_retries=20, rate_limiter=None):
+    self.api_url = api_url
+    self.max_retries = max_retries
+    self.rate_limiter = rate_limiter or rate_limiter_for(token)
+    self.point_budget = point_budget_for(token)
+    self.graphql_url = api_url + '/graphql'
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    self.session.mount('https://', adapter)
+    self.session.mount('http://', adapter)
+    # bl: every call type gets its own headers. they are tuples, so no call can change them for the others
+    base_headers = (('User-Agent', 'bongohrtech'),
+                    ('Authorization', 'Bearer ' + token),
+                    ('Content-Type', 'application/json'))
+    self._headers = {
+      GitHubClient.REST: base_headers,
+      GitHubClient.IMPORT: base_headers + (('Accept', 'application/vnd.github.golden-comet-preview+json'),),
+      GitHubClient.GRAPHQL: base_headers
+    }
+
+  def request(self, method, url, json=None, kind=REST, idempotent=None):
+    """
+    Sends a request once the rate limiter allows it. Rate limited requests are retried with backoff,
+    up to max_retries times. Server errors and connection failures are only retried for idempotent requests,
+    by default GETs and PATCHes: a POST that timed out may have been processed, and sending it again would
+    import an issue or post a comment twice. The last response is returned whatever its status.
+    """
+    if idempotent is None:
+      idempotent = method in ('GET', 'PATCH')
+    attempt = 0
+    while True:
+      start = time.time()
+      self.rate_limiter.acquire()
+      sent_at = time.time()
+      metrics.add('rate_limit_wait_seconds', sent_at - start)
+      try:
+        response = self.session.request(method, url, json=json, headers=dict(self._headers[kind]), timeout=GitHubClient._DEFAULT_TIME_OUT)
+      except (requests.ConnectionError, requests.Timeout) as e:
+        metrics.record_request(method, url, 'error', time.time() - sent_at, 0)
+        if not idempotent or attempt >= self.max_retries:
+          raise
+        response = None
+        print 'Request {} {} failed: {}'.format(method, url, e)
+      else:
+        metrics.record_request(method, url, response.status_code, time.time() - sent_at, len(response.request.body or ''))
+        self.rate_limiter.update(response)
+        retry = (idempotent and response.status_code in GitHubClient._RETRY_STATUS_CODES) or self.rate_limiter.is_rate_limited(response)
+        if not retry or attempt >= self.max_retries:
+          return response
+      wait = self.rate_limiter.backoff(response, attempt)
+      if response is not None:
+        print 'Request {} {} got HTTP {}. Retrying in {:.0f} seconds'.format(method, url, response.status_code, wait)
+      self.rate_limiter.record_wait(wait)
+      metrics.add('retries')
+      metrics.add('retry_wait_seconds', wait)
+      time.sleep(wait)
+      attempt += 1
+
+  def get(self, url, kind=REST):
+    return self.request('GET', url, kind=kind)
+
+  def post(self, url, json, kind=REST):
+    return self.request('POST', url, json=json, kind=kind)
+
+  def patch(self, url, json, kind=REST):
+    return self.request('PATCH', url, json=json, kind=kind)
+
+  def graphql(self, query, variables=None):
+    mutation = query.lstrip().startswith('mutation')
+    self.point_budget.spend(PointBudget.MUTATION_POINTS if mutation else PointBudget.QUERY_POINTS)
+    data = {'query': query}
+    if variables:
+      data['variables'] = variables
+    # bl: queries only read, so they can be sent again like GETs
+    return self.request('POST', self.graphql_url, json=data, kind=GitHubClient.GRAPHQL, idempotent=not mutation)
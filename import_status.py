@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+import time
+import urllib
+from dateutil.parser import parse
+from github import GitHubClient
+
+
+class ImportStatusTracker:
+  """
+  Follows all outstanding issue imports of a repository through the Import API's bulk listing
+  (GET /repos/{owner}/{repo}/import/issues?since=...), so one request checks every import in flight.
+  A single import in flight is checked through its own status instead.
+  Polls are scheduled from the observed completion times instead of once a second per import.
+  The listing leaves out the issue url, so the issues the imports are expected to have become are
+  looked up together with one GraphQL query instead of getting the status of every import.
+  """
+
+  # bl: like the single import status checks, give up once this many checks in a row failed
+  _MAX_FAILED_CHECKS = 100
+
+  # bl: issues looked up per GraphQL query, each under an alias of its own
+  _LOOKUP_SIZE = 100
+
+  def __init__(self, client, import_issues_url, owner, repo, min_interval=0.5, max_interval=10.0):
+    self.client = client
+    self.import_issues_url = import_issues_url
+    self.issues_url = import_issues_url[:-len('/import/issues')] + '/issues'
+    self.owner = owner
+    self.repo = repo
+    self.min_interval = min_interval
+    self.max_interval = max_interval
+    self.requests = 0
+    self.durations = []
+    self._pending = {}
+    self._done = {}
+    self._expected = {}
+    self._seen_pending_at = {}
+    self._expected_duration = None
+
+  def track(self, import_status, number=None, issue=None):
+    """
+    Starts following an import, given the status returned when it was submitted.
+    With the number and the imported issue payload, the issue is expected to get that number.
+    """
+    self._pending[import_status['url']] = (import_status.get('created_at'), time.time())
+    if number is not None and issue is not None and issue.get('created_at'):
+      self._expected[import_status['url']] = (number, issue['title'], issue['created_at'])
+
+  def wait(self, status_url):
+    """
+    Blocks until the given import left the 'pending' status.
+    Returns its final status, including the issue_url of imported issues, and the seconds it took.
+    """
+    interval = self.min_interval
+    failed_checks = 0
+    while status_url not in self._done:
+      submitted_at = self._pending[status_url][1]
+      delay = interval
+      if self._expected_duration is not None and submitted_at + self._expected_duration - time.time() > delay:
+        # bl: the backoff only starts once the import takes longer than expected
+        delay = submitted_at + self._expected_duration - time.time()
+        interval = self.min_interval / 1.5
+      time.sleep(min(delay, self.max_interval))
+      listed = self._poll_listing() if len(self._pending) > 1 else None
+      checked = listed is not None and status_url in listed
+      if not checked:
+        checked = self._poll_status(status_url)
+      failed_checks = 0 if checked else failed_checks + 1
+      if failed_checks >= ImportStatusTracker._MAX_FAILED_CHECKS:
+        raise RuntimeError("Failing import status check permanently!")
+      interval = min(interval * 1.5, self.max_interval)
+
+    if self._done[status_url][0]['status'] == 'imported' and 'issue_url' not in self._done[status_url][0]:
+      self._look_up_issues()
+    status, duration = self._done.pop(status_url)
+    self._expected.pop(status_url, None)
+    if status['status'] == 'imported' and 'issue_url' not in status or status['status'] == 'failed' and 'errors' not in status:
+      # bl: the listing leaves out the issue url and errors, so get them from the import itself
+      status = self._get_status(status_url)
+    return status, duration
+
+  def _look_up_issues(self):
+    """
+    Adds the issue url to the listed statuses of completed imports whose expected issue number holds
+    an issue with the title and creation time of the import. The others keep going through their own status.
+    """
+    unresolved = [status_url for status_url, (status, duration) in self._done.iteritems()
+                  if status['status'] == 'imported' and 'issue_url' not in status and status_url in self._expected]
+    for start in xrange(0, len(unresolved), ImportStatusTracker._LOOKUP_SIZE):
+      batch = unresolved[start:start + ImportStatusTracker._LOOKUP_SIZE]
+      issues = ' '.join('i{}: issue(number: {}) {{ number title createdAt }}'.format(i, self._expected[status_url][0])
+                        for i, status_url in enumerate(batch))
+      response = self.client.graphql('query { repository(owner: "%s", name: "%s") { %s } }' % (self.owner, self.repo, issues))
+      self.requests += 1
+      if response.status_code != 200:
+        print "Failed to look up imported issues due to unexpected HTTP status code: {}".format(response.status_code)
+        return
+      # bl: numbers without an issue come back as null with an error, which is no reason to give up on the others
+      repository = (response.json().get('data') or {}).get('repository') or {}
+      for i, status_url in enumerate(batch):
+        node = repository.get('i{}'.format(i))
+        number, title, created_at = self._expected[status_url]
+        if node is not None and node['title'] == title and parse(node['createdAt']) == parse(created_at):
+          status, duration = self._done[status_url]
+          self._done[status_url] = (dict(status, issue_url=self.issues_url + '/' + str(number)), duration)
+
+  def _poll_listing(self):
+    """
+    Updates all pending imports from the bulk listing and returns the status urls it reported,
+    or None if it could not be used
+    """
+    created = [created_at for created_at, submitted_at in self._pending.itervalues()]
+    if not created or None in created:
+      return None
+    listed = set()
+    url = self.import_issues_url + '?' + urllib.urlencode((('since', min(created)), ('per_page', 100)))
+    while url is not None:
+      response = self.client.get(url, kind=GitHubClient.IMPORT)
+      self.requests += 1
+      if response.status_code != 200:
+        print "Failed to list GitHub issue imports {} due to unexpected HTTP status code: {}".format(url, response.status_code)
+        return None
+      for status in response.json():
+        listed.add(status['url'])
+        self._update(status['url'], status)
+      url = response.links.get('next', {}).get('url')
+    return listed
+
+  def _poll_status(self, status_url):
+    """
+    Updates an import from its own status. Returns False if the status could not be checked
+    """
+    response = self.client.get(status_url, kind=GitHubClient.IMPORT)
+    self.requests += 1
+    if response.status_code != 200:
+      print "Failed to check GitHub issue import status url: {} due to unexpected HTTP status code: {}".format(status_url, response.status_code)
+      return False
+    self._update(status_url, response.json())
+    return True
+
+  def _get_status(self, status_url):
+    for i in range(100):
+      response = self.client.get(status_url, kind=GitHubClient.IMPORT)
+      self.requests += 1
+      if response.status_code == 200:
+        return response.json()
+      print "Failed to check GitHub issue import status url: {} due to unexpected HTTP status code: {}".format(status_url, response.status_code)
+      time.sleep(1)
+    raise RuntimeError("Failing import status check permanently!")
+
+  def _update(self, status_url, status):
+    if status_url not in self._pending:
+      return
+    if status['status'] == 'pending':
+      self._seen_pending_at[status_url] = time.time()
+      return
+    created_at, submitted_at = self._pending.pop(status_url)
+    now = time.time()
+    duration = now - submitted_at
+    self.durations.append(duration)
+    # bl: the import finished between the last check that saw it pending and this one. taking the time it was noticed
+    # would make the expected duration, and so every first check, creep later and later
+    finished_in = (self._seen_pending_at.pop(status_url, submitted_at) + now) / 2 - submitted_at
+    if self._expected_duration is None:
+      self._expected_duration = finished_in
+    else:
+      self._expected_duration = 0.8 * self._expected_duration + 0.2 * finished_in
+    self._done[status_url] = (status, duration)
@@ -1,10 +1,33 @@
 #!/usr/bin/env python
 
-import requests
 import random
 import time
 import re
 import json
+import hashlib
+from collections import namedtuple, deque
+from body_store import StoredBody, bodies, body_sha1, json_sha1, prepend, split_body, text, text_chunks
+from github import GitHubClient
+from import_status import ImportStatusTracker
+from journal import Journal
+from metrics import metrics
+from model import Comment, LINK_KINDS
+from payloads import ExportedIssue, PayloadWriter, MILESTONE_PLACEHOLDER
+from post_processing import PostProcessor
+from purge import IssuePurger
+from references import ReferenceRewriter, PlaceholderResolver
+from text import chunk_spans, MAX_BODY_LENGTH
+
+Options = namedtuple("Options", "user account repo token first_issue_id last_issue_id jira_repos pre_resolve_references import_window http_pool_size journal_file delta_import api_url verbose")
+# bl: jira_repos maps JIRA project keys to GitHub repositories, defaulting to Importer._JIRA_PROJECT_REPOS.
+# with pre_resolve_references the final issue references are written into the imported issues right away.
+# import_window is the number of issue imports that may be in flight at the same time,
+# http_pool_size the number of keep-alive connections kept open to GitHub.
+# journal_file is the SQLite journal the progress is recorded in, so a crashed migration can be resumed.
+# with delta_import, issues the journal records as imported are brought up to date instead of skipped.
+# api_url is where the GitHub API is served, e.g. a local fake_github server for load tests.
+# with verbose, the old and new texts of patched bodies are printed
+Options.__new__.__defaults__ = (None, False, 1, 10, None, False, 'https://api.github.com', False)
 
 
 class Importer:
@@ -12,119 +35,416 @@ class Importer:
   
   _PLACEHOLDER_SUFFIX = "@PEND"
   
-  _DEFAULT_TIME_OUT = 120.0
+  _JIRA_PROJECT_REPOS = {
+    'CRST': 'crowdstack',
+    'HLA': 'crowdstack',
+    'OPS': 'operations',
+    'RS': 'right-starts',
+    'EVE': 'eve',
+    'HDO': 'hoodo',
+    'WS': 'web-sites',
+    'CS': 'customer-service'
+  }
+
+  # bl: JIRA keys that were only renamed and are still found in old texts, rewritten during post-processing
+  _LEGACY_JIRA_KEYS = {
+    'TUR': 'crowdstack',
+    'HLA': 'crowdstack'
+  }
 
   def __init__(self, options, project):
     self.options = options
-    self.headers = {  'User-Agent': 'bongohrtech',
-                    'Authorization': 'Bearer ' + options.token,
-                    'Content-Type': 'application/json'
-                    }
+    self.client = GitHubClient(options.token, api_url=options.api_url, pool_size=options.http_pool_size)
     self.project = project
-    self.github_url = 'https://api.github.com/repos/' + self.options.account + '/' + self.options.repo
+    self.github_url = self.client.api_url + '/repos/' + self.options.account + '/' + self.options.repo
     self.github_web_url = 'https://github.com/' + self.options.account + '/' + self.options.repo
-    self.githubGQL_url = 'https://api.github.com/graphql'
-    self.jira_issue_replace_patterns = {
-        'https://hub.socialstrata.com/jira/browse/' + self.project.name + r'-(\d+)': r'\1',
-        self.project.name + r'-(\d+)': r'\1'
-    }
-    self.jira_issue_url_replace_patterns = {
-        'https://hub.socialstrata.com/jira/browse/CRST' + r'-(\d+)': r'https://github.com/SocialStrata/crowdstack/issues/\1',
-        'CRST' + r'-(\d+)': r'https://github.com/SocialStrata/crowdstack/issues/\1',
-        'https://hub.socialstrata.com/jira/browse/HLA' + r'-(\d+)': r'https://github.com/SocialStrata/crowdstack/issues/\1',
-        'HLA' + r'-(\d+)': r'https://github.com/SocialStrata/crowdstack/issues/\1',
-        'https://hub.socialstrata.com/jira/browse/OPS' + r'-(\d+)': r'https://github.com/SocialStrata/operations/issues/\1',
-        'OPS' + r'-(\d+)': r'https://github.com/SocialStrata/operations/issues/\1',
-        'https://hub.socialstrata.com/jira/browse/RS' + r'-(\d+)': r'https://github.com/SocialStrata/right-starts/issues/\1',
-        'RS' + r'-(\d+)': r'https://github.com/SocialStrata/right-starts/issues/\1',
-        'https://hub.socialstrata.com/jira/browse/EVE' + r'-(\d+)': r'https://github.com/SocialStrata/eve/issues/\1',
-        'EVE' + r'-(\d+)': r'https://github.com/SocialStrata/eve/issues/\1',
-        'https://hub.socialstrata.com/jira/browse/HDO' + r'-(\d+)': r'https://github.com/SocialStrata/hoodo/issues/\1',
-        'HDO' + r'-(\d+)': r'https://github.com/SocialStrata/hoodo/issues/\1',
-        'https://hub.socialstrata.com/jira/browse/WS' + r'-(\d+)': r'https://github.com/SocialStrata/web-sites/issues/\1',
-        'WS' + r'-(\d+)': r'https://github.com/SocialStrata/web-sites/issues/\1',
-        'https://hub.socialstrata.com/jira/browse/CS' + r'-(\d+)': r'https://github.com/SocialStrata/customer-service/issues/\1',
-        'CS' + r'-(\d+)': r'https://github.com/SocialStrata/customer-service/issues/\1'
-    }
+    self.githubGQL_url = self.client.graphql_url
+    jira_repos = self.options.jira_repos or Importer._JIRA_PROJECT_REPOS
+    self.reference_rewriter = ReferenceRewriter(self.options.account, jira_repos, self.project.name,
+                                                Importer._PLACEHOLDER_PREFIX, Importer._PLACEHOLDER_SUFFIX)
+    self.placeholder_resolver = PlaceholderResolver(self.options.account, set(jira_repos.itervalues()), Importer._LEGACY_JIRA_KEYS,
+                                                    Importer._PLACEHOLDER_PREFIX, Importer._PLACEHOLDER_SUFFIX)
+    self.status_tracker = ImportStatusTracker(self.client, self.github_url + '/import/issues', self.options.account, self.options.repo)
+    self.journal = Journal(self.options.journal_file) if self.options.journal_file else None
     self.comments_to_append = []
+    self.unresolved_bodies = 0
     
+  @metrics.timed('milestones')
   def import_milestones(self):
     """
-    Imports the gathered project milestones into GitHub and remembers the created milestone ids
+    Imports the gathered project milestones into GitHub and remembers the created milestone ids.
+    The milestones that already exist are looked up once, so only the missing ones are created.
     """
     milestone_url = self.github_url + '/milestones'
     print 'Importing milestones...', milestone_url
     print
-    for mkey in self.project.get_milestones().iterkeys():
-        data = {'title': mkey}
-        r = requests.post(milestone_url, json=data, headers=self.headers, timeout=Importer._DEFAULT_TIME_OUT)
-        
-        # overwrite histogram data with the actual milestone id now
-        if r.status_code == 201:
-          content = r.json()
-          self.project.get_milestones()[mkey] = content['number']
-          print mkey
-        else:
-          if r.status_code == 422: # already exists
-            ms = requests.get(milestone_url + '?state=open', headers=self.headers, timeout=Importer._DEFAULT_TIME_OUT).json()
-            ms += requests.get(milestone_url + '?state=closed', headers=self.headers, timeout=Importer._DEFAULT_TIME_OUT).json()
-            f = False
-            for m in ms:
-              if m['title'] == mkey:
-                self.project.get_milestones()[mkey] = m['number']
-                print mkey, 'found'
-                f = True
-                break
-            if not f:
-              exit('Could not find milestone: ' + mkey)
-          else:
-            print 'Failure!', r.status_code, r.content, r.headers
-    
-  
+    milestones = self.project.get_milestones()
+    existing = self._fetch_index(milestone_url + '?state=all', 'title', 'number')
+    missing = set(mkey for mkey in milestones if mkey not in existing)
+    for data, r in self._create_sequentially(milestone_url, [{'title': mkey} for mkey in missing]):
+      if r.status_code == 201:
+        existing[data['title']] = r.json()['number']
+        print data['title']
+      elif r.status_code != 422:
+        raise RuntimeError(
+          "Failed to create milestone {} due to unexpected HTTP status code: {} ; text: {}".format(data['title'], r.status_code, r.text)
+        )
+    if any(mkey not in existing for mkey in missing):
+      # bl: a 422 means it was created by someone else in the meantime
+      existing = self._fetch_index(milestone_url + '?state=all', 'title', 'number')
+    # overwrite histogram data with the actual milestone id now
+    for mkey in milestones:
+      if mkey not in existing:
+        raise RuntimeError('Could not find milestone: ' + mkey)
+      if mkey not in missing:
+        print mkey, 'found'
+      milestones[mkey] = existing[mkey]
+
+  @metrics.timed('labels')
   def import_labels(self):
     """
-    Imports the gathered project components and labels as labels into GitHub 
+    Imports the gathered project components and labels as labels into GitHub.
+    Labels that already exist, in any case, are left as they are.
     """
     label_url = self.github_url + '/labels'
     print 'Importing labels...', label_url
     print
-    for lkey in self.project.get_components().iterkeys():
-      data = {'name': lkey, 'color': '%.6x' % random.randint(0, 0xffffff)}
-      r = requests.post(label_url, json=data, headers=self.headers, timeout=Importer._DEFAULT_TIME_OUT)
+    existing = self._fetch_index(label_url, 'name', 'name')
+    existing = set(name.lower() for name in existing)
+    missing = [{'name': lkey, 'color': '%.6x' % random.randint(0, 0xffffff)}
+               for lkey in self.project.get_components().iterkeys() if lkey.lower() not in existing]
+    print '{} labels exist already'.format(len(self.project.get_components()) - len(missing))
+    for data, r in self._create_sequentially(label_url, missing):
       if r.status_code == 201:
-        print lkey
-      else:
-        print 'Failure importing label ' + lkey, r.status_code, r.content, r.headers
+        print data['name']
+      elif r.status_code != 422:
+        print 'Failure importing label ' + data['name'], r.status_code, r.content, r.headers
+
+  def _fetch_index(self, url, key, value):
+    """
+    Fetches every page of a listing and returns its items as a key -> value dict
+    """
+    index = {}
+    url += ('&' if '?' in url else '?') + 'per_page=100'
+    while url is not None:
+      response = self.client.get(url)
+      if response.status_code != 200:
+        raise RuntimeError(
+          "Failed to list {} due to unexpected HTTP status code: {} ; text: {}".format(url, response.status_code, response.text)
+        )
+      for item in response.json():
+        index[item[key]] = item[value]
+      url = response.links.get('next', {}).get('url')
+    return index
+
+  def _create_sequentially(self, url, items):
+    """
+    POSTs the items to url one at a time and yields (item, response) pairs in order
+    """
+    # bl: requests creating content are sent one after another, parallel ones trigger GitHub's secondary rate limits
+    for data in items:
+      yield data, self.client.post(url, data)
 
-  def import_issues(self):
+  @metrics.timed('import')
+  def import_issues(self, issues=None):
     """
     Starts the issue import into GitHub:
     First the milestone id is captured for the issue.
     Then JIRA issue relationships are converted into comments.
     After that, the comments are taken out of the issue and 
     references to JIRA issues in comments are replaced with a placeholder    
+    Without issues, the issues of the project are imported.
     """
     print 'Importing issues...'
-    for issue in self.project.get_issues():
-      
+    start = time.time()
+    imported = metrics.totals['issues_imported']
+    if issues is None:
+      issues = self.project.get_issues()
+    if self.options.import_window > 1:
+      self._import_issues_windowed(issues, self.options.import_window)
+    else:
+      for issue in issues:
         #time.sleep(2)
-        if 'milestone_name' in issue:
-          issue['milestone'] = self.project.get_milestones()[ issue['milestone_name'] ]
-          del issue['milestone_name']
-
-
-        self.convert_relationships_to_comments(issue)
-
-        issue['body'] = self._replace_jira_with_github_id(issue['body'])
-        issue_comments = issue['comments']
-        del issue['comments']
-        comments = []
-        for comment in issue_comments:
-          comments.append(dict((k,self._replace_jira_with_github_id(v)) for k,v in comment.items()))
-
+        entry = self._journal_entry(issue)
+        if entry is not None:
+          self._resume_issue(issue, entry)
+          continue
+        comments = self._prepare_issue(issue)
+        self.import_issue_with_comments(issue, comments)
+    elapsed = time.time() - start
+    imported = metrics.totals['issues_imported'] - imported
+    print 'Imported {:.0f} issues in {:.1f}s ({:.2f} issues/s)'.format(imported, elapsed, imported / max(elapsed, 0.001))
+    durations = self.status_tracker.durations
+    if durations:
+      print 'Imports took {:.1f}s on average, {:.1f}s at most, checked with {} status requests'.format(
+        sum(durations) / len(durations), max(durations), self.status_tracker.requests)
+
+  @metrics.timed('transform')
+  def _prepare_issue(self, issue):
+    """
+    Resolves the milestone of an issue, converts its relationships into comments and
+    replaces the JIRA references in its body and comments. Returns the comments to import.
+    Exported issues were transformed by the export already.
+    """
+    if isinstance(issue, ExportedIssue):
+      return []
+    if issue.milestone_name is not None:
+      issue.milestone = self.project.get_milestones()[ issue.milestone_name ]
+      issue.milestone_name = None
+
+    self.convert_relationships_to_comments(issue)
+
+    issue.body = self._replace_jira_with_github_id(issue.body)
+    issue_comments = issue.comments
+    issue.comments = []
+    comments = []
+    for comment in issue_comments:
+      comments.append(Comment(comment.created_at, self._replace_jira_with_github_id(comment.body)))
+    return comments
+
+  def _import_issues_windowed(self, issues, window):
+    """
+    Imports the issues with up to window imports in flight at a time.
+    Issues are still submitted in JIRA number order and completed in that order,
+    while the status of all in-flight imports is followed by the status tracker with bulk requests.
+    The first issue and any issue after a gap in the JIRA numbers go through
+    import_issue_with_comments, which retries until GitHub hands out the right number.
+    """
+    in_flight = deque()
+    next_number = None
+    for issue in issues:
+      entry = self._journal_entry(issue)
+      if entry is not None:
+        self._complete_imports(in_flight)
+        self._resume_issue(issue, entry)
+        next_number = issue.get_number() + 1
+        continue
+      comments = self._prepare_issue(issue)
+      if issue.get_number() != next_number:
+        self._complete_imports(in_flight)
         self.import_issue_with_comments(issue, comments)
+      else:
+        self._complete_imports(in_flight, window - 1)
+        in_flight.append(self._submit_import(issue, comments))
+      next_number = issue.get_number() + 1
+    self._complete_imports(in_flight)
+
+  @metrics.timed('export')
+  def export_payloads(self, directory, shard_size=1000):
+    """
+    Runs the whole transform of the issues without GitHub and writes their final Import API payloads
+    and overflow comments into directory, for upload_payloads to import later.
+    Milestones are exported by name and get their number when uploaded.
+    """
+    print 'Exporting payloads to', directory
+    writer = PayloadWriter(directory, self.project.name, self.options.repo, self.options.pre_resolve_references, shard_size)
+    for issue in self.project.get_issues():
+      milestone_name = issue.milestone_name
+      if milestone_name is not None:
+        issue.milestone = MILESTONE_PLACEHOLDER
+        issue.milestone_name = None
+      comments = self._prepare_issue(issue)
+      body = issue.body
+      comment_hashes = self._issue_hashes(issue, comments)[1]
+      self.comments_to_append = []
+      self.build_issue_data(issue, comments)
+      self.issue_data['issue'].pop('milestone', None)
+      writer.write(issue.key, milestone_name, self.issue_data, self.comments_to_append, comment_hashes,
+                   body if issue.body is not body else None)
+    writer.close(self.project.get_state())
+    print 'Exported {} issues into {} shards'.format(writer.issues, len(writer.shards))
+
+  def upload_payloads(self, reader):
+    """
+    Imports the issues of an export read by a PayloadReader, streaming them from its shards.
+    The milestones must be imported first.
+    """
+    if reader.manifest['pre_resolve_references'] != self.options.pre_resolve_references:
+      raise RuntimeError("The payloads in {} were exported with pre_resolve_references {}. Upload them with the same setting."
+                         .format(reader.directory, reader.manifest['pre_resolve_references']))
+    if self.options.delta_import:
+      raise RuntimeError("Delta imports compare the issues with the parsed export. They can't be run from exported payloads.")
+    self.import_issues(reader.issues(self.project.get_milestones()))
+
+  def _submit_import(self, issue, comments):
+    self.comments_to_append = []
+    print 'Issue ', issue.key
+    response = self.upload_github_issue(issue, comments)
+    if self.journal is not None:
+      self._record_submitted(issue, response.json()['url'])
+    self.status_tracker.track(response.json(), issue.get_number(), self.issue_data['issue'])
+    return _PendingImport(issue, response.json()['url'], self.issue_data, self.comments_to_append)
+
+  def _complete_imports(self, in_flight, keep=0):
+    """
+    Completes the imports in flight in submission order until at most keep are left.
+    Once GitHub gave an issue another number than its JIRA one, the whole window is drained:
+    wrongly numbered issues are deleted and imported again one at a time by import_issue_with_comments,
+    which retries until the numbers match, while the ones that got their number are kept.
+    """
+    while len(in_flight) > keep:
+      pending = in_flight.popleft()
+      gh_issue_id = self._imported_number(pending)
+      if gh_issue_id == pending.issue.get_number():
+        self._complete_import(pending, gh_issue_id)
+        continue
+      drained = [(pending, gh_issue_id)] + [(p, self._imported_number(p)) for p in in_flight]
+      in_flight.clear()
+      print 'Failed creating JIRA issue {}. Created #{}. Importing the wrongly numbered issues of the window again!'.format(
+        pending.issue.key, gh_issue_id)
+      # bl: GitHub never hands out a number twice, not even of a deleted issue, so the retries start after all of the window
+      highest = max(number for p, number in drained)
+      for p, number in drained:
+        jira_num = p.issue.get_number()
+        if number == jira_num:
+          self._complete_import(p, number)
+          continue
+        if jira_num <= highest:
+          raise RuntimeError(
+            "JIRA issue {} was imported as #{} and can't get #{} anymore, GitHub already handed out up to #{}."
+            .format(p.issue.key, number, jira_num, highest)
+          )
+        self._delete_imported_issue(p.issue.key, number)
+        # bl: the payload holds the comments that fit into it, the rest were to be appended
+        comments = [Comment(c['created_at'], c['body']) for c in p.issue_data['comments']] + p.comments_to_append
+        self.import_issue_with_comments(p.issue, comments)
+        highest = jira_num
+
+  def _imported_number(self, pending):
+    gh_issue_url = self.wait_for_issue_creation(pending.status_url, pending.issue_data)['issue_url']
+    return int(gh_issue_url.split('/')[-1])
+
+  def _complete_import(self, pending, gh_issue_id):
+    if self.journal is not None:
+      self.journal.record_imported(pending.issue.key, gh_issue_id, not pending.comments_to_append)
+    metrics.add('issues_imported')
+    pending.issue.githubid = gh_issue_id
+    self._upload_extra_comments(gh_issue_id, pending.issue, pending.comments_to_append)
+
+  def _journal_entry(self, issue):
+    if self.journal is None:
+      return None
+    entry = self.journal.get(issue.key)
+    if entry is None or entry.state is None:
+      return None
+    return entry
+
+  def _resume_issue(self, issue, entry):
+    """
+    Continues the import of an issue from where the journal says a previous run stopped.
+    """
+    if entry.state == Journal.COMPLETED:
+      issue.githubid = entry.github_number
+      if self.options.delta_import:
+        self._sync_issue(issue, entry)
+      return
+    comments = self._prepare_issue(issue)
+    if entry.state == Journal.SUBMITTED:
+      print 'Resuming import of {} from {}'.format(issue.key, entry.status_url)
+      self.import_issue_with_comments(issue, comments, entry.status_url)
+    else:
+      print 'Resuming overflow comments of {} after {} posted'.format(issue.key, entry.overflow_posted)
+      # bl: the payload is built again only to find the comments that did not fit into it
+      self.comments_to_append = []
+      self.build_issue_data(issue, comments)
+      issue.githubid = entry.github_number
+      self._upload_extra_comments(entry.github_number, issue, self.comments_to_append)
+
+  def _sync_issue(self, issue, entry):
+    """
+    Brings an issue that a previous run imported up to date with the export.
+    Issues whose updated timestamp did not change are skipped without looking at their content.
+    Otherwise changed issue fields are patched and comments that were not imported yet are appended.
+    """
+    if entry.updated_at == issue.updated_at:
+      return
+    jira_key = issue.key
+    comments = self._prepare_issue(issue)
+    content_hash, comment_hashes = self._issue_hashes(issue, comments)
+    if entry.content_hash is None:
+      # bl: journals of runs before delta imports don't know the imported content, so take the current one as imported
+      self.journal.record_content(jira_key, content_hash)
+      self.journal.record_comment_hashes(jira_key, comment_hashes)
+      self.journal.record_synced(jira_key, issue.updated_at, entry.post_processed)
+      return
+
+    changed = False
+    if content_hash != entry.content_hash:
+      if len(issue.body) > MAX_BODY_LENGTH:
+        print 'Body of {} is too long to be patched. Skipping the changed issue fields!'.format(jira_key)
+      else:
+        print 'Patching changed issue {} #{}'.format(jira_key, entry.github_number)
+        self._patch_issue(entry.github_number, issue)
+        self.journal.record_content(jira_key, content_hash)
+        changed = True
+
+    # bl: match the comments by hash. a comment created at a known time that does not match is one that was edited
+    imported = list(entry.comment_hashes)
+    imported_times = set(created_at for created_at, comment_hash in imported)
+    edited = 0
+    for comment, comment_hash in zip(comments, comment_hashes):
+      if comment_hash in imported:
+        imported.remove(comment_hash)
+      elif comment.created_at in imported_times:
+        edited += 1
+      else:
+        # bl: tracked by the comment hashes, the overflow count of the import is left alone
+        self.upload_extra_comment(entry.github_number, issue, comment, record=False)
+        entry.comment_hashes.append(comment_hash)
+        self.journal.record_comment_hashes(jira_key, entry.comment_hashes)
+        changed = True
+    if edited:
+      print '{} comments of {} were edited in JIRA. Edited comments are not synced!'.format(edited, jira_key)
+
+    # bl: patched texts might contain placeholders again
+    post_processed = entry.post_processed and (not changed or self.options.pre_resolve_references)
+    self.journal.record_synced(jira_key, issue.updated_at, post_processed)
+
+  def _patch_issue(self, gh_issue_id, issue):
+    issue_url = self.github_url + '/issues/' + str(gh_issue_id)
+    patch_data = {'title': issue.title,
+      'body': text(issue.body),
+      'state': 'closed' if issue.closed else 'open',
+      'labels': list(issue.labels)
+    }
+    if issue.milestone is not None:
+      patch_data['milestone'] = issue.milestone
+    response = self.client.patch(issue_url, patch_data)
+    metrics.add('issues_patched')
+    if response.status_code != 200:
+      raise RuntimeError(
+        "Failed to patch issue {} due to unexpected HTTP status code: {} ; text: {}".format(issue_url, response.status_code, response.text)
+      )
 
-  def import_issue_with_comments(self, issue, comments):
+  def _issue_hashes(self, issue, comments):
+    """
+    Returns the hash of the issue fields as imported and the (created_at, hash) pairs of its comments
+    """
+    content_hash = json_sha1([issue.title, issue.body, issue.closed, issue.closed_at, sorted(issue.labels), issue.milestone])
+    if isinstance(issue, ExportedIssue):
+      # bl: the comments were moved into the payload by the export, which kept their hashes
+      return content_hash, issue.comment_hashes
+    comment_hashes = [(comment.created_at, body_sha1(comment.body)) for comment in comments]
+    return content_hash, comment_hashes
+
+  def _record_submitted(self, issue, status_url):
+    content_hash, comment_hashes = self.issue_hashes
+    self.journal.record_submitted(issue.key, self.options.repo, self._payload_hash(), status_url,
+                                  issue.updated_at, content_hash, comment_hashes)
+
+  def _payload_hash(self):
+    return hashlib.sha1(json.dumps(self.issue_data, sort_keys=True)).hexdigest()
+
+  @metrics.timed('overflow_comments')
+  def _upload_extra_comments(self, gh_issue_id, issue, comments_to_append):
+    posted = 0
+    already_posted = self.journal.get(issue.key).overflow_posted if self.journal is not None else 0
+    for long_comment in comments_to_append:
+      posted = self.upload_extra_comment(gh_issue_id, issue, long_comment, posted, already_posted)
+    if self.journal is not None and comments_to_append:
+      self.journal.record_completed(issue.key)
+
+  def import_issue_with_comments(self, issue, comments, status_url=None):
     """
     Imports a single issue with its comments into GitHub.
     Importing via GitHub's normal Issue API quickly triggers anti-abuse rate limits.
@@ -134,117 +454,132 @@ class Importer:
     First the issue with the comments is pushed to GitHub asynchronously.
     Then GitHub is pulled in a loop until the issue import is completed.
     Finally the issue github is noted.    
+    With a status_url, the import that was already submitted by a previous run is picked up instead.
     """
 
     # bl: reset the array in case we have extra comments we need to create
     self.comments_to_append = []
 
-    print 'Issue ', issue['key']
-    jira_key = issue['key']
-    del issue['key']
-    headers = self.headers
-    headers['Accept'] = 'application/vnd.github.golden-comet-preview+json'
-    response = self.upload_github_issue(issue, comments, headers)
-    status_url = response.json()['url']
-    gh_issue_url = self.wait_for_issue_creation(status_url, headers).json()['issue_url']
+    print 'Issue ', issue.key
+    jira_key = issue.key
+    if status_url is None:
+      response = self.upload_github_issue(issue, comments)
+      status_url = response.json()['url']
+      if self.journal is not None:
+        self._record_submitted(issue, status_url)
+      self.status_tracker.track(response.json(), issue.get_number(), self.issue_data['issue'])
+    else:
+      self.status_tracker.track({'url': status_url})
+      self.build_issue_data(issue, comments)
+      entry = self.journal.get(jira_key)
+      if entry.payload_hash != self._payload_hash():
+        print 'The export of {} changed since its import was submitted. Keeping the submitted one.'.format(jira_key)
+    gh_issue_url = self.wait_for_issue_creation(status_url)['issue_url']
     gh_issue_id = int(gh_issue_url.split('/')[-1])
-    jira_num = int(jira_key.split("-",1)[1])
-    issue['key'] = jira_key
+    jira_num = issue.get_number()
     if jira_num != gh_issue_id:
         print 'Failed creating JIRA issue ' + str(jira_key) + '. Created #' + str(gh_issue_id) + '. Trying again!'
         #  bl: if the issue wasn't created with the right ID, try again. probably a deleted/skipped issue.
-        get_issue_url = self.github_url + '/issues/' + str(gh_issue_id)
-        response = requests.get(get_issue_url, headers=self.headers, timeout=Importer._DEFAULT_TIME_OUT)
-        if response.status_code != 200:
-            raise RuntimeError(
-                "Failed to get an issue we just created! unexpected HTTP status code: {}".format(response.status_code)
-            )
-
-        issue_json = response.json()
-        self.delete_issue(str(issue_json['node_id']))
+        self._delete_imported_issue(jira_key, gh_issue_id)
         self.import_issue_with_comments(issue, comments)
         return
-    issue['githubid'] = gh_issue_id
+    issue.githubid = gh_issue_id
     #print "\nGithub issue id: ", gh_issue_id
+    if self.journal is not None:
+      self.journal.record_imported(jira_key, gh_issue_id, not self.comments_to_append)
+    metrics.add('issues_imported')
 
     # bl: now manually create any one-off comments
-    for long_comment in self.comments_to_append:
-        self.upload_extra_comment(gh_issue_id, issue, long_comment)
+    self._upload_extra_comments(gh_issue_id, issue, self.comments_to_append)
     
-  def upload_github_issue(self, issue, comments, headers):
+  def _delete_imported_issue(self, jira_key, gh_issue_id):
+    get_issue_url = self.github_url + '/issues/' + str(gh_issue_id)
+    response = self.client.get(get_issue_url)
+    if response.status_code != 200:
+        raise RuntimeError(
+            "Failed to get an issue we just created! unexpected HTTP status code: {}".format(response.status_code)
+        )
+
+    issue_json = response.json()
+    if self.journal is not None:
+      # bl: forget the import before deleting its issue, so a crash in between submits it again on restart
+      self.journal.discard(jira_key)
+    self.delete_issue(str(issue_json['node_id']))
+
+  def upload_github_issue(self, issue, comments):
       """
       Uploads a single issue to GitHub asynchronously with the Issue Import API.
       """
       issue_url = self.github_url + '/import/issues'
-      self.trim_long_issue_body(issue, comments)
-      self.trim_payload_size(issue, comments)
+      if self.journal is not None:
+        # bl: taken before the payload is built, since that splits long bodies and moves comments out of it
+        self.issue_hashes = self._issue_hashes(issue, comments)
+      self.build_issue_data(issue, comments)
 
       # print json.dumps(issue_data, indent=2, sort_keys=True)
-      response = requests.post(issue_url, json=self.issue_data, headers=headers, timeout=Importer._DEFAULT_TIME_OUT)
+      response = self.client.post(issue_url, self.issue_data, kind=GitHubClient.IMPORT)
       if response.status_code == 202:
           return response
       elif response.status_code == 422:
           raise RuntimeError(
               "Initial import validation failed for issue '{}' due to the "
-              "following errors:\n{}".format(issue['title'], response.json())
+              "following errors:\n{}".format(issue.title, response.json())
           )
       else:
           raise RuntimeError(
               "Failed to POST issue: '{}' due to unexpected HTTP status code: {}\nerrors:\n{} \nURL {}"
-              .format(issue['title'], response.status_code, response.json(), issue_url)
+              .format(issue.title, response.status_code, response.json(), issue_url)
           )
 
 
-  def wait_for_issue_creation(self, status_url, headers):
+  def build_issue_data(self, issue, comments):
+      """
+      Builds the Issue Import API payload of an issue in issue_data.
+      Whatever does not fit into it is moved to comments_to_append.
+      """
+      if isinstance(issue, ExportedIssue):
+          self.issue_data = issue.to_import_data()
+          self.comments_to_append[0:0] = issue.overflow
+          return
+      self.trim_long_issue_body(issue, comments)
+      self.trim_payload_size(issue, comments)
+
+  def wait_for_issue_creation(self, status_url, issue_data=None):
       """
-      Check the status of a GitHub issue import.
-      If the status is 'pending', it sleeps, then rechecks until the status is
-      either 'imported' or 'failed'.
+      Check the status of a tracked GitHub issue import.
+      The status tracker rechecks it, timed by how long imports have been taking,
+      until the status is either 'imported' or 'failed'. Returns the final status.
       """
-      i = 0
-      while True:  # keep checking until status is something other than 'pending'
-          response = requests.get(status_url, headers=headers, timeout=Importer._DEFAULT_TIME_OUT)
-          if response.status_code != 200:
-              print "Failed to check GitHub issue import status url: {} due to unexpected HTTP status code: {}".format(status_url, response.status_code)
-              i = i+1
-              if i > 100:
-                  raise RuntimeError("Failing import status check permanently!")
-          else:
-              status = response.json()['status']
-              if status != 'pending':
-                  break
-          time.sleep(1)
-      if status == 'imported':
-          print "Imported Issue:", response.json()['issue_url']
-      elif status == 'failed':
-          print "Issue JSON: " + json.dumps(self.issue_data)
+      status, duration = self.status_tracker.wait(status_url)
+      if status['status'] == 'imported':
+          print "Imported Issue: {} in {:.1f}s".format(status['issue_url'], duration)
+      elif status['status'] == 'failed':
+          print "Issue JSON: " + json.dumps(issue_data if issue_data is not None else self.issue_data)
           raise RuntimeError(
               "Failed to import GitHub issue due to the following errors:\n{}"
-              .format(response.json())
+              .format(status)
           )
       else:
           raise RuntimeError(
               "Status check for GitHub issue import returned unexpected status: '{}'"
-              .format(status)
+              .format(status['status'])
           )
-      return response
+      return status
 
   def trim_long_issue_body(self, issue, comments):
-      body = issue['body']
+      body = issue.body
       body_len = len(body)
-      if body_len > 65536:
-          n = 65436
-          # bl: split the body into comments so that no data is lost
-          chunks = [body[i:i+n] for i in range(0, len(body), n)]
+      if body_len > MAX_BODY_LENGTH:
+          # bl: split the body into comments so that no data is lost. the chunks of a stored body stay handles
+          chunks = split_body(body)
           chunk_len = len(chunks)
           for i in range(chunk_len):
-              chunk = chunks[i]
-              chunk = '<i>issue chunk ' + str(i + 1) + ' of ' + str(chunk_len) + '</i>\n' + chunk
+              chunk = prepend('<i>issue chunk ' + str(i + 1) + ' of ' + str(chunk_len) + '</i>\n', chunks[i])
               # bl: the first chunk is the main issue body. the rest will be comments in order
               if i == 0:
-                  issue['body'] = chunk
+                  issue.body = text(chunk)
               else:
-                  comments.insert(i-1, {'body': chunk, 'created_at': issue['created_at']})
+                  comments.insert(i-1, Comment(issue.created_at, chunk))
 
   def trim_payload_size(self, issue, comments):
       # bl: find the lowest index of the comment that we need to remove and start inserting at the end. it will either be the first comment over 64KB
@@ -254,141 +589,95 @@ class Importer:
       num_comments = len(comments)
       for i in range(num_comments):
           comment = comments[i]
-          comment_len = len(comment['body'])
-          if comment_len > 65536:
+          comment_len = len(comment.body)
+          if comment_len > MAX_BODY_LENGTH:
               comment_to_strip_from = i
               break
 
+      # bl: the encoded payload is the payload without comments plus every encoded comment and a ', ' between them,
+      # so each part is encoded once and the size with the first i comments is a running total
+      issue_payload = issue.to_payload()
+      payload_sizes = [len(json.dumps({'issue': issue_payload, 'comments': []}))]
+      for comment in comments:
+          payload_sizes.append(payload_sizes[-1] + comment.payload_length() + (2 if len(payload_sizes) > 1 else 0))
+
       # bl: work from the back forward until the issue_data body is less than 1MB
       for i in range(num_comments, 0, -1):
-          self.issue_data = {'issue': issue, 'comments': comments[0:i]}
           # bl: once the body is under 1MB, we are done
-          if len(json.dumps(self.issue_data)) <= 1048576:
+          if payload_sizes[i] <= 1048576:
               if i < num_comments:
                   # bl: strip from the earliest comment that we found to be a problem
                   comment_to_strip_from = min(comment_to_strip_from, i)
               break
 
-      self.issue_data = {'issue': issue, 'comments': comments[0: comment_to_strip_from if comment_to_strip_from is not None else num_comments]}
+      # bl: only the comments that fit are encoded, stored bodies that don't are left on disk
+      self.issue_data = {'issue': issue_payload, 'comments': [comment.to_payload() for comment in comments[0: comment_to_strip_from if comment_to_strip_from is not None else num_comments]]}
 
       if comment_to_strip_from is not None:
           self.remove_comments_from(comments, comment_to_strip_from)
 
   def remove_comments_from(self, comments, index):
-      # bl: to avoid indexing issues, work from the back of the list to the front
+      # bl: the removed comments go in front of the ones to append, in their original order
       for i in range(len(comments)-1, index-1, -1):
-          removed_comment = comments[i]
-          del comments[i]
-          self.comments_to_append.insert(0, removed_comment)
           print 'Removed comment {}'.format(i)
+      self.comments_to_append[0:0] = comments[index:]
+      del comments[index:]
 
-  def upload_extra_comment(self, gh_issue_id, issue, comment):
+  def upload_extra_comment(self, gh_issue_id, issue, comment, posted=0, already_posted=0, record=True):
+      """
+      Posts a comment that did not fit into the import payload, split into chunks if necessary.
+      posted counts the chunks posted for the issue before this comment; chunks a previous run
+      already posted are skipped. Returns the count including the chunks of this comment.
+      Without record, the posted chunks are not counted as overflow comments in the journal.
+      """
       issue_comment_url = self.github_url + '/issues/' + str(gh_issue_id) + '/comments'
 
-      headers = self.headers
-      headers['Content-Type'] = 'application/json'
-
-      body = comment['body']
+      body = comment.body
       # bl: prepend the original comment date since it's going to be lost
-      # bl: comments can be at most 65,536 characters. reduce by 100 so we can add the prefix for each chunk
-      n = 65436
+      # bl: comments can be at most 65,536 characters. chunks are 100 shorter so we can add the prefix for each chunk
       # bl: split the long comment into multiple comments so that no data is lost
-      chunks = [body[i:i+n] for i in range(0, len(body), n)]
-      chunk_len = len(chunks)
-      for i in range(chunk_len):
-          chunk = chunks[i]
+      chunk_len = len(chunk_spans(len(body)))
+      for i, chunk in enumerate(text_chunks(body)):
           # bl: identify if this is a comment or an extension of the issue body by the post time
-          if issue['created_at'] != comment['created_at']:
+          if issue.created_at != comment.created_at:
               if i == 0:
-                  chunk = '<i>originally posted at ' + comment['created_at'] + '</i>\n' + chunk
+                  chunk = '<i>originally posted at ' + comment.created_at + '</i>\n' + chunk
               if chunk_len > 1:
                   chunk = '<i>comment chunk ' + str(i + 1) + ' of ' + str(chunk_len) + '</i>\n' + chunk
           new_comment = {'body': chunk}
 
-          response = requests.post(issue_comment_url, json=new_comment, headers=headers, timeout=Importer._DEFAULT_TIME_OUT)
+          posted += 1
+          if posted <= already_posted:
+              continue
+          response = self.client.post(issue_comment_url, new_comment)
           if response.status_code != 201:
               raise RuntimeError(
                   "Failed to post issue comment {} due to unexpected HTTP status code: {} ; text: {}".format(issue_comment_url, response.status_code, response.text)
               )
-      print 'Appended {} comments for comment in issue #{}'.format(len(chunks), gh_issue_id)
+          metrics.add('overflow_comments_posted')
+          if self.journal is not None and record:
+              self.journal.record_overflow_posted(issue.key, posted)
+      print 'Appended {} comments for comment in issue #{}'.format(chunk_len, gh_issue_id)
+      return posted
 
   def convert_relationships_to_comments(self, issue):
-    duplicates = issue['duplicates']
-    is_duplicated_by = issue['is-duplicated-by']
-    requires = issue['requires']
-    is_required_by = issue['is-required-by']
-    caused = issue['caused']
-    is_caused_by = issue['is-caused-by']
-    incorporates = issue['incorporates']
-    is_incorporateed_by = issue['is-incorporated-by']
-    relates_to = issue['relates-to']
-    is_related_to = issue['is-related-to']
-    depends_on = issue['depends-on']
-    blocks = issue['blocks']
-
-    for duplicate_item in duplicates:
-      self._add_link_to_issue(issue, "Duplicates: " + self._replace_jira_with_github_id(duplicate_item))
-
-    for is_duplicated_by_item in is_duplicated_by:
-      self._add_link_to_issue(issue, "Is duplicated by: " + self._replace_jira_with_github_id(is_duplicated_by_item))
-
-    for require_item in requires:
-      self._add_link_to_issue(issue, "Requires: " + self._replace_jira_with_github_id(require_item))
-
-    for is_required_by_item in is_required_by:
-      self._add_link_to_issue(issue, "Is required by: " + self._replace_jira_with_github_id(is_required_by_item))
-
-    for caused_item in caused:
-      self._add_link_to_issue(issue, "Caused: " + self._replace_jira_with_github_id(caused_item))
-
-    for is_caused_by_item in is_caused_by:
-      self._add_link_to_issue(issue, "Is caused by: " + self._replace_jira_with_github_id(is_caused_by_item))
-
-    for incorporates_item in incorporates:
-      self._add_link_to_issue(issue, "Caused: " + self._replace_jira_with_github_id(incorporates_item))
-
-    for is_incorporated_by_item in is_incorporateed_by:
-      self._add_link_to_issue(issue, "Is caused by: " + self._replace_jira_with_github_id(is_incorporated_by_item))
-
-    for relates_to_item in relates_to:
-      self._add_link_to_issue(issue, "Relates to: " + self._replace_jira_with_github_id(relates_to_item))
-
-    for is_related_to_item in is_related_to:
-      self._add_link_to_issue(issue, "Is related to: " + self._replace_jira_with_github_id(is_related_to_item))
-
-    for depends_on_item in depends_on:
-      self._add_link_to_issue(issue, "Depends on: " + self._replace_jira_with_github_id(depends_on_item))
-
-    for blocks_item in blocks:
-      self._add_link_to_issue(issue, "Blocks: " + self._replace_jira_with_github_id(blocks_item))
-
-    del issue['duplicates']
-    del issue['is-duplicated-by']
-    del issue['requires']
-    del issue['is-required-by']
-    del issue['caused']
-    del issue['is-caused-by']
-    del issue['incorporates']
-    del issue['is-incorporated-by']
-    del issue['relates-to']
-    del issue['is-related-to']
-    del issue['depends-on']
-    del issue['blocks']
+    prefixes = dict(LINK_KINDS)
+    for link in issue.pop_links():
+      self._add_link_to_issue(issue, prefixes[link.kind] + ": " + self._replace_jira_with_github_id(link.key))
 
   def _add_link_to_issue(self, issue, body):
-      issue['comments'].insert(0, {"created_at": issue["created_at"], "body": body})
-
-  def _replace_jira_urls_for_github(self, text):
-    result = text
-    for pattern, replacement in self.jira_issue_url_replace_patterns.iteritems():
-      result = re.sub(pattern, replacement, result)
-    return result
+      issue.comments.insert(0, Comment(issue.created_at, body))
 
   def _replace_jira_with_github_id(self, text):
-    result = text
-    for pattern, replacement in self.jira_issue_replace_patterns.iteritems():
-      result = re.sub(pattern, Importer._PLACEHOLDER_PREFIX + replacement + Importer._PLACEHOLDER_SUFFIX, result)
-    return self._replace_jira_urls_for_github(result)
+    if isinstance(text, StoredBody):
+      # bl: no reference spans lines, so stored bodies are rewritten a few lines at a time
+      return bodies.rewrite(text, self._replace_jira_with_github_id)
+    text = self.reference_rewriter.rewrite(text)
+    if self.options.pre_resolve_references:
+      # bl: GitHub issue numbers are forced to match the JIRA ones, so the placeholders can be resolved
+      # before the import exactly like post-processing would resolve them afterwards
+      text = self.placeholder_resolver.resolve(text)
+    return text
       
   def post_process_comments(self):
     """
@@ -398,45 +687,95 @@ class Importer:
     while comment_url is not None:
         comment_url = self._post_process_comments(comment_url)
 
-  def post_process_issue_comments(self, issue_id):
+  @metrics.timed('post_process')
+  def post_process_issue_comments(self, issue_id, verify=False):
     """
     Starts post-processing all issue comments.
+    With verify, nothing is patched and bodies that would still change are only reported.
+    Issues the journal records as post-processed are skipped.
     """
+    jira_key = self.project.name + '-' + str(issue_id)
+    if self.journal is not None:
+      entry = self.journal.get(jira_key)
+      if entry is not None and entry.post_processed:
+        return
+    unresolved_bodies = self.unresolved_bodies
+    self._post_process_issue_comments(issue_id, verify)
+    # bl: bodies that were only verified still need a real post-processing run
+    if self.journal is not None and self.unresolved_bodies == unresolved_bodies:
+      self.journal.record_post_processed(jira_key, self.options.repo)
+
+  @metrics.timed('post_process')
+  def post_process_issues(self, verify=False):
+    """
+    Post-processes the issues from first_issue_id to last_issue_id with GraphQL: their bodies and comments are read
+    for a page of issues at a time and the changed ones written back in batches.
+    With verify, nothing is patched and bodies that would still change are only reported.
+    Issues the journal records as post-processed are skipped.
+    """
+    processor = PostProcessor(self.client, self.options.account, self.options.repo)
+    processed = 0
+    for page in processor.issues(self.options.first_issue_id, self.options.last_issue_id):
+      changes = []
+      keys = []
+      for issue in page:
+        jira_key = self.project.name + '-' + str(issue['number'])
+        if self.journal is not None:
+          entry = self.journal.get(jira_key)
+          if entry is not None and entry.post_processed:
+            continue
+        unresolved_bodies = self.unresolved_bodies
+        body = self._resolved_body('#' + str(issue['number']), issue['body'], verify)
+        if body is not None:
+          changes.append((issue['id'], False, body))
+        for comment in issue['comments']:
+          body = self._resolved_body('comment {} of #{}'.format(comment['id'], issue['number']), comment['body'], verify)
+          if body is not None:
+            changes.append((comment['id'], True, body))
+        processed += 1
+        # bl: bodies that were only verified still need a real post-processing run
+        if self.unresolved_bodies == unresolved_bodies:
+          keys.append(jira_key)
+      processor.update(changes)
+      metrics.add('bodies_patched', len(changes))
+      if self.journal is not None:
+        for jira_key in keys:
+          self.journal.record_post_processed(jira_key, self.options.repo)
+    print 'Post-processed {} issues of {} with {} GraphQL requests'.format(processed, self.options.repo, processor.requests)
+
+  def _post_process_issue_comments(self, issue_id, verify):
     issue_url = self.github_url + '/issues/' + str(issue_id)
     print "getting issue using " + issue_url
-    response = requests.get(issue_url, headers=self.headers, timeout=Importer._DEFAULT_TIME_OUT)
+    response = self.client.get(issue_url)
     if response.status_code == 404 or response.status_code == 410:
         print "Issue #{} doesn't exist (status code: {}). Skipping!".format(issue_id, response.status_code)
         return
-    if response.status_code == 403:
-        print "Issue #{} error. Rate limit exceeded? (status code: {}). Sleeping a minute and trying again!".format(issue_id, response.status_code)
-        time.sleep(100)
-        self.post_process_issue_comments(issue_id)
-        return
+    if response.status_code != 200:
+        raise RuntimeError(
+            "Failed to get issue #{} due to unexpected HTTP status code: {} ; text: {}".format(issue_id, response.status_code, response.text)
+        )
     issue = response.json()
-    self._patch_body(issue_url, issue['body'])
+    self._patch_body(issue_url, issue['body'], verify)
 
     comment_url = issue_url + '/comments'
     while comment_url is not None:
-        comment_url = self._post_process_comments(comment_url)
+        comment_url = self._post_process_comments(comment_url, verify)
     
-  def _post_process_comments(self, url):
+  def _post_process_comments(self, url, verify=False):
     """
     Paginates through all issue comments and replaces the issue id placeholders with the correct issue ids.
     """    
     print "listing comments using " + url
-    response = requests.get(url, headers=self.headers, timeout=Importer._DEFAULT_TIME_OUT)
+    response = self.client.get(url)
     if response.status_code != 200:
-        print "Failed to list all comments due to unexpected HTTP status code: {}".format(response.status_code)
-        print "Sleeping 10 seconds"
-        time.sleep(10)
-        self._post_process_comments(url)
-        return
-      
+        raise RuntimeError(
+            "Failed to list all comments {} due to unexpected HTTP status code: {} ; text: {}".format(url, response.status_code, response.text)
+        )
+
     comments = response.json()
     for comment in comments:
       # print "handling comment " + comment['url']
-      self._patch_body(comment['url'], comment['body'])
+      self._patch_body(comment['url'], comment['body'], verify)
     try:
       next_comments = response.links["next"]
       if next_comments:
@@ -450,35 +789,31 @@ class Importer:
     return None
 
   def _replace_github_id_placholder(self, text):
-    result = text
-    pattern = Importer._PLACEHOLDER_PREFIX + r'(\d+)' + Importer._PLACEHOLDER_SUFFIX
-    result = re.sub(pattern, r'#\1', result)
-    result = re.sub(r'<a href=\"https://github\.com/SocialStrata/crowdstack/issues/[0-9]+(.*?)".*?>(<del>)?(#|TUR-|HLA-|https://github.com/SocialStrata/crowdstack/issues/|SocialStrata/crowdstack#)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/crowdstack#\4', result)
-    result = re.sub(r'<a href=\"https://github\.com/SocialStrata/eve/issues/[0-9]+(.*?)".*?>(<del>)?(#|https://github.com/SocialStrata/eve/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/eve#\4', result)
-    result = re.sub(r'<a href=\"https://github\.com/SocialStrata/operations/issues/[0-9]+(.*?)".*?>(<del>)?(#|https://github.com/SocialStrata/operations/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/operations#\4', result)
-    result = re.sub(r'<a href=\"https://github\.com/SocialStrata/web-sites/issues/[0-9]+(.*?)".*?>(<del>)?(#|https://github.com/SocialStrata/web-sites/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/web-sites#\4', result)
-    result = re.sub(r'<a href=\"https://github\.com/SocialStrata/right-starts/issues/[0-9]+(.*?)".*?>(<del>)?(#|https://github.com/SocialStrata/right-starts/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/right-starts#\4', result)
-    result = re.sub(r'<a href=\"https://github\.com/SocialStrata/customer-service/issues/[0-9]+(.*?)".*?>(<del>)?(#|https://github.com/SocialStrata/customer-service/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/customer-service#\4', result)
-    result = re.sub(r'<a href=\"https://github\.com/SocialStrata/hoodo/issues/[0-9]+(.*?)".*?>(<del>)?(#|https://github.com/SocialStrata/hoodo/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/hoodo#\4', result)
-    result = re.sub(r'<a href=\"https://hub\.socialstrata\.com/jira/browse/#[0-9]+(.*?)".*?>(<del>)?(#|https://hub.socialstrata.com/jira/browse/#)([0-9]+)(.*?)(</del>)?</a>', r'#\4', result)
-    result = re.sub(r'<a href=\"https://hub\.socialstrata\.com/jira/browse/https://github\.com/SocialStrata/crowdstack/issues/[0-9]+(.*?)".*?>(<del>)?(#|TUR-|HLA-|https://github.com/SocialStrata/crowdstack/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/crowdstack#\4', result)
-    result = re.sub(r'<a href=\"https://hub\.socialstrata\.com/jira/browse/https://github\.com/SocialStrata/eve/issues/[0-9]+(.*?)".*?>(<del>)?(#|TUR-|HLA-|https://github.com/SocialStrata/eve/issues/)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/eve#\4', result)
-    result = re.sub(r'<a href=\"https://hub\.socialstrata\.com/jira/browse/#[0-9]+(.*?)".*?>(<del>)?(#|TUR-|HLA-)([0-9]+)(.*?)(</del>)?</a>', r'SocialStrata/crowdstack#\4', result)
-    # bl: replace old JIRA URLs with the GitHub counterpart
-    result = re.sub(r'>https://hub\.socialstrata\.com/jira/browse/(#[0-9]+)</a>', r'>\1</a>', result)
-    result = re.sub(r'(TUR|HLA)-([0-9]+)', r'SocialStrata/crowdstack#\2', result)
-    return result
-
-  def _patch_body(self, url, body):
+    return self.placeholder_resolver.resolve(text)
+
+  def _patch_body(self, url, body, verify=False):
+      body = self._resolved_body(url, body, verify)
+      if body is not None:
+          self._patch_body_index(url, body)
+
+  def _resolved_body(self, name, body, verify):
+      """
+      Returns the body with its placeholders replaced, or None if there are none or they are only verified
+      """
       original_body = body
       body = self._replace_github_id_placholder(original_body)
       if body == original_body:
-          return
-      print "Patching body: {}".format(original_body.encode("utf8"))
-      print "New body: {}".format(body.encode("utf8"))
-      self._patch_body_index(url, body, 0)
-
-  def _patch_body_index(self, url, body, i):
+          return None
+      if verify:
+          self.unresolved_bodies += 1
+          print "Unresolved references in body: {}".format(name)
+          return None
+      if self.options.verbose:
+          print "Patching body: {}".format(original_body.encode("utf8"))
+          print "New body: {}".format(body.encode("utf8"))
+      return body
+
+  def _patch_body_index(self, url, body):
     """
     Patches the body of a single Github issue or comment.
     """
@@ -486,61 +821,44 @@ class Importer:
     # print "new body:" + body
     patch_data = {'body': body}
     # print patch_data
-    response = requests.patch(url, json=patch_data, headers=self.headers, timeout=Importer._DEFAULT_TIME_OUT)
+    response = self.client.patch(url, patch_data)
+    metrics.add('bodies_patched')
     if response.status_code != 200:
-        print "Failed to patch body {} due to unexpected HTTP status code: {} ; text: {}".format(url, response.status_code, response.text)
-        time.sleep(3)
-        if i > 20:
-            raise RuntimeError("Failed 20 times. Quitting.")
-        self._patch_body_index(url, body, i+1)
+        raise RuntimeError(
+            "Failed to patch body {} due to unexpected HTTP status code: {} ; text: {}".format(url, response.status_code, response.text)
+        )
 
   def purge_existing_issues(self):
-    print "Calling graphql api..."
-
-    
-    headers = self.headers
-    headers['Content-Type'] = 'application/json'
-
-    q = """
-    {
-      __typename
-      search(type: ISSUE, query: "repo:""" + self.options.account + '/' + self.options.repo + """", first: 100) {
-        nodes {
-          ... on Issue {
-            id
-          }
-        }
-      }
-    }
     """
-
-    print 'query: {}'.format(q)
-    response = requests.post(self.githubGQL_url, headers=headers, json={'query': q})
-    if response.status_code != 200:
-      raise RuntimeError(
-            "Failed to get issues {} due to unexpected HTTP status code: {} ; text: {}".format(self.githubGQL_url, response.status_code, response.text)
-          )
-    else:
-      data = response.json()
-      
-      for node in data['data']['search']['nodes'] :
-          self.delete_issue_with_headers(node['id'], headers)
+    Deletes all issues of the repository, e.g. to reset it between rehearsals, and forgets them in the journal
+    """
+    IssuePurger(self.client, self.options.account, self.options.repo).purge()
+    if self.journal is not None:
+      self.journal.discard_repo(self.options.repo)
 
   def delete_issue(self, id):
-    headers = self.headers
-    headers['Content-Type'] = 'application/json'
-    self.delete_issue_with_headers(id, headers)
-
-  def delete_issue_with_headers(self, id, headers):
       d = """
           mutation {   deleteIssue(input: {issueId: \"""" + id + """\"}) {     clientMutationId    repository {      id    }  }}
           """
       print 'query: {}'.format(d)
 
-      response = requests.post(self.githubGQL_url, headers=headers, json={'query': d})
+      response = self.client.graphql(d)
       if response.status_code != 200:
         raise RuntimeError(
               "Failed to get issues {} due to unexpected HTTP status code: {} ; text: {}".format(self.githubGQL_url, response.status_code, response.text)
             )
       else:
         print response.json()
+
+
+class _PendingImport(object):
+  """
+  An issue import that was submitted to GitHub and is waiting to be completed
+  """
+  __slots__ = ('issue', 'status_url', 'issue_data', 'comments_to_append')
+
+  def __init__(self, issue, status_url, issue_data, comments_to_append):
+    self.issue = issue
+    self.status_url = status_url
+    self.issue_data = issue_data
+    self.comments_to_append = comments_to_append
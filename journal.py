@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import json
+import sqlite3
+from collections import namedtuple
+
+JournalEntry = namedtuple("JournalEntry", "jira_key repo payload_hash status_url github_number overflow_posted state post_processed"
+                                          " updated_at content_hash comment_hashes")
+
+# bl: columns added after the first journals were written, with their types
+_ADDED_COLUMNS = (
+  ('updated_at', 'TEXT'),
+  ('content_hash', 'TEXT'),
+  ('comment_hashes', 'TEXT')
+)
+
+
+class Journal:
+  """
+  Durable record of the migration progress in a local SQLite database, one row per JIRA key.
+  Every step of an issue import is committed as soon as GitHub confirmed it,
+  so a crashed migration can skip finished work and pick up pending imports on restart.
+  The imported content is recorded as hashes, so later runs can tell which issues changed in JIRA.
+  """
+
+  # bl: the import was accepted by GitHub and its status url is known
+  SUBMITTED = 'submitted'
+
+  # bl: the issue exists on GitHub, but overflow comments may still be missing
+  IMPORTED = 'imported'
+
+  # bl: the issue and all of its overflow comments exist on GitHub
+  COMPLETED = 'completed'
+
+  def __init__(self, file_name):
+    self.file_name = file_name
+    # bl: the worker processes of a parallel migration write to the same journal, and wait their turn
+    self._connection = sqlite3.connect(file_name, timeout=60.0)
+    self._connection.execute('PRAGMA journal_mode=WAL')
+    self._connection.execute('PRAGMA synchronous=NORMAL')
+    with self._connection:
+      self._connection.execute(
+        'CREATE TABLE IF NOT EXISTS issues ('
+        ' jira_key TEXT PRIMARY KEY,'
+        ' repo TEXT NOT NULL,'
+        ' payload_hash TEXT,'
+        ' status_url TEXT,'
+        ' github_number INTEGER,'
+        ' overflow_posted INTEGER NOT NULL DEFAULT 0,'
+        ' state TEXT,'
+        ' post_processed INTEGER NOT NULL DEFAULT 0)')
+      columns = set(row[1] for row in self._connection.execute('PRAGMA table_info(issues)'))
+      for name, column_type in _ADDED_COLUMNS:
+        if name not in columns:
+          self._connection.execute('ALTER TABLE issues ADD COLUMN ' + name + ' ' + column_type)
+
+  def get(self, jira_key):
+    row = self._connection.execute(
+      'SELECT jira_key, repo, payload_hash, status_url, github_number, overflow_posted, state, post_processed,'
+      ' updated_at, content_hash, comment_hashes FROM issues WHERE jira_key = ?', (jira_key,)).fetchone()
+    if row is None:
+      return None
+    entry = JournalEntry(*row)
+    return entry._replace(comment_hashes=[tuple(pair) for pair in json.loads(entry.comment_hashes or '[]')])
+
+  def record_submitted(self, jira_key, repo, payload_hash, status_url, updated_at=None, content_hash=None, comment_hashes=()):
+    """
+    Records an import GitHub accepted. comment_hashes are the (created_at, hash) pairs of all comments of the issue,
+    including the ones that are appended after the import.
+    """
+    with self._connection:
+      self._connection.execute(
+        'INSERT OR REPLACE INTO issues (jira_key, repo, payload_hash, status_url, state, updated_at, content_hash, comment_hashes)'
+        ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        (jira_key, repo, payload_hash, status_url, Journal.SUBMITTED, updated_at, content_hash, json.dumps(list(comment_hashes))))
+
+  def record_imported(self, jira_key, github_number, completed):
+    with self._connection:
+      self._connection.execute(
+        'UPDATE issues SET github_number = ?, state = ? WHERE jira_key = ?',
+        (github_number, Journal.COMPLETED if completed else Journal.IMPORTED, jira_key))
+
+  def record_overflow_posted(self, jira_key, overflow_posted):
+    with self._connection:
+      self._connection.execute('UPDATE issues SET overflow_posted = ? WHERE jira_key = ?', (overflow_posted, jira_key))
+
+  def record_completed(self, jira_key):
+    with self._connection:
+      self._connection.execute('UPDATE issues SET state = ? WHERE jira_key = ?', (Journal.COMPLETED, jira_key))
+
+  def record_content(self, jira_key, content_hash):
+    with self._connection:
+      self._connection.execute('UPDATE issues SET content_hash = ? WHERE jira_key = ?', (content_hash, jira_key))
+
+  def record_comment_hashes(self, jira_key, comment_hashes):
+    with self._connection:
+      self._connection.execute('UPDATE issues SET comment_hashes = ? WHERE jira_key = ?', (json.dumps(list(comment_hashes)), jira_key))
+
+  def record_synced(self, jira_key, updated_at, post_processed):
+    with self._connection:
+      self._connection.execute('UPDATE issues SET updated_at = ?, post_processed = ? WHERE jira_key = ?',
+                               (updated_at, int(post_processed), jira_key))
+
+  def record_post_processed(self, jira_key, repo):
+    with self._connection:
+      # bl: issues that were never imported, like deleted JIRA issues, are post-processed too
+      self._connection.execute('INSERT OR IGNORE INTO issues (jira_key, repo) VALUES (?, ?)', (jira_key, repo))
+      self._connection.execute('UPDATE issues SET post_processed = 1 WHERE jira_key = ?', (jira_key,))
+
+  def discard(self, jira_key):
+    with self._connection:
+      self._connection.execute('DELETE FROM issues WHERE jira_key = ?', (jira_key,))
+
+  def discard_repo(self, repo):
+    with self._connection:
+      self._connection.execute('DELETE FROM issues WHERE repo = ?', (repo,))
+
+  def close(self):
+    self._connection.close()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+End-to-end load test of a migration against a local fake GitHub API.
+Generates a synthetic JIRA export, imports it into fake_github with the usual importer steps
+and writes the throughput and the requests the server saw as JSON.
+Usage: python load_test.py [options]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from fake_github import FakeGitHubServer, add_settings_arguments as add_server_arguments, settings_from_arguments as server_settings
+from importer import Importer, Options
+from metrics import metrics
+from project import Project
+from reader import add_xml_files_to_project
+from synthetic_export import generate_exports, add_settings_arguments as add_export_arguments, settings_from_arguments as export_settings
+
+
+def _timed(fn):
+  start = time.time()
+  fn()
+  return round(time.time() - start, 4)
+
+
+def run_load_test(args, directory):
+  settings = export_settings(args)
+  server = FakeGitHubServer(server_settings(args))
+  api_url = server.start()
+  print >> sys.stderr, 'Fake GitHub API at', api_url
+
+  # bl: stopped before main puts stdout back, so none of the server's threads outlive the test
+  try:
+    project = Project(settings.project)
+    add_xml_files_to_project(project, generate_exports(directory, settings), processes=1)
+    project.merge_labels_and_components()
+    project.prettify()
+    issues = len(project.get_issues())
+
+    journal_file = os.path.join(directory, 'load-test.journal') if args.journal else None
+    importer = Importer(Options(user='', account='SocialStrata', repo='load-test', token='load-test', first_issue_id=1,
+                                last_issue_id=settings.issues, pre_resolve_references=args.pre_resolve_references,
+                                import_window=args.import_window, http_pool_size=args.import_window + 2,
+                                journal_file=journal_file, api_url=api_url), project)
+    phases = {}
+    phases['milestones'] = _timed(importer.import_milestones)
+    phases['labels'] = _timed(importer.import_labels)
+    phases['issues'] = _timed(importer.import_issues)
+    if args.post_process:
+      def post_process():
+        for issue_id in range(1, settings.issues + 1):
+          importer.post_process_issue_comments(issue_id, verify=args.pre_resolve_references)
+      phases['post_processing'] = _timed(post_process)
+  finally:
+    server.stop()
+
+  return {
+    'settings': settings._asdict(),
+    'server': server.github.settings._asdict(),
+    'import_window': args.import_window,
+    'issues': issues,
+    'seconds': phases,
+    'issues_per_second': round(issues / max(phases['issues'], 1e-9), 1),
+    'rate_limit_wait_seconds': round(importer.client.rate_limiter.wait_time, 4),
+    'requests': server.github.stats(),
+    'metrics': metrics.snapshot()
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Load tests a migration against a local fake GitHub API.')
+  add_export_arguments(parser)
+  add_server_arguments(parser)
+  parser.add_argument('--import-window', type=int, default=10, help='number of issue imports in flight')
+  parser.add_argument('--no-pre-resolve', dest='pre_resolve_references', action='store_false', help='import placeholders and post-process')
+  parser.add_argument('--post-process', action='store_true', help='also run the post-processing')
+  parser.add_argument('--journal', action='store_true', help='keep a journal of the import')
+  parser.add_argument('--output', help='file to write the JSON results to instead of stdout')
+  parser.add_argument('--keep', help='directory to keep the generated export in')
+  parser.set_defaults(issues=200)
+  args = parser.parse_args()
+
+  directory = args.keep or tempfile.mkdtemp()
+  # bl: the importer reports every issue on stdout, which is kept for the results
+  stdout = sys.stdout
+  sys.stdout = sys.stderr
+  try:
+    results = run_load_test(args, directory)
+  finally:
+    sys.stdout = stdout
+    if not args.keep:
+      shutil.rmtree(directory)
+  output = json.dumps(results, indent=2, sort_keys=True)
+  if args.output:
+    with open(args.output, 'w') as f:
+      f.write(output + '\n')
+  else:
+    print output
+
+
+if __name__ == '__main__':
+  main()
@@ -1,14 +1,17 @@
 #!/usr/bin/env python
 
 import getpass
-from collections import namedtuple
-from lxml import objectify
+import os
 from project import Project
-from importer import Importer
-
-def read_xml_sourcefile(file_name):
-  all_text = open(file_name).read()
-  return objectify.fromstring(all_text)
+from importer import Importer, Options
+from reader import add_xml_files_to_project
+from cache import ProjectCache
+from body_store import bodies
+from metrics import metrics
+from payloads import PayloadReader
+from github import share_budget
+from journal import Journal
+from orchestrator import Orchestrator
 
 #file_name = raw_input('Path to JIRA XML query file: ')
 #jiraProj = raw_input('JIRA project name to use: ')
@@ -73,50 +76,187 @@ project_configs = [
     }
 ]
 
-#purge flag
+# bl: old JIRA project keys whose issues now live in one of the repositories above
+jira_key_aliases = {
+    'HLA': 'crowdstack'
+}
+
+jira_repos = dict((project_config['jira_proj'], project_config['repo']) for project_config in project_configs)
+jira_repos.update(jira_key_aliases)
+
+#write the final GitHub issue references into the imported issues instead of placeholders.
+#post-processing then only verifies the imported texts, if enabled
+pre_resolve_references = "true"
+verify_post_processing = "false"
+
+#number of issue imports that may be in flight at once. their status is checked with bulk requests.
+#an issue GitHub numbers wrongly is deleted and imported again, after the imports in flight were drained.
+#the migration only stops if its number was handed out already, e.g. to a pull request opened meanwhile
+import_window = 10
+
+#keep-alive connections kept open to GitHub per repository, at least one per in-flight import
+http_pool_size = import_window + 2
+
+#SQLite journal of the migration progress. a restarted migration skips what is recorded as done
+#and picks up pending imports. set to None to not keep one. purging a repository forgets its issues
+journal_file = "migration.journal"
+
+#rehearsal runs: bring issues the journal records as imported up to date with the export.
+#changed issue fields are patched and new comments appended, new issues are imported as usual
+delta_import = "false"
+
+#GitHub API to migrate into. point it at a local fake_github.py server for rehearsals
+api_url = "https://api.github.com"
+
+#phase timings, request counts and latencies are written to this file every 30 seconds while migrating,
+#in the Prometheus textfile format if it ends in .prom and as JSON otherwise. set to None to not write them
+metrics_file = "migration-metrics.prom"
+
+#print the old and new texts of every body patched during post-processing
+verbose = "false"
+
+#purge flag: delete all issues of each repository before importing into it
 purge_before_import = "false"
 
-importers = []
+#stream <item>s out of the XML exports instead of loading each file as a whole
+streaming_ingestion = "true"
+
+#parse the export files of a project in a process pool (None uses one process per CPU)
+parallel_ingestion = "true"
+ingestion_processes = None
+
+#directory of the parsed projects cache. an export is only parsed again when it changed. set to None to always parse
+project_cache_dir = ".project-cache"
+
+#descriptions and comments longer than GitHub's 65,536 characters, e.g. pasted logs, are spilled into append-only blob
+#files in this directory while migrating and read back from them a segment at a time. set to None to keep them in memory
+body_store_dir = ".body-store"
 
-# bl: first, load the configs
-for project_config in project_configs:
-    Options = namedtuple("Options", "user account repo token first_issue_id last_issue_id")
-    opts = Options(user=user, account=us, repo=project_config['repo'], token=token, first_issue_id=project_config['first_issue_id'], last_issue_id=project_config['last_issue_id'])
+#"export" transforms every project offline and writes its final import payloads into payload_dir, sharded into
+#gzip compressed JSONL files of payload_shard_size issues, without calling GitHub. "upload" then imports those
+#payloads instead of parsing and transforming the JIRA exports. None parses, transforms and imports in one run
+payload_mode = None
+payload_dir = "payloads"
+payload_shard_size = 1000
 
-    jira_proj = project_config['jira_proj']
-    project = Project(jira_proj)
+#migrate the repositories at once, each in a worker process of its own, instead of one after the other.
+#opt-in: all workers create content against one token, so keep repository_processes small to stay clear of
+#GitHub's secondary rate limits. the workers share the rate limit budget of the token and their progress is printed
+#every progress_interval seconds. the output of each worker is written to repository_log_dir/<repo>.log, its metrics next to it
+parallel_repositories = "false"
+repository_processes = 2
+repository_log_dir = "logs"
+progress_interval = 10
 
-    for xml_file in project_config['files']:
-        all_xml = read_xml_sourcefile(xml_file)
-        for item in all_xml.channel.item:
-            project.add_item(item)
 
-    project.merge_labels_and_components()
+def migrate(project_config, project_cache=None):
+  """
+  Parses, transforms and imports the issues of one project. Returns its importer, None after an export.
+  """
+  opts = Options(user=user, account=us, repo=project_config['repo'], token=token, first_issue_id=project_config['first_issue_id'], last_issue_id=project_config['last_issue_id'], jira_repos=jira_repos,
+                 pre_resolve_references=pre_resolve_references == "true", import_window=import_window,
+                 http_pool_size=http_pool_size, journal_file=journal_file,
+                 delta_import=delta_import == "true", api_url=api_url, verbose=verbose == "true")
+
+  jira_proj = project_config['jira_proj']
+  project = Project(jira_proj)
+
+  payload_reader = None
+  if payload_mode == "upload":
+    payload_reader = PayloadReader(os.path.join(payload_dir, jira_proj))
+    payload_reader.merge_into(project)
+  else:
+    with metrics.phase('parse'):
+      if project_cache is not None:
+        cache_key = project_cache.key(jira_proj, project_config['files'])
+      if project_cache is None or not project_cache.load(project, cache_key):
+        processes = ingestion_processes if parallel_ingestion == "true" else 1
+        add_xml_files_to_project(project, project_config['files'], streaming=streaming_ingestion == "true", processes=processes)
+        if project_cache is not None:
+          project_cache.store(project, cache_key)
+    metrics.add('issues_parsed', len(project.get_issues()))
+
+  with metrics.phase('transform'):
+    # bl: the manifest of an export holds the components with the labels merged into them already
+    if payload_reader is None:
+      project.merge_labels_and_components()
     project.prettify()
 
-    '''
-    Steps:
-      1. Create any milestones
-      2. Create any labels
-      3. Create each issue with comments, linking them to milestones and labels
-      4: Post-process all comments to replace issue id placeholders with the real ones
-    '''
-    importer = Importer(opts, project)
-    importers.append(importer)
+  '''
+  Steps:
+    1. Create any milestones
+    2. Create any labels
+    3. Create each issue with comments, linking them to milestones and labels
+    4: Post-process all comments to replace issue id placeholders with the real ones
+  '''
+  importer = Importer(opts, project)
+
+  if payload_mode == "export":
+    importer.export_payloads(os.path.join(payload_dir, jira_proj), payload_shard_size)
+    return None
 
-    print 'Found {} issues for {}'.format(len(project.get_issues()), jira_proj)
+  issue_count = payload_reader.manifest['issues'] if payload_reader is not None else len(project.get_issues())
+  metrics.add('issues_found', issue_count)
+  print 'Found {} issues for {}'.format(issue_count, jira_proj)
 
-    # bl: then, create the milestones and labels
-    if purge_before_import == "true":
-      importer.purge_existing_issues()
+  # bl: then, create the milestones and labels
+  if purge_before_import == "true":
+    importer.purge_existing_issues()
 
-    importer.import_milestones()
-    importer.import_labels()
+  importer.import_milestones()
+  importer.import_labels()
 
-    # bl: then, import all of the issues
+  # bl: then, import all of the issues
+  if payload_reader is not None:
+    importer.upload_payloads(payload_reader)
+  else:
     importer.import_issues()
+  return importer
+
+
+def post_process(importer):
+  if importer is None or pre_resolve_references == "true" and verify_post_processing != "true":
+    return
+  importer.post_process_issues(verify=pre_resolve_references == "true")
+  if pre_resolve_references == "true":
+    print 'Verified {}: {} bodies with unresolved references'.format(importer.options.repo, importer.unresolved_bodies)
+
+
+def migrate_and_post_process(project_config):
+  project_cache = ProjectCache(project_cache_dir) if project_cache_dir else None
+  post_process(migrate(project_config, project_cache))
+
+
+def main():
+  metrics.configure(metrics_file)
+  bodies.configure(body_store_dir)
+
+  if parallel_repositories == "true":
+    # bl: the placeholders only name the repository and issue number they stand for, so each repository
+    # is post-processed as soon as it is imported, without waiting for the others
+    share_budget(token)
+    if journal_file:
+      # bl: brings the journal schema up to date once, before the workers open it
+      Journal(journal_file).close()
+    orchestrator = Orchestrator(migrate_and_post_process, log_dir=repository_log_dir, metrics_file=metrics_file,
+                                max_workers=repository_processes, report_interval=progress_interval)
+    with metrics.phase('migrate'):
+      orchestrator.run([(project_config['repo'], project_config) for project_config in project_configs])
+    return
+
+  project_cache = ProjectCache(project_cache_dir) if project_cache_dir else None
+  # bl: first, load the configs
+  importers = [migrate(project_config, project_cache) for project_config in project_configs]
+
+  # bl: once we've processed everything, then we can process comments so that everything will be linked properly
+  for importer in importers:
+      post_process(importer)
+
 
-# bl: once we've processed everything, then we can process comments so that everything will be linked properly
-for importer in importers:
-    for issue_id in range(importer.options.first_issue_id-1, importer.options.last_issue_id):
-        importer.post_process_issue_comments(issue_id+1)
+# bl: the guard keeps the ingestion worker processes from re-running the migration
+if __name__ == '__main__':
+  try:
+    main()
+  finally:
+    metrics.write()
+    bodies.close()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+_ENDPOINT_REPO = re.compile(r'/repos/[^/]+/[^/]+')
+
+_ENDPOINT_NUMBER = re.compile(r'/\d+(?=/|$)')
+
+_PREFIX = 'jira_migration_'
+
+
+def endpoint(method, url):
+  """
+  Returns the endpoint a request belongs to, with the repository and all numbers left out,
+  e.g. 'GET /repos/:repo/issues/:n/comments'
+  """
+  path = url.split('://', 1)[-1]
+  path = path[path.find('/'):] if '/' in path else '/'
+  path = _ENDPOINT_NUMBER.sub('/:n', _ENDPOINT_REPO.sub('/repos/:repo', path.split('?', 1)[0]))
+  return method + ' ' + path
+
+
+class _Endpoint(object):
+  __slots__ = ('count', 'seconds', 'buckets', 'statuses')
+
+  def __init__(self, bucket_count):
+    self.count = 0
+    self.seconds = 0.0
+    self.buckets = [0] * bucket_count
+    self.statuses = defaultdict(int)
+
+
+class Metrics:
+  """
+  Phase timers, per-endpoint request counts and latency histograms and the totals of a migration.
+  With an output file, the metrics are written there as JSON, or in the Prometheus textfile format
+  if the name ends in .prom, at most every interval seconds while the migration runs.
+  """
+
+  # bl: upper bounds of the latency histogram buckets in seconds, the import status checks take the longest
+  BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self._lock:
+      self.phases = defaultdict(float)
+      self._running = {}
+      self.endpoints = {}
+      self.totals = defaultdict(float)
+      self.output_file = None
+      self.interval = 30.0
+      self._written_at = 0.0
+
+  def configure(self, output_file, interval=30.0):
+    self.output_file = output_file
+    self.interval = interval
+
+  @contextmanager
+  def phase(self, name):
+    """
+    Adds the time spent in the block to the phase. A phase entered again within itself is timed once.
+    """
+    with self._lock:
+      outermost = name not in self._running
+      if outermost:
+        self._running[name] = time.time()
+    try:
+      yield
+    finally:
+      if outermost:
+        with self._lock:
+          self.phases[name] += time.time() - self._running.pop(name)
+        self.write_if_due()
+
+  def current_phase(self):
+    """
+    Returns the name of the phase entered last of those still running, None if none is
+    """
+    with self._lock:
+      if not self._running:
+        return None
+      return max(self._running.iteritems(), key=lambda item: item[1])[0]
+
+  def timed(self, name):
+    """
+    Decorates a function to run in the phase
+    """
+    def decorate(fn):
+      @wraps(fn)
+      def run(*args, **kwargs):
+        with self.phase(name):
+          return fn(*args, **kwargs)
+      return run
+    return decorate
+
+  def add(self, total, value=1):
+    with self._lock:
+      self.totals[total] += value
+
+  def record_request(self, method, url, status, seconds, bytes_sent):
+    name = endpoint(method, url)
+    with self._lock:
+      stats = self.endpoints.get(name)
+      if stats is None:
+        stats = self.endpoints[name] = _Endpoint(len(Metrics.BUCKETS))
+      stats.count += 1
+      stats.seconds += seconds
+      stats.statuses[status] += 1
+      for i, bound in enumerate(Metrics.BUCKETS):
+        if seconds <= bound:
+          stats.buckets[i] += 1
+          break
+      self.totals['requests'] += 1
+      self.totals['bytes_sent'] += bytes_sent
+
+  def snapshot(self):
+    """
+    Returns the metrics as a dict. Phases still running count with the time spent in them so far.
+    """
+    with self._lock:
+      now = time.time()
+      phases = dict(self.phases)
+      for name, start in self._running.iteritems():
+        phases[name] = phases.get(name, 0.0) + now - start
+      totals = dict(self.totals)
+      endpoints = {}
+      for name, stats in self.endpoints.iteritems():
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(Metrics.BUCKETS, stats.buckets):
+          cumulative += count
+          buckets.append((bound, cumulative))
+        endpoints[name] = {'count': stats.count, 'seconds': stats.seconds, 'buckets': buckets, 'statuses': dict(stats.statuses)}
+    import_seconds = phases.get('import', 0.0)
+    return {
+      'time': now,
+      'phases': phases,
+      'totals': totals,
+      'issues_per_second': totals.get('issues_imported', 0) / import_seconds if import_seconds else 0.0,
+      'endpoints': endpoints
+    }
+
+  def to_json(self):
+    return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+  def to_prometheus(self):
+    snapshot = self.snapshot()
+    lines = ['# TYPE {}phase_seconds gauge'.format(_PREFIX)]
+    for name, seconds in sorted(snapshot['phases'].iteritems()):
+      lines.append('{}phase_seconds{{phase="{}"}} {:.6f}'.format(_PREFIX, name, seconds))
+    for name, value in sorted(snapshot['totals'].iteritems()):
+      lines.append('# TYPE {}{}_total counter'.format(_PREFIX, name))
+      lines.append('{}{}_total {:.6f}'.format(_PREFIX, name, value))
+    lines.append('# TYPE {}issues_per_second gauge'.format(_PREFIX))
+    lines.append('{}issues_per_second {:.6f}'.format(_PREFIX, snapshot['issues_per_second']))
+    lines.append('# TYPE {}responses_total counter'.format(_PREFIX))
+    for name, stats in sorted(snapshot['endpoints'].iteritems()):
+      for status, count in sorted(stats['statuses'].iteritems()):
+        lines.append('{}responses_total{{endpoint="{}",status="{}"}} {}'.format(_PREFIX, name, status, count))
+    lines.append('# TYPE {}request_seconds histogram'.format(_PREFIX))
+    for name, stats in sorted(snapshot['endpoints'].iteritems()):
+      for bound, count in stats['buckets']:
+        lines.append('{}request_seconds_bucket{{endpoint="{}",le="{}"}} {}'.format(_PREFIX, name, bound, count))
+      lines.append('{}request_seconds_bucket{{endpoint="{}",le="+Inf"}} {}'.format(_PREFIX, name, stats['count']))
+      lines.append('{}request_seconds_sum{{endpoint="{}"}} {:.6f}'.format(_PREFIX, name, stats['seconds']))
+      lines.append('{}request_seconds_count{{endpoint="{}"}} {}'.format(_PREFIX, name, stats['count']))
+    return '\n'.join(lines) + '\n'
+
+  def write(self, file_name=None):
+    """
+    Writes the metrics to the file, or the configured output file
+    """
+    file_name = file_name or self.output_file
+    if file_name is None:
+      return
+    self._written_at = time.time()
+    data = self.to_prometheus() if file_name.endswith('.prom') else self.to_json() + '\n'
+    # bl: renamed into place, so a scraper never reads a half written file
+    with open(file_name + '.tmp', 'w') as f:
+      f.write(data)
+    os.rename(file_name + '.tmp', file_name)
+
+  def write_if_due(self):
+    if self.output_file is not None and time.time() - self._written_at >= self.interval:
+      self.write()
+
+
+# bl: one set of metrics per process, shared like the rate limiters of the GitHub clients
+metrics = Metrics()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+import json
+from body_store import StoredBody, text
+
+# JIRA link descriptions (with spaces replaced by dashes) in the order their comments are generated,
+# mapped to the prefix of the GitHub comment they are converted to
+LINK_KINDS = (
+  ('duplicates', 'Duplicates'),
+  ('is-duplicated-by', 'Is duplicated by'),
+  ('requires', 'Requires'),
+  ('is-required-by', 'Is required by'),
+  ('caused', 'Caused'),
+  ('is-caused-by', 'Is caused by'),
+  ('incorporates', 'Caused'),
+  ('is-incorporated-by', 'Is caused by'),
+  ('relates-to', 'Relates to'),
+  ('is-related-to', 'Is related to'),
+  ('depends-on', 'Depends on'),
+  ('blocks', 'Blocks')
+)
+
+_LINK_ORDER = dict((kind, i) for i, (kind, prefix) in enumerate(LINK_KINDS))
+
+# bl: almost no issue has links or labels, so they all share these until they get their own list
+_NONE = ()
+
+
+class _Slotted(object):
+  __slots__ = ()
+
+  def __getstate__(self):
+    return tuple(getattr(self, name) for name in self.__slots__)
+
+  def __setstate__(self, state):
+    for name, value in zip(self.__slots__, state):
+      setattr(self, name, value)
+
+
+class Comment(_Slotted):
+  __slots__ = ('created_at', 'body')
+
+  def __init__(self, created_at, body):
+    self.created_at = created_at
+    self.body = body
+
+  def to_payload(self):
+    """
+    Returns the comment as expected by the GitHub Issue Import API
+    """
+    return {'created_at': self.created_at, 'body': text(self.body)}
+
+  def payload_length(self):
+    """
+    Returns the length of the JSON encoded payload, without reading a stored body back
+    """
+    if isinstance(self.body, StoredBody):
+      return len(json.dumps({'created_at': self.created_at, 'body': ''})) + self.body.json_length
+    return len(json.dumps(self.to_payload()))
+
+
+class Link(_Slotted):
+  __slots__ = ('kind', 'key')
+
+  def __init__(self, kind, key):
+    if kind not in _LINK_ORDER:
+      raise KeyError(kind)
+    self.kind = kind
+    self.key = key
+
+
+class Issue(_Slotted):
+  __slots__ = ('key', 'title', 'body', 'created_at', 'updated_at', 'closed_at', 'closed',
+               'labels', 'milestone_name', 'milestone', 'comments', 'links', 'githubid')
+
+  def __init__(self, key, title, body, created_at, updated_at, closed, closed_at=''):
+    self.key = key
+    self.title = title
+    self.body = body
+    self.created_at = created_at
+    self.updated_at = updated_at
+    self.closed = closed
+    self.closed_at = closed_at
+    self.labels = _NONE
+    self.milestone_name = None
+    self.milestone = None
+    self.comments = []
+    self.links = _NONE
+    self.githubid = None
+
+  def get_number(self):
+    return int(self.key.split('-', 1)[1])
+
+  def add_label(self, label):
+    if not self.labels:
+      self.labels = []
+    self.labels.append(label)
+
+  def add_link(self, kind, key):
+    link = Link(kind, key)
+    if not self.links:
+      self.links = []
+    self.links.append(link)
+
+  def pop_links(self):
+    """
+    Removes the links from the issue and returns them in LINK_KINDS order
+    """
+    links = sorted(self.links, key=lambda link: _LINK_ORDER[link.kind])
+    self.links = _NONE
+    return links
+
+  def to_payload(self):
+    """
+    Returns the issue as expected by the GitHub Issue Import API
+    """
+    payload = {'title': self.title,
+      'body': text(self.body),
+      'created_at': self.created_at,
+      'updated_at': self.updated_at,
+      'closed': self.closed,
+      'labels': list(self.labels)
+    }
+    if self.closed_at:
+      payload['closed_at'] = self.closed_at
+    if self.milestone is not None:
+      payload['milestone'] = self.milestone
+    return payload
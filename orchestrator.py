@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from metrics import metrics
+
+
+class Orchestrator:
+  """
+  Migrates several repositories at once, each in a worker process of its own, so the migration takes about as long
+  as its largest repository instead of all of them together. The workers pace their requests by one rate limit budget
+  shared in memory (see github.share_budget) and report their progress into one shared table, which is printed every
+  report_interval seconds. The output of each worker goes to <log_dir>/<name>.log and its metrics to a file of its own.
+  """
+
+  PHASES = ('parse', 'transform', 'milestones', 'labels', 'import', 'overflow_comments', 'post_process', 'export')
+
+  WAITING, RUNNING, DONE, FAILED = range(4)
+
+  _STATES = ('waiting', 'running', 'done', 'failed')
+
+  # bl: the progress of a worker is its state, phase, issues found, issues imported, bodies patched and requests
+  _FIELDS = 6
+
+  def __init__(self, migrate, log_dir='logs', metrics_file=None, max_workers=None, report_interval=10.0):
+    self.migrate = migrate
+    self.log_dir = log_dir
+    self.metrics_file = metrics_file
+    self.max_workers = max_workers
+    self.report_interval = report_interval
+    self.names = []
+    self._progress = None
+
+  def run(self, jobs):
+    """
+    Runs migrate(argument) for each (name, argument) of jobs in a worker process, at most max_workers at a time
+    """
+    self.names = [name for name, argument in jobs]
+    self._progress = multiprocessing.Array('d', len(jobs) * Orchestrator._FIELDS)
+    if not os.path.isdir(self.log_dir):
+      os.makedirs(self.log_dir)
+    pending = list(enumerate(jobs))
+    running = {}
+    failed = []
+    reported_at = time.time()
+    while pending or running:
+      while pending and (self.max_workers is None or len(running) < self.max_workers):
+        index, (name, argument) = pending.pop(0)
+        # bl: not a daemon, so the worker may start the ingestion processes of its own
+        process = multiprocessing.Process(target=self._work, args=(index, name, argument), name='migrate-' + name)
+        process.start()
+        running[index] = process
+      for index, process in running.items():
+        if not process.is_alive():
+          process.join()
+          del running[index]
+          if process.exitcode != 0:
+            self._set(index, 0, Orchestrator.FAILED)
+            failed.append(self.names[index])
+      if time.time() - reported_at >= self.report_interval:
+        self.report()
+        reported_at = time.time()
+      time.sleep(0.2)
+    self.report()
+    for total, field in (('issues_imported', 3), ('bodies_patched', 4), ('requests', 5)):
+      metrics.add(total, sum(self._get(index, field) for index in range(len(jobs))))
+    if failed:
+      raise RuntimeError("Failed to migrate {}, see {}".format(
+        ', '.join(failed), ', '.join(os.path.join(self.log_dir, name + '.log') for name in failed)))
+
+  def report(self):
+    """
+    Prints the progress of all workers
+    """
+    print '{:<20} {:<8} {:<18} {:>8} {:>9} {:>8} {:>9}'.format('repository', 'state', 'phase', 'found', 'imported', 'patched', 'requests')
+    for index, name in enumerate(self.names):
+      state = int(self._get(index, 0))
+      phase = int(self._get(index, 1))
+      print '{:<20} {:<8} {:<18} {:>8.0f} {:>9.0f} {:>8.0f} {:>9.0f}'.format(
+        name, Orchestrator._STATES[state], Orchestrator.PHASES[phase - 1] if phase and state == Orchestrator.RUNNING else '-',
+        self._get(index, 2), self._get(index, 3), self._get(index, 4), self._get(index, 5))
+    sys.stdout.flush()
+
+  def _work(self, index, name, argument):
+    log = open(os.path.join(self.log_dir, name + '.log'), 'w', 1)
+    # bl: the file descriptors too, so the output of child processes ends up in the log as well
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+    sys.stdout = sys.stderr = log
+    metrics.reset()
+    metrics.configure(self._metrics_file(name))
+    self._set(index, 0, Orchestrator.RUNNING)
+    stopped = threading.Event()
+    reporter = threading.Thread(target=self._report_progress, args=(index, stopped))
+    reporter.daemon = True
+    reporter.start()
+    try:
+      self.migrate(argument)
+    except BaseException:
+      # bl: re-raised, so multiprocessing writes the traceback into the log and exits with a failure
+      self._set(index, 0, Orchestrator.FAILED)
+      raise
+    else:
+      self._set(index, 0, Orchestrator.DONE)
+    finally:
+      stopped.set()
+      reporter.join()
+      metrics.write()
+      log.flush()
+
+  def _report_progress(self, index, stopped):
+    while True:
+      done = stopped.wait(1.0)
+      phase = metrics.current_phase()
+      totals = metrics.snapshot()['totals']
+      with self._progress.get_lock():
+        if phase in Orchestrator.PHASES:
+          self._set(index, 1, Orchestrator.PHASES.index(phase) + 1)
+        for field, total in ((2, 'issues_found'), (3, 'issues_imported'), (4, 'bodies_patched'), (5, 'requests')):
+          self._set(index, field, totals.get(total, 0))
+      if done:
+        return
+
+  def _metrics_file(self, name):
+    if self.metrics_file is None:
+      return None
+    base, extension = os.path.splitext(os.path.basename(self.metrics_file))
+    return os.path.join(self.log_dir, '{}-{}{}'.format(base, name, extension))
+
+  def _get(self, index, field):
+    return self._progress[index * Orchestrator._FIELDS + field]
+
+  def _set(self, index, field, value):
+    self._progress[index * Orchestrator._FIELDS + field] = value
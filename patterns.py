@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+
+import re
+
+
+def trie_pattern(words):
+  """
+  Builds a regex alternation of the given words that is shaped like a trie,
+  so the regex engine only ever follows one branch per character.
+  """
+  trie = {}
+  for word in words:
+    node = trie
+    for char in word:
+      node = node.setdefault(char, {})
+    node[''] = True
+
+  def build(node):
+    alternatives = [re.escape(char) + build(node[char]) for char in sorted(node) if char]
+    if not alternatives:
+      return ''
+    if len(alternatives) == 1 and '' not in node:
+      return alternatives[0]
+    return '(?:' + '|'.join(alternatives) + ')' + ('?' if '' in node else '')
+  return build(trie)
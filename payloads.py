@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+import gzip
+import io
+import json
+import os
+from body_store import text
+from model import Comment, Issue
+
+# bl: bump whenever the records change, so uploads don't misread payloads of an older export
+_FORMAT_VERSION = 1
+
+_MANIFEST = 'manifest.json'
+
+# bl: exported payloads are sized with this milestone number in place of the real one, which only the upload knows.
+# GitHub milestone numbers of a repository stay below it, so the real payload is never bigger than the sized one
+MILESTONE_PLACEHOLDER = 99999
+
+
+class ExportedIssue(Issue):
+  """
+  An issue read back from exported payloads. It carries its final Import API payload, the comments
+  that did not fit into it and the hashes of its comments, so the importer uploads it without transforming it again.
+  """
+  __slots__ = ('payload', 'overflow', 'comment_hashes')
+
+  def to_import_data(self):
+    """
+    Returns the Import API payload with the milestone number of the repository
+    """
+    issue = dict(self.payload['issue'])
+    if self.milestone is not None:
+      issue['milestone'] = self.milestone
+    return {'issue': issue, 'comments': self.payload['comments']}
+
+
+class PayloadWriter:
+  """
+  Writes the final Import API payloads of a project into gzip compressed JSONL shards of shard_size issues,
+  one record per issue in JIRA number order. The manifest is written last, so an export that did not finish is never uploaded.
+  """
+
+  def __init__(self, directory, project, repo, pre_resolve_references, shard_size=1000):
+    self.directory = directory
+    self.project = project
+    self.repo = repo
+    self.pre_resolve_references = pre_resolve_references
+    self.shard_size = shard_size
+    self.shards = []
+    self.issues = 0
+    self._shard = None
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    # bl: shards and the manifest of an earlier export are replaced as a whole
+    for name in os.listdir(directory):
+      if name == _MANIFEST or name.endswith('.jsonl.gz'):
+        os.remove(os.path.join(directory, name))
+
+  def write(self, key, milestone_name, payload, overflow, comment_hashes, body=None):
+    """
+    Writes the record of an issue. body is the description before it was split into chunks, if it was.
+    """
+    if self._shard is None or self.issues % self.shard_size == 0:
+      self._close_shard()
+      name = '{}-{:05d}.jsonl.gz'.format(self.project, len(self.shards))
+      self.shards.append(name)
+      self._shard = gzip.open(os.path.join(self.directory, name), 'wb', 6)
+    record = {'key': key, 'milestone': milestone_name, 'payload': payload,
+              'overflow': [comment.to_payload() for comment in overflow], 'comment_hashes': comment_hashes}
+    if body is not None:
+      record['body'] = text(body)
+    self._shard.write(json.dumps(record, separators=(',', ':')) + '\n')
+    self.issues += 1
+
+  def _close_shard(self):
+    if self._shard is not None:
+      self._shard.close()
+      self._shard = None
+
+  def close(self, state):
+    """
+    Closes the last shard and writes the manifest with the milestone, component and label histograms of the project
+    """
+    self._close_shard()
+    manifest = {'format': _FORMAT_VERSION, 'project': self.project, 'repo': self.repo, 'issues': self.issues,
+                'shards': self.shards, 'pre_resolve_references': self.pre_resolve_references,
+                'state': dict((hist, state[hist]) for hist in ('Milestones', 'Components', 'Labels'))}
+    with open(os.path.join(self.directory, _MANIFEST + '.tmp'), 'w') as f:
+      json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(os.path.join(self.directory, _MANIFEST + '.tmp'), os.path.join(self.directory, _MANIFEST))
+
+
+class PayloadReader:
+  """
+  Streams the issues of an export written by PayloadWriter, one shard at a time
+  """
+
+  def __init__(self, directory):
+    self.directory = directory
+    manifest_file = os.path.join(directory, _MANIFEST)
+    if not os.path.exists(manifest_file):
+      raise RuntimeError("No exported payloads in {}. Was the export finished?".format(directory))
+    with open(manifest_file) as f:
+      self.manifest = json.load(f)
+    if self.manifest['format'] != _FORMAT_VERSION:
+      raise RuntimeError("The payloads in {} were exported in format {}, expected {}. Export them again."
+                         .format(directory, self.manifest['format'], _FORMAT_VERSION))
+
+  def merge_into(self, project):
+    """
+    Adds the milestones, components and labels of the export to the project, to be imported like parsed ones
+    """
+    state = dict(self.manifest['state'])
+    state['Issues'] = []
+    project.merge_states([state])
+
+  def issues(self, milestones):
+    """
+    Yields the exported issues in JIRA number order, with the milestone numbers taken from milestones
+    """
+    for name in self.manifest['shards']:
+      with io.BufferedReader(gzip.open(os.path.join(self.directory, name), 'rb')) as f:
+        for line in f:
+          yield self._issue(json.loads(line), milestones)
+
+  def _issue(self, record, milestones):
+    payload = record['payload']
+    data = payload['issue']
+    issue = ExportedIssue(record['key'], data['title'], record.get('body', data['body']), data['created_at'],
+                          data['updated_at'], data['closed'], data.get('closed_at', ''))
+    if data['labels']:
+      issue.labels = data['labels']
+    if record['milestone'] is not None:
+      issue.milestone = milestones[record['milestone']]
+    issue.payload = payload
+    issue.overflow = [Comment(comment['created_at'], comment['body']) for comment in record['overflow']]
+    issue.comment_hashes = [tuple(comment_hash) for comment_hash in record['comment_hashes']]
+    return issue
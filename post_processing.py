@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+
+class PostProcessor:
+  """
+  Reads and rewrites the issue and comment bodies of a repository with GraphQL.
+  The bodies are read for page_size issues per query, with up to 100 comments each, and changed bodies are
+  written back with batches of aliased updateIssue and updateIssueComment mutations, instead of a REST
+  request per issue, comment page and changed body.
+  """
+
+  _COMMENT_PAGE_SIZE = 100
+
+  def __init__(self, client, owner, repo, page_size=50, batch_size=50, max_batch_length=500000):
+    self.client = client
+    self.owner = owner
+    self.repo = repo
+    self.page_size = page_size
+    self.batch_size = batch_size
+    self.max_batch_length = max_batch_length
+    self.requests = 0
+
+  def issues(self, first_number, last_number):
+    """
+    Yields pages of the issues numbered first_number to last_number, as dicts with the number, id and body of the issue
+    and the ids and bodies of all of its comments
+    """
+    cursor = None
+    while True:
+      after = ', after: "{}"'.format(cursor) if cursor is not None else ''
+      data = self._query("""
+        query {
+          repository(owner: "%s", name: "%s") {
+            issues(first: %d%s) {
+              pageInfo { hasNextPage endCursor }
+              nodes {
+                id number body
+                comments(first: %d) { pageInfo { hasNextPage endCursor } nodes { id body } }
+              }
+            }
+          }
+        }
+        """ % (self.owner, self.repo, self.page_size, after, PostProcessor._COMMENT_PAGE_SIZE))
+      issues = data['repository']['issues']
+      page = []
+      for node in issues['nodes']:
+        if first_number <= node['number'] <= last_number:
+          comments = node['comments']['nodes']
+          if node['comments']['pageInfo']['hasNextPage']:
+            comments.extend(self._more_comments(node['id'], node['comments']['pageInfo']['endCursor']))
+          page.append({'number': node['number'], 'id': node['id'], 'body': node['body'], 'comments': comments})
+      yield page
+      if not issues['pageInfo']['hasNextPage']:
+        return
+      cursor = issues['pageInfo']['endCursor']
+
+  def _more_comments(self, issue_id, cursor):
+    comments = []
+    while cursor is not None:
+      data = self._query("""
+        query {
+          node(id: "%s") {
+            ... on Issue {
+              comments(first: %d, after: "%s") { pageInfo { hasNextPage endCursor } nodes { id body } }
+            }
+          }
+        }
+        """ % (issue_id, PostProcessor._COMMENT_PAGE_SIZE, cursor))
+      page = data['node']['comments']
+      comments.extend(page['nodes'])
+      cursor = page['pageInfo']['endCursor'] if page['pageInfo']['hasNextPage'] else None
+    return comments
+
+  def update(self, changes):
+    """
+    Writes the changed bodies, given as (node id, is_comment, body) triples.
+    The batches are kept below max_batch_length characters of bodies.
+    """
+    batch = []
+    length = 0
+    for change in changes:
+      if batch and (len(batch) >= self.batch_size or length + len(change[2]) > self.max_batch_length):
+        self._update_batch(batch)
+        batch = []
+        length = 0
+      batch.append(change)
+      length += len(change[2])
+    if batch:
+      self._update_batch(batch)
+
+  def _update_batch(self, batch):
+    # bl: the bodies are passed as variables, so they need no escaping inside the query
+    parameters = []
+    mutations = []
+    variables = {}
+    for i, (node_id, is_comment, body) in enumerate(batch):
+      parameters.append('$i{0}: ID!, $b{0}: String!'.format(i))
+      mutations.append('u{0}: {1}(input: {{id: $i{0}, body: $b{0}}}) {{ clientMutationId }}'
+                       .format(i, 'updateIssueComment' if is_comment else 'updateIssue'))
+      variables['i{}'.format(i)] = node_id
+      variables['b{}'.format(i)] = body
+    self._query('mutation (' + ', '.join(parameters) + ') { ' + ' '.join(mutations) + ' }', variables)
+
+  def _query(self, query, variables=None):
+    self.requests += 1
+    response = self.client.graphql(query, variables)
+    if response.status_code != 200:
+      raise RuntimeError(
+        "Failed to post-process {}/{} due to unexpected HTTP status code: {} ; text: {}".format(self.owner, self.repo, response.status_code, response.text)
+      )
+    result = response.json()
+    if result.get('errors'):
+      raise RuntimeError("Failed to post-process {}/{}: {}".format(self.owner, self.repo, result['errors']))
+    return result['data']
@@ -1,16 +1,63 @@
 #!/usr/bin/env python
 
 from collections import defaultdict
-from htmlentitydefs import name2codepoint
+from datetime import datetime
 from dateutil.parser import parse
+from body_store import bodies
+from model import Issue, Comment
+from text import normalize_jira_text
 import re
 
+# bl: the RFC 822 style timestamps of JIRA exports, e.g. 'Thu, 5 Mar 2020 22:21:01 +0700'
+_JIRA_TIMESTAMP = re.compile(r'(?:[A-Za-z]{3}, )?(\d{1,2}) ([A-Za-z]{3}) (\d{4}) (\d{2}):(\d{2}):(\d{2}) ([+-]\d{4})$')
+
+_MONTHS = dict((name, i + 1) for i, name in enumerate(('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')))
+
+# bl: converted timezone offsets, e.g. '+0700' -> '+07:00'. dateutil writes UTC as '+00:00' whatever its sign
+_tz_offsets = {'-0000': '+00:00'}
+
+# bl: comments of the same discussion often share timestamps, so recently converted ones are kept. bounded to stay small
+_timestamps = {}
+_MAX_TIMESTAMPS = 65536
+
+
+def convert_jira_timestamp(timestamp):
+  """
+  Converts a JIRA export timestamp into the ISO 8601 format of the GitHub Import API,
+  exactly like dateutil's parse(timestamp).isoformat(). Anything but the JIRA format goes through dateutil.
+  """
+  iso = _timestamps.get(timestamp)
+  if iso is not None:
+    return iso
+  match = _JIRA_TIMESTAMP.match(timestamp)
+  month = _MONTHS.get(match.group(2)) if match is not None else None
+  if month is None:
+    iso = parse(timestamp).isoformat()
+  else:
+    day, year, hour, minute, second = (int(match.group(i)) for i in (1, 3, 4, 5, 6))
+    try:
+      # bl: only to reject dates like the 30th of February the way dateutil does
+      datetime(year, month, day, hour, minute, second)
+    except ValueError:
+      iso = parse(timestamp).isoformat()
+    else:
+      offset = match.group(7)
+      tz = _tz_offsets.get(offset)
+      if tz is None:
+        tz = _tz_offsets.setdefault(offset, offset[:3] + ':' + offset[3:])
+      iso = '%04d-%02d-%02dT%02d:%02d:%02d%s' % (year, month, day, hour, minute, second, tz)
+  if len(_timestamps) >= _MAX_TIMESTAMPS:
+    _timestamps.clear()
+  _timestamps[timestamp] = iso
+  return iso
+
 
 class Project:
 
   def __init__(self, name):
     self.name = name
     self._project = {'Milestones': defaultdict(int), 'Components': defaultdict(int), 'Labels': defaultdict(int), 'Issues': []}
+    self._strings = {}
 
   def get_milestones(self):
     return self._project['Milestones']
@@ -38,6 +85,35 @@ class Project:
     self._add_relationships(item)
 
 
+  def get_state(self):
+    """
+    Returns the plain extracted state (issues and histograms) of this project
+    """
+    return self._project
+
+  def merge_states(self, states):
+    """
+    Merges states extracted by other Project instances, e.g. in worker processes.
+    Histograms are summed up and the issues are kept in JIRA number order.
+    """
+    for state in states:
+      for hist in ('Milestones', 'Components', 'Labels'):
+        for key, count in state[hist].iteritems():
+          self._project[hist][self._intern(key)] += count
+      for issue in state['Issues']:
+        if issue.milestone_name is not None:
+          issue.milestone_name = self._intern(issue.milestone_name)
+        if issue.labels:
+          issue.labels = [self._intern(label) for label in issue.labels]
+        self._project['Issues'].append(issue)
+    self.sort_issues()
+
+  def sort_issues(self):
+    """
+    Puts the issues in JIRA number order, the order they are imported and numbered in
+    """
+    self._project['Issues'].sort(key=Issue.get_number)
+
   def merge_labels_and_components(self):
     print
     print 'Components will be combined with labels as github labels...'    
@@ -75,63 +151,52 @@ class Project:
       except AttributeError:
         pass
 
-    self._project['Issues'].append({"title": item.title.text[item.title.text.index("]") + 2:len(item.title.text)],
-      'key': item.key.text,
-      "body": '<i>created by ' + item.reporter.get('username') + '</i>\n' + self._htmlentitydecode(item.description.text),
-      'created_at': self._convert_to_iso(item.created.text),
-      'closed_at': closed_at,
-      'updated_at': self._convert_to_iso(item.updated.text),
-      'closed': closed,
-      "labels": [],
-      'comments': [],
-      'duplicates': [],
-      'is-duplicated-by': [],
-      'requires': [],
-      'is-required-by': [],
-      'caused': [],
-      'is-caused-by': [],
-      'incorporates': [],
-      'is-incorporated-by': [],
-      'relates-to': [],
-      'is-related-to': [],
-      'depends-on': [],
-      'blocks': []
-    })
-    if not self._project['Issues'][-1]['closed_at']:
-      del self._project['Issues'][-1]['closed_at']
+    self._project['Issues'].append(Issue(item.key.text,
+      title=item.title.text[item.title.text.index("]") + 2:len(item.title.text)],
+      body=bodies.store(normalize_jira_text('<i>created by ' + item.reporter.get('username') + '</i>\n', item.description.text)),
+      created_at=self._convert_to_iso(item.created.text),
+      updated_at=self._convert_to_iso(item.updated.text),
+      closed=closed,
+      closed_at=closed_at
+    ))
+
+  def _intern(self, s):
+    # bl: labels and milestones repeat across thousands of issues, so keep a single copy of each
+    return self._strings.setdefault(s, s)
 
   def _convert_to_iso(self, timestamp):
-    dt = parse(timestamp)
-    return dt.isoformat()
+    return convert_jira_timestamp(timestamp)
 
   def _add_milestone(self, item):
     try:
-      self._project['Milestones'][item.fixVersion.text] += 1
-      # this prop will be deleted later:
-      self._project['Issues'][-1]['milestone_name'] = item.fixVersion.text 
+      milestone_name = self._intern(item.fixVersion.text)
+      self._project['Milestones'][milestone_name] += 1
+      self._project['Issues'][-1].milestone_name = milestone_name
     except AttributeError:
       pass
   
   def _add_labels(self, item):
     try:
-      self._project['Components'][item.component.text] += 1
-      self._project['Issues'][-1]['labels'].append(item.component.text)
+      component = self._intern(item.component.text)
+      self._project['Components'][component] += 1
+      self._project['Issues'][-1].add_label(component)
     except AttributeError:
       pass
     try:
       for label in item.labels.label:
-        self._project['Labels'][label.text] += 1
-        self._project['Issues'][-1]['labels'].append(label.text)
+        label = self._intern(label.text)
+        self._project['Labels'][label] += 1
+        self._project['Issues'][-1].add_label(label)
     except AttributeError:
       pass
 
   def _add_comments(self, item):
     try:
       for comment in item.comments.comment:
-        self._project['Issues'][-1]['comments'].append(
-          {"created_at": self._convert_to_iso(comment.get('created')),
-           "body": '<i>by ' + comment.get('author') + '</i>\n' + self._htmlentitydecode(comment.text)
-          })
+        self._project['Issues'][-1].comments.append(
+          Comment(created_at=self._convert_to_iso(comment.get('created')),
+            body=bodies.store(normalize_jira_text('<i>by ' + comment.get('author') + '</i>\n', comment.text))
+          ))
     except AttributeError:
       pass
 
@@ -141,7 +206,7 @@ class Project:
         for outwardlink in issuelinktype.outwardlinks:
           for issuelink in outwardlink.issuelink:
             for issuekey in issuelink.issuekey:
-              self._project['Issues'][-1][outwardlink.get("description").replace(' ', '-')].append(issuekey.text)
+              self._project['Issues'][-1].add_link(outwardlink.get("description").replace(' ', '-'), issuekey.text)
     except AttributeError:
       pass
     except KeyError:
@@ -151,15 +216,8 @@ class Project:
         for inwardlink in issuelinktype.inwardlinks:
           for issuelink in inwardlink.issuelink:
             for issuekey in issuelink.issuekey:
-              self._project['Issues'][-1][inwardlink.get("description").replace(' ', '-')].append(issuekey.text)
+              self._project['Issues'][-1].add_link(inwardlink.get("description").replace(' ', '-'), issuekey.text)
     except AttributeError:
       pass
     except KeyError:
           print 'KeyError at ' + item.key.text
-  
-  def _htmlentitydecode(self, s):
-    if s is None: return ''
-    s = s.replace(' ' * 8, '')
-    return re.sub('&(%s);' % '|'.join(name2codepoint),
-        lambda m: unichr(name2codepoint[m.group(1)]), s)
-    
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import calendar
+import json
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from github import PointBudget
+
+
+class IssuePurger:
+  """
+  Deletes every issue of a repository with GraphQL.
+  The issue ids are paged through with cursors, then deleted with batch_size aliased deleteIssue mutations per request
+  and up to concurrency requests at a time, paced by the GraphQL point budget of the client.
+  Pull requests can't be deleted through the API and are only counted.
+  """
+
+  _PAGE_SIZE = 100
+
+  def __init__(self, client, owner, repo, batch_size=50, concurrency=4, max_rounds=5):
+    self.client = client
+    self.owner = owner
+    self.repo = repo
+    self.batch_size = batch_size
+    self.concurrency = concurrency
+    self.max_rounds = max_rounds
+    self._lock = threading.Lock()
+    self.deleted = 0
+    self.failed = 0
+    self.pull_requests = 0
+
+  def purge(self):
+    """
+    Deletes the issues until none are left. Issues whose deletion failed are tried again in the next round.
+    Returns the number of deleted issues.
+    """
+    for i in range(self.max_rounds):
+      ids = self.list_issue_ids()
+      if not ids:
+        break
+      self.delete_issues(ids)
+    else:
+      if self.list_issue_ids():
+        raise RuntimeError("Issues of {}/{} are left after {} purge rounds".format(self.owner, self.repo, self.max_rounds))
+    if self.pull_requests:
+      print '{} pull requests of {}/{} can only be deleted with the repository'.format(self.pull_requests, self.owner, self.repo)
+    return self.deleted
+
+  def list_issue_ids(self):
+    """
+    Returns the ids of all issues of the repository, paging through them with cursors
+    """
+    ids = []
+    cursor = None
+    while True:
+      after = ', after: "{}"'.format(cursor) if cursor is not None else ''
+      data = self._query("""
+        query {
+          repository(owner: "%s", name: "%s") {
+            issues(first: %d%s) {
+              totalCount
+              pageInfo { hasNextPage endCursor }
+              nodes { id }
+            }
+            pullRequests { totalCount }
+          }
+          rateLimit { cost remaining resetAt }
+        }
+        """ % (self.owner, self.repo, IssuePurger._PAGE_SIZE, after))
+      self._respect_rate_limit(data['rateLimit'])
+      issues = data['repository']['issues']
+      self.pull_requests = data['repository']['pullRequests']['totalCount']
+      ids.extend(node['id'] for node in issues['nodes'])
+      if cursor is None:
+        print 'Purging {} issues of {}/{}'.format(issues['totalCount'], self.owner, self.repo)
+      if not issues['pageInfo']['hasNextPage']:
+        return ids
+      cursor = issues['pageInfo']['endCursor']
+
+  def delete_issues(self, ids):
+    batches = [ids[i:i + self.batch_size] for i in xrange(0, len(ids), self.batch_size)]
+    start = time.time()
+    pool = ThreadPool(min(self.concurrency, len(batches)))
+    try:
+      for deleted in pool.imap_unordered(self._delete_batch, batches):
+        with self._lock:
+          self.deleted += deleted
+          elapsed = time.time() - start
+          print 'Deleted {} issues of {}/{} ({:.1f} issues/s)'.format(self.deleted, self.owner, self.repo, self.deleted / max(elapsed, 0.001))
+    finally:
+      pool.close()
+
+  def _delete_batch(self, ids):
+    mutations = ['d{}: deleteIssue(input: {{issueId: "{}"}}) {{ clientMutationId }}'.format(i, issue_id) for i, issue_id in enumerate(ids)]
+    response = self.client.graphql('mutation { ' + ' '.join(mutations) + ' }')
+    if response.status_code != 200:
+      raise RuntimeError(
+        "Failed to delete issues due to unexpected HTTP status code: {} ; text: {}".format(response.status_code, response.text)
+      )
+    result = response.json()
+    deleted = sum(1 for value in (result.get('data') or {}).itervalues() if value is not None)
+    errors = [error for error in result.get('errors', ()) if error.get('type') != 'NOT_FOUND']
+    if errors:
+      with self._lock:
+        self.failed += len(errors)
+      print 'Failed to delete {} issues: {}'.format(len(errors), json.dumps(errors[:3]))
+    return deleted
+
+  def _query(self, query):
+    response = self.client.graphql(query)
+    if response.status_code != 200:
+      raise RuntimeError(
+        "Failed to list issues due to unexpected HTTP status code: {} ; text: {}".format(response.status_code, response.text)
+      )
+    result = response.json()
+    if result.get('errors'):
+      raise RuntimeError("Failed to list issues: {}".format(result['errors']))
+    return result['data']
+
+  def _respect_rate_limit(self, rate_limit):
+    # bl: the GraphQL point budget is separate from the REST one the client paces by
+    if rate_limit['remaining'] < rate_limit['cost'] + PointBudget.MUTATION_POINTS * self.concurrency:
+      reset_at = calendar.timegm(time.strptime(rate_limit['resetAt'], '%Y-%m-%dT%H:%M:%SZ'))
+      wait = max(reset_at - time.time(), 0) + 1
+      print 'GraphQL points of {}/{} are used up. Waiting {:.0f} seconds'.format(self.owner, self.repo, wait)
+      time.sleep(wait)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import multiprocessing
+from lxml import etree, objectify
+from project import Project
+
+
+def read_xml_sourcefile(file_name):
+  """
+  Reads a whole JIRA XML export into an objectified tree.
+  """
+  all_text = open(file_name).read()
+  return objectify.fromstring(all_text)
+
+
+def iter_xml_items(file_name):
+  """
+  Streams the <item> elements of a JIRA XML export one at a time.
+  Each item is objectified so Project.add_item can use it as usual, and it is
+  freed together with its already processed siblings once the caller moves on,
+  so memory stays flat no matter how large the export is.
+  """
+  context = etree.iterparse(file_name, events=('end',), tag='item')
+  context.set_element_class_lookup(objectify.ObjectifyElementClassLookup())
+  for event, item in context:
+    yield item
+    # bl: drop the item and everything that came before it in the channel
+    item.clear()
+    parent = item.getparent()
+    while item.getprevious() is not None:
+      parent.remove(item.getprevious())
+  del context
+
+
+def add_xml_file_to_project(project, file_name, streaming=True):
+  """
+  Feeds every <item> of a JIRA XML export into the given project.
+  """
+  if streaming:
+    for item in iter_xml_items(file_name):
+      project.add_item(item)
+  else:
+    all_xml = read_xml_sourcefile(file_name)
+    for item in all_xml.channel.item:
+      project.add_item(item)
+
+
+def _parse_project_file(args):
+  project_name, file_name, streaming = args
+  project = Project(project_name)
+  add_xml_file_to_project(project, file_name, streaming)
+  return project.get_state()
+
+
+def add_xml_files_to_project(project, file_names, streaming=True, processes=None):
+  """
+  Feeds all export files of a project into it, leaving its issues in JIRA number order.
+  With more than one file and process, the files are parsed in a process pool and
+  the extracted states are merged into the project.
+  """
+  if processes is None:
+    processes = multiprocessing.cpu_count()
+  processes = min(processes, len(file_names))
+  if processes < 2:
+    for file_name in file_names:
+      add_xml_file_to_project(project, file_name, streaming)
+    # bl: sorted like merged states, so the import order doesn't depend on how the files were parsed
+    project.sort_issues()
+    return
+
+  pool = multiprocessing.Pool(processes)
+  try:
+    states = pool.map(_parse_project_file, [(project.name, file_name, streaming) for file_name in file_names], chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+  project.merge_states(states)
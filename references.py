@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import re
+from patterns import trie_pattern
+
+JIRA_BROWSE_URL = 'https://hub.socialstrata.com/jira/browse/'
+
+# bl: compiled patterns by set of JIRA project keys, so every Importer of a run shares them
+_patterns = {}
+
+
+def _compile(jira_keys):
+  jira_keys = frozenset(jira_keys)
+  pattern = _patterns.get(jira_keys)
+  if pattern is None:
+    pattern = re.compile('(' + trie_pattern(jira_keys) + r')-(\d+)')
+    _patterns[jira_keys] = pattern
+  return pattern
+
+
+class ReferenceRewriter(object):
+  """
+  Rewrites JIRA issue keys and JIRA browse URLs in a text with a single scan.
+  Keys of the placeholder project become issue number placeholders,
+  keys of any other known project become links to the issue in its GitHub repository.
+  """
+
+  def __init__(self, account, jira_repos, placeholder_project, placeholder_prefix, placeholder_suffix):
+    self._pattern = _compile(list(jira_repos) + [placeholder_project])
+    self._targets = {}
+    for jira_key, repo in jira_repos.iteritems():
+      self._targets[jira_key] = ('https://github.com/' + account + '/' + repo + '/issues/', '')
+    self._targets[placeholder_project] = (placeholder_prefix, placeholder_suffix)
+
+  def rewrite(self, text):
+    pieces = []
+    last = 0
+    for match in self._pattern.finditer(text):
+      start = match.start()
+      # bl: a JIRA browse URL in front of the key is replaced along with it
+      url_start = start - len(JIRA_BROWSE_URL)
+      if url_start >= last and text.startswith(JIRA_BROWSE_URL, url_start):
+        start = url_start
+      prefix, suffix = self._targets[match.group(1)]
+      pieces.append(text[last:start])
+      pieces.append(prefix + match.group(2) + suffix)
+      last = match.end()
+    if not pieces:
+      return text
+    pieces.append(text[last:])
+    return ''.join(pieces)
+
+
+class PlaceholderResolver(object):
+  """
+  Post-processes imported issue bodies and comments:
+  issue number placeholders become GitHub issue references, and links to GitHub issues,
+  JIRA browse URLs and legacy JIRA keys are collapsed into plain owner/repo#N references.
+  The link patterns are generated from the repository table instead of one per repository,
+  and texts without any of the trigger literals are returned without running a regex at all.
+  """
+
+  def __init__(self, account, repos, legacy_jira_keys, placeholder_prefix, placeholder_suffix):
+    self._account = account
+    self._legacy_jira_keys = dict(legacy_jira_keys)
+    self._placeholder_prefix = placeholder_prefix
+    self._placeholder_pattern = re.compile(re.escape(placeholder_prefix) + r'(\d+)' + re.escape(placeholder_suffix))
+
+    issues_url = re.escape('https://github.com/' + account + '/') + '%s' + re.escape('/issues/')
+    legacy_refs = ''.join('|' + re.escape(key + '-') for key in sorted(self._legacy_jira_keys))
+    # bl: no part of a link may run past its </a>, so a match never swallows the text up to a later link
+    self._link_pattern = re.compile(
+      '<a href="(?:' + re.escape(JIRA_BROWSE_URL) + ')?(?:' + issues_url % ('(?P<repo>' + trie_pattern(repos) + ')') + '|#)[0-9]+[^"]*"[^>]*>(?:<del>)?'
+      '(?P<ref>#|' + re.escape(JIRA_BROWSE_URL + '#') + legacy_refs + '|' + issues_url % '(?P=repo)' + '|' + re.escape(account + '/') + '(?P=repo)#)'
+      '(?P<number>[0-9]+)(?:(?!</a>).)*?(?:</del>)?</a>')
+    leftover = '>' + re.escape(JIRA_BROWSE_URL) + r'(?P<number>#[0-9]+)</a>'
+    if self._legacy_jira_keys:
+      leftover += '|(?P<key>' + trie_pattern(self._legacy_jira_keys) + ')-(?P<key_number>[0-9]+)'
+    self._leftover_pattern = re.compile(leftover)
+
+    self._leftover_literals = (JIRA_BROWSE_URL,) + tuple(key + '-' for key in self._legacy_jira_keys)
+
+  def _resolve_link(self, match):
+    number = match.group('number')
+    repo = match.group('repo')
+    if repo is None:
+      ref = match.group('ref')
+      if ref[:-1] not in self._legacy_jira_keys:
+        return '#' + number
+      repo = self._legacy_jira_keys[ref[:-1]]
+    return self._account + '/' + repo + '#' + number
+
+  def _resolve_leftover(self, match):
+    if match.group('number') is not None:
+      return '>' + match.group('number') + '</a>'
+    return self._account + '/' + self._legacy_jira_keys[match.group('key')] + '#' + match.group('key_number')
+
+  def resolve(self, text):
+    if self._placeholder_prefix in text:
+      text = self._placeholder_pattern.sub(r'#\1', text)
+    if '<a href="' in text:
+      text = self._link_pattern.sub(self._resolve_link, text)
+    if any(literal in text for literal in self._leftover_literals):
+      text = self._leftover_pattern.sub(self._resolve_leftover, text)
+    return text
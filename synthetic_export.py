@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+"""
+Generates synthetic JIRA XML exports in the format of export.xml, for benchmarks and load tests
+without real exports.
+Usage: python synthetic_export.py [options] <output directory>
+"""
+
+import argparse
+import os
+import random
+from collections import namedtuple
+from xml.sax.saxutils import escape
+from importer import Importer
+from model import LINK_KINDS
+from references import JIRA_BROWSE_URL
+
+ExportSettings = namedtuple("ExportSettings", "project issues files comments body_size entity_density link_density gaps oversized seed")
+# bl: comments is the average number of comments per issue and body_size the average length of a description or comment.
+# entity_density is the share of words that are HTML entities, link_density the share of issues with issue links
+# and references to other JIRA projects. gaps is the share of JIRA numbers left out, like deleted issues, and
+# oversized the share of issues with a description or comment over GitHub's 64KB limit
+ExportSettings.__new__.__defaults__ = ('CRST', 1000, 1, 5, 600, 0.02, 0.2, 0.0, 0.002, 1)
+
+_WORDS = ('the', 'issue', 'import', 'migration', 'server', 'client', 'fails', 'when', 'after', 'update',
+          'crowd', 'stack', 'release', 'build', 'deploy', 'error', 'page', 'user', 'login', 'report')
+
+_ENTITIES = ('&nbsp;', '&eacute;', '&amp;', '&lt;', '&gt;', '&quot;', '&uuml;', '&mdash;', '&hellip;', '&copy;')
+
+# bl: JIRA link types with their outward and inward descriptions, as found in the exports
+_LINK_TYPES = [(outward.split('-')[0].capitalize(), outward.replace('-', ' '), inward.replace('-', ' '))
+               for (outward, prefix), (inward, inward_prefix) in zip(LINK_KINDS[0::2], LINK_KINDS[1::2])]
+
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+_XML_ESCAPES = {'"': '&quot;', "'": '&apos;'}
+
+_HEADER = '''<!--
+RSS generated by JIRA (8.3.4#803005-sha1:1f96e09b3c60279a408a2ae47be3c745f571388b) at Fri Apr 10 03:46:38 UTC 2020
+-->
+<rss version="0.92">
+    <channel>
+        <title>Synthetic JIRA</title>
+        <link>{browse}</link>
+        <description>An XML representation of a search request</description>
+                <language>en-uk</language>
+                        <issue start="0" end="{count}" total="{count}"/>
+'''
+
+_FOOTER = '''</channel>
+</rss>
+'''
+
+
+def _timestamp(rng):
+  return '{}, {} {} {} {:02d}:{:02d}:{:02d} {}'.format(
+    rng.choice(_DAYS), rng.randint(1, 28), rng.choice(_MONTHS), rng.randint(2012, 2020),
+    rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59), rng.choice(('+0000', '+0700', '-0500', '+0100')))
+
+
+def _reference(rng, settings, number):
+  key = rng.choice(sorted(Importer._JIRA_PROJECT_REPOS) + sorted(Importer._LEGACY_JIRA_KEYS) + [settings.project] * 4)
+  ref = '{}-{}'.format(key, rng.randint(1, max(number, 2)))
+  if rng.random() < 0.5:
+    return '<a href="{}{}" class="issue-link" data-issue-key="{}">{}</a>'.format(JIRA_BROWSE_URL, ref, ref, ref)
+  return ref
+
+
+def _sentence(rng, settings, with_links):
+  words = []
+  for i in range(rng.randint(4, 16)):
+    roll = rng.random()
+    if roll < settings.entity_density:
+      word = rng.choice(_ENTITIES)
+    elif with_links and roll < settings.entity_density + 0.1:
+      word = _reference(rng, settings, rng.randint(2, settings.issues))
+    else:
+      word = rng.choice(_WORDS)
+    words.append(word)
+  sentence = ' '.join(words) + '.'
+  if rng.random() < 0.05:
+    # bl: the exports indent nested markup with 8 spaces
+    sentence += '</p>\n\n' + ' ' * 8 + '<p>'
+  return sentence
+
+
+def _sentence_pools(rng, settings):
+  """
+  Returns pools of sentences without and with references to other issues, which texts are built from.
+  Picking whole sentences keeps generating large exports fast.
+  """
+  return ([_sentence(rng, settings, False) for i in range(2000)],
+          [_sentence(rng, settings, True) for i in range(2000)])
+
+
+def _text(rng, settings, pools, size):
+  """
+  Returns the HTML of a description or comment of about the given length
+  """
+  plain, with_links = pools
+  sentences = []
+  length = 0
+  while length < size:
+    sentence = rng.choice(with_links if rng.random() < settings.link_density else plain)
+    sentences.append(sentence)
+    length += len(sentence) + 1
+  return '<p>' + ' '.join(sentences) + '</p>'
+
+
+def _size(rng, settings):
+  if rng.random() < settings.oversized:
+    return rng.randint(70000, 200000)
+  return int(settings.body_size * rng.uniform(0.2, 1.8))
+
+
+def _xml(text):
+  return escape(text, _XML_ESCAPES)
+
+
+def _item(rng, settings, pools, number):
+  key = '{}-{}'.format(settings.project, number)
+  closed = rng.random() < 0.6
+  lines = ['<item>',
+    '            <title>[{}] {}</title>'.format(key, _xml(' '.join(rng.choice(_WORDS) for i in range(rng.randint(3, 10))))),
+    '                <link>{}{}</link>'.format(JIRA_BROWSE_URL, key),
+    '                <project id="1" key="{}">{}</project>'.format(settings.project, settings.project),
+    '                    <description>{}</description>'.format(_xml(_text(rng, settings, pools, _size(rng, settings)))),
+    '        <key id="{}">{}</key>'.format(10000 + number, key),
+    '                        <status id="{}" description="">{}</status>'.format(rng.choice(('5', '6')) if closed else '1', 'Closed' if closed else 'Open'),
+    '                                    <reporter username="user{}">User {}</reporter>'.format(rng.randint(1, 50), number)]
+  labels = ''.join('<label>label{}</label>'.format(rng.randint(1, 20)) for i in range(rng.randint(0, 2)))
+  lines.append('                        <labels>{}</labels>'.format(labels))
+  lines.append('                <created>{}</created>'.format(_timestamp(rng)))
+  lines.append('                <updated>{}</updated>'.format(_timestamp(rng)))
+  if closed:
+    lines.append('                <resolved>{}</resolved>'.format(_timestamp(rng)))
+  if rng.random() < 0.3:
+    lines.append('                <fixVersion>{}.{}</fixVersion>'.format(rng.randint(1, 3), rng.randint(0, 9)))
+  if rng.random() < 0.3:
+    lines.append('                <component>component{}</component>'.format(rng.randint(1, 8)))
+
+  comment_count = rng.randint(0, 2 * settings.comments)
+  if comment_count:
+    lines.append('                                                                <comments>')
+    for i in range(comment_count):
+      lines.append('                            <comment id="{}" author="user{}" created="{}"  >{}</comment>'.format(
+        number * 1000 + i, rng.randint(1, 50), _timestamp(rng), _xml(_text(rng, settings, pools, _size(rng, settings)))))
+    lines.append('                    </comments>')
+
+  if rng.random() < settings.link_density:
+    lines.append('                    <issuelinks>')
+    for name, outward, inward in rng.sample(_LINK_TYPES, rng.randint(1, 2)):
+      target = '{}-{}'.format(rng.choice(sorted(Importer._JIRA_PROJECT_REPOS) + [settings.project]), rng.randint(1, max(number, 2)))
+      lines.append('                        <issuelinktype id="1"><name>{}</name>'.format(name))
+      lines.append('                            <outwardlinks description="{}"><issuelink><issuekey id="1">{}</issuekey></issuelink></outwardlinks>'.format(outward, target))
+      if rng.random() < 0.5:
+        lines.append('                            <inwardlinks description="{}"><issuelink><issuekey id="2">{}</issuekey></issuelink></inwardlinks>'.format(inward, target))
+      lines.append('                        </issuelinktype>')
+    lines.append('                    </issuelinks>')
+  lines.append('    </item>')
+  return '\n'.join(lines) + '\n'
+
+
+def generate_exports(directory, settings):
+  """
+  Writes the synthetic export of a project into the directory, split into settings.files files
+  in JIRA number order. Returns the file names.
+  """
+  rng = random.Random(settings.seed)
+  pools = _sentence_pools(rng, settings)
+  numbers = [number for number in range(1, settings.issues + 1) if number == 1 or rng.random() >= settings.gaps]
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  file_names = []
+  per_file = (len(numbers) + settings.files - 1) // settings.files
+  for i in range(settings.files):
+    file_numbers = numbers[i * per_file:(i + 1) * per_file]
+    file_name = os.path.join(directory, '{}{}.xml'.format(settings.project.lower(), i + 1))
+    with open(file_name, 'w') as f:
+      f.write(_HEADER.format(browse=JIRA_BROWSE_URL, count=len(file_numbers)))
+      for number in file_numbers:
+        f.write(_item(rng, settings, pools, number))
+      f.write(_FOOTER)
+    file_names.append(file_name)
+  return file_names
+
+
+def add_settings_arguments(parser):
+  defaults = ExportSettings()
+  parser.add_argument('--project', default=defaults.project, help='JIRA project key')
+  parser.add_argument('--issues', type=int, default=defaults.issues, help='number of JIRA issue numbers')
+  parser.add_argument('--files', type=int, default=defaults.files, help='number of files the export is split into')
+  parser.add_argument('--comments', type=int, default=defaults.comments, help='average number of comments per issue')
+  parser.add_argument('--body-size', type=int, default=defaults.body_size, help='average length of descriptions and comments')
+  parser.add_argument('--entity-density', type=float, default=defaults.entity_density, help='share of words that are HTML entities')
+  parser.add_argument('--link-density', type=float, default=defaults.link_density, help='share of issues with links to other issues')
+  parser.add_argument('--gaps', type=float, default=defaults.gaps, help='share of JIRA numbers without an issue')
+  parser.add_argument('--oversized', type=float, default=defaults.oversized, help='share of issues with texts over 64KB')
+  parser.add_argument('--seed', type=int, default=defaults.seed, help='random seed')
+
+
+def settings_from_arguments(args):
+  return ExportSettings(*(getattr(args, field) for field in ExportSettings._fields))
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Generates synthetic JIRA XML exports.')
+  add_settings_arguments(parser)
+  parser.add_argument('directory', help='output directory')
+  args = parser.parse_args()
+  for file_name in generate_exports(args.directory, settings_from_arguments(args)):
+    print file_name
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+from htmlentitydefs import name2codepoint
+from patterns import trie_pattern
+import re
+
+# bl: GitHub rejects issue bodies and comments over 65,536 characters
+MAX_BODY_LENGTH = 65536
+
+# bl: texts over the limit are split into chunks 100 characters shorter, leaving room for the chunk headers
+CHUNK_LENGTH = 65436
+
+_ENTITY = re.compile('&(' + trie_pattern(name2codepoint) + ');')
+
+_ENTITY_CHARS = dict((name, unichr(codepoint)) for name, codepoint in name2codepoint.iteritems())
+
+
+def _decode_entity(match):
+  return _ENTITY_CHARS[match.group(1)]
+
+
+def normalize_jira_text(header, text):
+  """
+  Turns the text of a JIRA description or comment into the body imported into GitHub:
+  the 8-space indentation of the export is stripped, HTML entities are decoded and the header is put in front.
+  """
+  if text is None:
+    return header
+  text = text.replace(' ' * 8, '')
+  if '&' in text:
+    text = _ENTITY.sub(_decode_entity, text)
+  return header + text
+
+
+def chunk_spans(length, chunk_length=CHUNK_LENGTH):
+  """
+  Returns the (start, end) spans of the chunks a text of the given length is split into
+  """
+  return [(start, min(start + chunk_length, length)) for start in xrange(0, length, chunk_length)]